@@ -0,0 +1,351 @@
+"""MongoSync 效能測試
+
+在本機 mongod 建立測試資料, 以 MongoSync 執行代表性的處理函式, 輸出 JSON 結果以便比較
+
+    python benchmarks/benchmark.py --sizes 10000 1000000 --shapes small wide
+    python benchmarks/benchmark.py --compare benchmarks/results/上次結果.json
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.basic import MongoSyncFuncBasic
+from src.mongo_pool import MongoConnect
+from src.mongo_sync import MongoSync
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from multiprocessing import get_context
+from time import monotonic
+import argparse
+import json
+import platform
+import pymongo
+import random
+import resource
+import subprocess
+
+
+SEED_CHUNK_SIZE = 10000
+
+
+def generate_document(rnd: random.Random, index: int, shape: str):
+    """生成 測試資料
+
+    Args:
+        rnd (random.Random): 亂數產生器, 固定種子 每次資料相同
+        index (int): 序號
+        shape (str): small: 5 個欄位, wide: 約 60 個欄位 含子文件及陣列
+
+    Returns:
+        dict: 測試資料
+    """
+    data = {
+        'index': index,
+        'name': f'name-{index}',
+        'group': index % 100,
+        'value': rnd.random(),
+        'modified_date': datetime(2024, 1, 1) + timedelta(seconds=index)
+    }
+    if shape == 'wide':
+        for column in range(50):
+            data[f'field_{column}'] = rnd.choice([rnd.randint(0, 10 ** 6), rnd.random(), f'text-{rnd.randint(0, 10 ** 6)}'])
+        data['detail'] = {
+            'title': f'title-{index}',
+            'tags': [f'tag-{rnd.randint(0, 50)}' for _ in range(5)],
+            'stats': {'view': rnd.randint(0, 10 ** 5), 'like': rnd.randint(0, 10 ** 4)}
+        }
+        data['items'] = [{'no': no, 'price': rnd.randint(1, 1000)} for no in range(10)]
+    return data
+
+
+def seed_collection(mongo_client, database: str, collection: str, count: int, shape: str, reseed: bool = False):
+    """建立 測試資料, 筆數相同時不重新建立
+
+    Args:
+        mongo_client (MongoClient): pymongo 連線物件
+        database (str): 資料庫
+        collection (str): 集合
+        count (int): 筆數
+        shape (str): 資料形式
+        reseed (bool, optional): 強制重新建立. Defaults to False.
+
+    Returns:
+        float: 建立秒數, 未重新建立為 0
+    """
+    col = mongo_client[database][collection]
+    if not reseed and col.estimated_document_count() == count:
+        return 0
+    col.drop()
+    start = monotonic()
+    rnd = random.Random(count)
+    for chunk_start in range(0, count, SEED_CHUNK_SIZE):
+        col.insert_many(
+            [generate_document(rnd, index, shape) for index in range(chunk_start, min(chunk_start + SEED_CHUNK_SIZE, count))],
+            ordered=False
+        )
+    col.create_index('index')
+    col.create_index('modified_date')
+    return monotonic() - start
+
+
+class ReadBenchmark(MongoSyncFuncBasic):
+
+    def mongo_func(self, data, **kwargs):
+        """只讀取, 測試 MongoSync 讀取速度
+        """
+        pass
+
+
+class SaveBenchmark(MongoSyncFuncBasic):
+
+    def __init__(self, target_database: str, target_collection: str, log_name: str = 'SaveBenchmark', **kwargs) -> None:
+        """比對後寫入目標集合, 測試 save_to_mongo
+
+        Args:
+            target_database (str): 目標資料庫
+            target_collection (str): 目標集合
+        """
+        super().__init__(log_name, **kwargs)
+        self.target_database = target_database
+        self.target_collection = target_collection
+
+    def mongo_func(self, data, **kwargs):
+        data = dict(data)
+        query = {'index': data['index']}
+        self.save_to_mongo(self.target_database, self.target_collection, data, query=query)
+
+
+WORKLOADS = {
+    # 名稱: (類別, 是否批次寫入)
+    'read': (ReadBenchmark, False),
+    'save': (SaveBenchmark, False),
+    'save_bulk': (SaveBenchmark, True)
+}
+
+
+def get_peak_rss():
+    """取得 記憶體用量最高值 (MB), 需在每次測試獨立的子程序中呼叫 (run_workload_in_process)
+    linux 的 ru_maxrss 在 exec 後保留父程序的最高值, 改用 /proc/self/status 的 VmHWM (只包含這個程序)
+
+    Returns:
+        dict: self: 測試程序, children: 測試程序已結束的子程序 (多程序模式) 中的最高值
+    """
+    # linux 單位為 KB, macOS 為 bytes
+    unit = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit
+    try:
+        with open('/proc/self/status', 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    peak = int(line.split()[1]) / 1024
+                    break
+    except OSError:
+        pass
+    return {
+        'self': peak,
+        'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit
+    }
+
+
+def get_git_commit():
+    """取得 目前 git commit, 無法取得則為 None
+    """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def get_latency_ms(latency: dict):
+    """取得 延遲 p50/p99 (毫秒)
+
+    Args:
+        latency (dict): MongoHistogram.get_stats 的結果
+
+    Returns:
+        dict: p50, p99, 無紀錄則為 None
+    """
+    if not latency or not latency.get('count'):
+        return {'p50': None, 'p99': None}
+    return {'p50': latency['p50'] * 1000, 'p99': latency['p99'] * 1000}
+
+
+def run_workload(mongo_setting: dict, database: str, collection: str, workload: str, args):
+    """以 MongoSync 執行一次測試
+
+    Args:
+        mongo_setting (dict): mongo 連線設定
+        database (str): 資料庫
+        collection (str): 來源集合
+        workload (str): 測試項目
+        args (argparse.Namespace): 參數
+
+    Returns:
+        dict: 測試結果
+    """
+    cls, bulk_write = WORKLOADS[workload]
+    setting = {**mongo_setting, 'log_level': args.log_level}
+    target_collection = None
+    if cls is SaveBenchmark:
+        target_collection = f'{collection}_{workload}'
+        MongoConnect(**mongo_setting).get_mongo_client()[database][target_collection].drop()
+        instance = cls(database, target_collection, **setting)
+    else:
+        instance = cls(**setting)
+    if bulk_write:
+        instance.enable_bulk_write(max_size=args.bulk_size)
+
+    ms = MongoSync(size=args.batch_size, **setting)
+    ms.add_func(
+        instance.mongo_func,
+        database=database,
+        collection=collection,
+        pagination=args.pagination,
+        partitions=args.partitions,
+        sort_key='index' if args.pagination == 'keyset' else '_id'
+    )
+
+    start = monotonic()
+    results = ms.run(workers=args.workers, mode=args.mode)
+    seconds = monotonic() - start
+
+    count = sum(results.values())
+    all_stats = ms.get_stats()
+    stats = all_stats.get(ms.get_metrics_label(instance.mongo_func), {})
+    latency = stats.get('latency', {})
+    # 逐筆寫入 以處理函式紀錄每次寫入, 批次寫入 以 資料庫.集合 紀錄每批寫入 (多程序模式 子程序的寫入不紀錄)
+    write_latency = latency.get('write')
+    if bulk_write and target_collection:
+        write_latency = all_stats.get(f'{database}.{target_collection}', {}).get('latency', {}).get('write')
+    fetch_ms = get_latency_ms(latency.get('fetch'))
+    write_ms = get_latency_ms(write_latency)
+    return {
+        'collection': collection,
+        'workload': workload,
+        'count': count,
+        'seconds': seconds,
+        'docs_per_sec': count / seconds if seconds > 0 else 0,
+        'batch_fetch_p50_ms': fetch_ms['p50'],
+        'batch_fetch_p99_ms': fetch_ms['p99'],
+        'write_p50_ms': write_ms['p50'],
+        'write_p99_ms': write_ms['p99'],
+        'latency': latency,
+        'write_latency': write_latency,
+        'counters': stats.get('counters', {}),
+        'peak_rss_mb': get_peak_rss()
+    }
+
+
+def run_workload_in_process(mongo_setting: dict, database: str, collection: str, workload: str, args):
+    """在獨立子程序 (spawn) 執行一次測試, 記憶體用量最高值只包含這次測試
+
+    Args:
+        參數同 run_workload
+
+    Returns:
+        dict: 測試結果
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+        return executor.submit(run_workload, mongo_setting, database, collection, workload, args).result()
+
+
+def format_ms(value):
+    """毫秒 顯示格式, 無紀錄為 -
+    """
+    return '-' if value is None else f'{value:.1f}'
+
+
+
+def compare_results(previous: dict, current: dict):
+    """比較 兩次結果的處理速度
+
+    Args:
+        previous (dict): 上次結果
+        current (dict): 本次結果
+
+    Returns:
+        list: 每個測試項目一行比較
+    """
+    previous_results = {(item['collection'], item['workload']): item for item in previous.get('results', [])}
+    lines = []
+    for item in current['results']:
+        old = previous_results.get((item['collection'], item['workload']))
+        if not old or not old['docs_per_sec']:
+            continue
+        change = (item['docs_per_sec'] - old['docs_per_sec']) / old['docs_per_sec'] * 100
+        lines.append(f'{item["collection"]} {item["workload"]}: {old["docs_per_sec"]:.0f} -> {item["docs_per_sec"]:.0f} 筆/秒 ({change:+.1f}%)')
+    return lines
+
+
+def parse_args(argv: list = None):
+    parser = argparse.ArgumentParser(description='MongoSync 效能測試')
+    parser.add_argument('--mongo-host', default='127.0.0.1')
+    parser.add_argument('--mongo-port', default='27017')
+    parser.add_argument('--database', default='benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000], help='測試資料筆數 ex: 10000 1000000 10000000')
+    parser.add_argument('--shapes', nargs='+', default=['small', 'wide'], choices=['small', 'wide'])
+    parser.add_argument('--workloads', nargs='+', default=list(WORKLOADS.keys()), choices=list(WORKLOADS.keys()))
+    parser.add_argument('--mode', default='thread', choices=['thread', 'process'])
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--partitions', type=int, default=1)
+    parser.add_argument('--pagination', default='keyset', choices=['skip', 'keyset'])
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--bulk-size', type=int, default=1000)
+    parser.add_argument('--reseed', action='store_true', help='重新建立測試資料')
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--output', default=None, help='結果檔案, 預設 benchmarks/results/時間.json')
+    parser.add_argument('--compare', default=None, help='與上次結果比較')
+    return parser.parse_args(argv)
+
+
+def main(argv: list = None):
+    args = parse_args(argv)
+    mongo_setting = {
+        'mongo_host': args.mongo_host,
+        'mongo_port': args.mongo_port
+    }
+    mongo_client = MongoConnect(**mongo_setting).get_mongo_client()
+
+    report = {
+        'started': datetime.now().isoformat(),
+        'commit': get_git_commit(),
+        'python': platform.python_version(),
+        'pymongo': pymongo.version,
+        'settings': vars(args),
+        'seed_seconds': {},
+        'results': []
+    }
+    for size in args.sizes:
+        for shape in args.shapes:
+            collection = f'{shape}_{size}'
+            report['seed_seconds'][collection] = seed_collection(mongo_client, args.database, collection, size, shape, args.reseed)
+            for workload in args.workloads:
+                result = run_workload_in_process(mongo_setting, args.database, collection, workload, args)
+                report['results'].append(result)
+                print(f'{collection} {workload}: {result["count"]} 筆 {result["seconds"]:.2f} 秒 {result["docs_per_sec"]:.0f} 筆/秒 '
+                      f'fetch p50/p99: {format_ms(result["batch_fetch_p50_ms"])}/{format_ms(result["batch_fetch_p99_ms"])} ms '
+                      f'write p50/p99: {format_ms(result["write_p50_ms"])}/{format_ms(result["write_p99_ms"])} ms '
+                      f'peak rss: {result["peak_rss_mb"]["self"]:.0f} MB')
+
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', f'{datetime.now():%Y%m%d_%H%M%S}.json')
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+    print(f'結果: {output}')
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            for line in compare_results(json.load(f), report):
+                print(line)
+    return report
+
+
+if __name__ == "__main__":
+    main()
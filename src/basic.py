@@ -1,8 +1,20 @@
 from src.mongo_func import MongoSyncFunc
 from src.mongo_pool import MongoConnect
+from src.mongo_bulk import MongoBulkWriter
+from src.mongo_matcher import MongoQueryMatcher
+from src.mongo_index import index_registry
 from src.logger import Log
 
+from collections import Counter
+from collections.abc import Mapping
+from concurrent.futures import Future
 from datetime import datetime
+from threading import Lock
+from time import monotonic
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+import bson
+import hashlib
 
 
 class TestBasic():
@@ -46,6 +58,9 @@ class TestBasic():
 
 class MongoFuncBasic(TestBasic):
 
+    # 批次寫入類別
+    bulk_writer_class = MongoBulkWriter
+
     def __init__(self, log_name: str = 'MongoFuncBasic', **kwargs) -> None:
         """不包含 Mongo Sync Func 類別
         基本測試功能
@@ -62,7 +77,247 @@ class MongoFuncBasic(TestBasic):
             mongo_client (MongoClient) : pymongo 連線物件
         """
         super().__init__(log_name, **kwargs)
-        self.mongo_client = MongoConnect(**kwargs).get_mongo_client()
+        # 保留連線設定, 多程序模式 子程序需重新建立連線
+        self.mongo_setting = {
+            key: kwargs[key] for key in ['name', 'mongo_host', 'mongo_port', 'mongo_username', 'mongo_password', 'log_level']
+            if key in kwargs
+        }
+        self.mongo_client = self.create_mongo_client()
+        self.bulk_writer = None
+        self.bulk_write_setting = None
+        self.matcher = MongoQueryMatcher()
+        self.fingerprint_field = None
+        self.delta_update = False
+        self.field_changes = Counter()
+        self.field_changes_lock = Lock()
+        # 執行前建立的索引 [(database, collection, index_names)]
+        self.index_settings = []
+        # 已確認的索引 {(database, collection, repr(index_names))}, 寫入時不再檢查
+        self.ensured_indexes = set()
+        self.metrics = None
+        self.write_governor = None
+
+    def __getstate__(self):
+        """pickle 序列化 (多程序模式), 連線物件不序列化
+        """
+        state = self.__dict__.copy()
+        state['mongo_client'] = None
+        state['bulk_writer'] = None
+        state['field_changes_lock'] = None
+        state['metrics'] = None
+        state['write_governor'] = None
+        # 子程序重新建立連線 需重新確認索引
+        state['ensured_indexes'] = set()
+        return state
+
+    def __setstate__(self, state: dict):
+        """pickle 反序列化 (多程序模式), 重新建立連線
+        """
+        self.__dict__.update(state)
+        self.logger.set_msg_handler()
+        self.field_changes_lock = Lock()
+        self.mongo_client = self.create_mongo_client()
+        if self.bulk_write_setting:
+            self.enable_bulk_write(**self.bulk_write_setting)
+
+    def create_mongo_client(self):
+        """依 mongo_setting 建立 mongo 連線
+
+        Returns:
+            MongoClient: pymongo 連線物件
+        """
+        return MongoConnect(**self.mongo_setting).get_mongo_client()
+
+    def enable_bulk_write(self, max_size: int = 1000, max_bytes: int = 8 * 1024 * 1024, max_seconds: float = 1.0):
+        """啟用 批次寫入
+        save_to_mongo 改為暫存寫入操作, 達到上限時以 unordered bulk_write 寫入,
+        並回傳 Future (寫入成功為 True, 無變化為 False)
+
+        Args:
+            max_size (int, optional): 每批最多筆數. Defaults to 1000.
+            max_bytes (int, optional): 每批最大位元組. Defaults to 8 * 1024 * 1024 (8M).
+            max_seconds (float, optional): 資料最長暫存秒數. Defaults to 1.0.
+        """
+        self.bulk_write_setting = {
+            'max_size': max_size,
+            'max_bytes': max_bytes,
+            'max_seconds': max_seconds
+        }
+        self.bulk_writer = self.bulk_writer_class(
+            self.mongo_client,
+            log_level=self.log_level,
+            metrics=self.metrics,
+            write_governor=self.write_governor,
+            **self.bulk_write_setting
+        )
+
+    def flush_bulk_write(self):
+        """寫入 批次寫入的全部暫存資料
+        """
+        if self.bulk_writer:
+            self.bulk_writer.close()
+
+    def set_metrics(self, metrics):
+        """設定 統計, 紀錄 save_to_mongo 新增、更新、無變化筆數及寫入延遲
+        MongoSync.add_func 會自動設定
+
+        Args:
+            metrics (MongoMetrics): 統計
+        """
+        self.metrics = metrics
+        if self.bulk_writer:
+            self.bulk_writer.metrics = metrics
+
+    def set_write_governor(self, write_governor):
+        """設定 寫入速率限制, save_to_mongo、save_many_to_mongo 及批次寫入 寫入前依速率等待
+        MongoSync.set_write_governor 會自動設定, 多程序模式的子程序不限制
+
+        Args:
+            write_governor (WriteGovernor): 寫入速率限制
+        """
+        self.write_governor = write_governor
+        if self.bulk_writer:
+            self.bulk_writer.write_governor = write_governor
+
+    def acquire_write(self, documents: list):
+        """寫入前 依寫入速率限制等待
+
+        Args:
+            documents (list): 寫入內容, 有位元組限制時計算大小
+        """
+        if self.write_governor is None:
+            return
+        nbytes = sum(len(bson.encode(document)) for document in documents) if self.write_governor.bytes_per_sec else 0
+        self.write_governor.acquire(len(documents), nbytes)
+
+    def observe_write(self, start: float, count: int = 1, error: bool = False):
+        """紀錄 寫入延遲, 調整寫入速率
+
+        Args:
+            start (float): 寫入開始時間 (monotonic)
+            count (int, optional): 寫入筆數. Defaults to 1.
+            error (bool, optional): 是否寫入錯誤. Defaults to False.
+        """
+        if self.write_governor is not None:
+            self.write_governor.observe(monotonic() - start, count, error=error)
+
+    def record_operation(self, operation, count: int = 1):
+        """紀錄 寫入操作類型
+
+        Args:
+            operation (InsertOne | UpdateOne | None): 寫入操作
+            count (int, optional): 筆數. Defaults to 1.
+        """
+        if self.metrics is None:
+            return
+        if operation is None:
+            name = 'unchanged'
+        elif isinstance(operation, UpdateOne):
+            name = 'updated'
+        else:
+            name = 'inserted'
+        self.metrics.inc(self.metrics.get_label(self.__class__.__name__), name, count)
+
+    def record_metric(self, name: str, start: float = None, value: int = 1):
+        """紀錄 延遲 (有 start) 或 計數
+
+        Args:
+            name (str): 項目
+            start (float, optional): 開始時間 monotonic(). Defaults to None.
+            value (int, optional): 計數增加數量. Defaults to 1.
+        """
+        if self.metrics is None:
+            return
+        label = self.metrics.get_label(self.__class__.__name__)
+        if start is None:
+            self.metrics.inc(label, name, value)
+        else:
+            self.metrics.observe(label, name, monotonic() - start)
+
+    def enable_fingerprint(self, field: str = '_fingerprint'):
+        """啟用 指紋比對
+        儲存時計算資料的雜湊值 並存入目標資料的 field 欄位,
+        比對時只取回舊資料的 field 欄位, 不需取回完整舊資料
+        數值依 has_change 的比較方式正規化 (1 == 1.0, 0 == False),
+        資料無法以 BSON 編碼時 不計算指紋, 改用一般比對 (舊資料只有指紋欄位 因此視為有更改)
+        建議建立 查詢欄位 + field 的複合索引
+
+        Args:
+            field (str, optional): 指紋欄位名稱. Defaults to '_fingerprint'.
+        """
+        self.fingerprint_field = field
+
+    def get_old_data_projection(self):
+        """取得 舊資料的 projection, 指紋比對時 只需指紋欄位
+
+        Returns:
+            dict: projection, None 為全部欄位
+        """
+        if self.fingerprint_field:
+            return {self.fingerprint_field: 1}
+        return None
+
+    def canonicalize(self, value):
+        """將資料轉為固定順序 (dict 依 key 排序), 計算指紋用
+
+        Args:
+            value (_type_): 資料
+
+        Returns:
+            _type_: 固定順序的資料
+        """
+        if isinstance(value, dict):
+            return {key: self.canonicalize(value[key]) for key in sorted(value.keys())}
+        if isinstance(value, (list, tuple)):
+            return [self.canonicalize(item) for item in value]
+        if isinstance(value, bool):
+            # 與 has_change 相同 False == 0, True == 1
+            return int(value)
+        if isinstance(value, float) and value.is_integer() and abs(value) < 2 ** 63:
+            # 與 has_change 相同 1 == 1.0
+            return int(value)
+        return value
+
+    def generate_fingerprint(self, data: dict, columns: list = [], exclude_columns: list = []):
+        """計算 資料指紋
+        比對欄位與 has_change 相同: data 的欄位及 columns, 排除 exclude_columns
+
+        Args:
+            data (dict): 資料
+            columns (list, optional): 指定比對的欄位. Defaults to [].
+            exclude_columns (list, optional): 指定排除比對的欄位. Defaults to [].
+
+        Returns:
+            str: 指紋, 資料無法編碼時為 None
+        """
+        excludes = set(exclude_columns) | {'_id', 'creation_date', 'modified_date', self.fingerprint_field}
+        keys = (set(data.keys()) | set(columns or [])) - excludes
+        content = self.canonicalize({key: data.get(key) for key in keys})
+        try:
+            return hashlib.blake2b(bson.encode(content), digest_size=16).hexdigest()
+        except Exception as err:
+            self.logger.warning(f'計算指紋 發生錯誤, 改用一般比對: {err}')
+            return None
+
+    def generate_future(self, result=None, err: Exception = None, callback=None) -> Future:
+        """生成 已完成的 Future, 批次寫入模式下 未寫入的結果使用
+
+        Args:
+            result (optional): 結果. Defaults to None.
+            err (Exception, optional): 錯誤. Defaults to None.
+            callback (optional): 完成後呼叫 callback(future). Defaults to None.
+
+        Returns:
+            Future: _description_
+        """
+        future = Future()
+        if err:
+            future.set_exception(err)
+        else:
+            future.set_result(result)
+        if callback:
+            callback(future)
+        return future
 
     def has_change(self, old_data: dict, new_data: dict, columns: list = [], exclude_columns: list = []):
         """資料是否有更改
@@ -79,32 +334,32 @@ class MongoFuncBasic(TestBasic):
         try:
             # self.logger.debug(f'舊資料: {old_data} 新資料: {new_data}')
             if len(columns) > 0:
-                self.logger.debug(f'指定比對欄位 {columns}')
+                self.logger.debug('指定比對欄位 %s', columns)
                 for column_name in columns:
                     if column_name not in exclude_columns:
                         if old_data.get(column_name) or old_data.get(column_name) == False:
                             if old_data.get(column_name) != new_data.get(column_name):
-                                self.logger.debug(f'{column_name} 舊資料: {old_data.get(column_name)} 新資料: {new_data.get(column_name)}')
+                                self.logger.debug('%s 舊資料: %s 新資料: %s', column_name, old_data.get(column_name), new_data.get(column_name))
                                 return True
                             else:
-                                self.logger.debug(f'{column_name} 無變化')
+                                self.logger.debug('%s 無變化', column_name)
                         else:
                             if column_name not in old_data.keys():
-                                self.logger.debug(f'舊資料 不存在{column_name}')
+                                self.logger.debug('舊資料 不存在%s', column_name)
                                 return True
 
             for column_name, new_value in new_data.items():
                 if column_name not in exclude_columns:
                     if old_data.get(column_name) or old_data.get(column_name) == False:
                         if old_data.get(column_name) != new_value:
-                            self.logger.debug(f'{column_name} 舊資料: {old_data.get(column_name)} 新資料: {new_value}')
+                            self.logger.debug('%s 舊資料: %s 新資料: %s', column_name, old_data.get(column_name), new_value)
                             return True
                         else:
-                            self.logger.debug(f'{column_name} 無變化')
+                            self.logger.debug('%s 無變化', column_name)
                     else:
                         # 沒有 column_name
                         if column_name not in old_data.keys():
-                            self.logger.debug(f'舊資料 不存在{column_name}')
+                            self.logger.debug('舊資料 不存在%s', column_name)
                             return True
 
             return False
@@ -112,6 +367,237 @@ class MongoFuncBasic(TestBasic):
             self.logger.error(f'檢查資料是否更動 發生錯誤: {err}\n檢查欄位: {columns}\n排除欄位: {exclude_columns}\n新資料: {new_data}\n舊資料: {old_data}', exc_info=True)
             return True
 
+    def enable_delta_update(self):
+        """啟用 欄位差異更新
+        更新時只 $set 有變化的欄位路徑 (包含子文件及陣列元素), 子文件中移除的欄位以 $unset 移除,
+        不再 $set 整份資料, 減少 oplog 大小及寫入量
+        比對只依 data 內的欄位, 有指定 check_colunms 時只比對及 $set 指定欄位,
+        指定移除 (unset) 的欄位 其下的路徑不會再 $set, 避免路徑衝突
+        指紋比對模式 (enable_fingerprint) 沒有舊資料內容, 仍 $set 整份資料
+        """
+        self.delta_update = True
+
+    def is_diffable(self, value):
+        """子文件的欄位名稱 是否可作為更新路徑
+
+        Args:
+            value (Mapping): 子文件
+
+        Returns:
+            bool: 是否可作為更新路徑
+        """
+        for key in value.keys():
+            if not isinstance(key, str) or key == '' or '.' in key or key.startswith('$'):
+                return False
+        return True
+
+    def is_sub_path(self, path: str, parents: list):
+        """欄位路徑 是否為 parents 中任一路徑 或其子路徑 (ex: a.b 為 a 的子路徑)
+
+        Args:
+            path (str): 欄位路徑
+            parents (list): 欄位路徑
+
+        Returns:
+            bool: _description_
+        """
+        return any(path == parent or path.startswith(f'{parent}.') for parent in parents)
+
+    def diff_value(self, old_value, new_value, path: str, set_data: dict, unset_paths: list):
+        """比對 單一欄位的新舊值, 將有變化的路徑加入 set_data, unset_paths
+
+        Args:
+            old_value (_type_): 舊值
+            new_value (_type_): 新值
+            path (str): 欄位路徑
+            set_data (dict): {路徑: 新值}
+            unset_paths (list): 需移除的路徑
+        """
+        if isinstance(old_value, Mapping) and isinstance(new_value, Mapping) \
+                and len(new_value) > 0 and self.is_diffable(new_value) and self.is_diffable(old_value):
+            for key, value in new_value.items():
+                if key in old_value:
+                    self.diff_value(old_value[key], value, f'{path}.{key}', set_data, unset_paths)
+                else:
+                    set_data[f'{path}.{key}'] = value
+            for key in old_value.keys():
+                if key not in new_value:
+                    unset_paths.append(f'{path}.{key}')
+        elif isinstance(old_value, list) and isinstance(new_value, list) \
+                and len(old_value) == len(new_value) and len(new_value) > 0:
+            # 長度相同 逐一比對元素, 長度不同則整個陣列更新
+            for index, value in enumerate(new_value):
+                self.diff_value(old_value[index], value, f'{path}.{index}', set_data, unset_paths)
+        elif old_value != new_value:
+            # 與 has_change 相同的比對方式 (ex: 1 與 1.0 視為相同)
+            set_data[path] = new_value
+
+    def diff_changes(self, old_data: dict, new_data: dict):
+        """比對新舊資料 取得有變化的欄位路徑
+        舊資料有但新資料沒有的最上層欄位 與 $set 整份資料相同 不移除
+
+        Args:
+            old_data (dict): 舊資料
+            new_data (dict): 新資料
+
+        Returns:
+            tuple: ({路徑: 新值}, [需移除的路徑])
+        """
+        set_data = {}
+        unset_paths = []
+        for column_name, new_value in new_data.items():
+            if column_name == '_id':
+                continue
+            if column_name in old_data:
+                self.diff_value(old_data[column_name], new_value, column_name, set_data, unset_paths)
+            else:
+                set_data[column_name] = new_value
+        return set_data, unset_paths
+
+    def record_field_changes(self, paths: list):
+        """累計 欄位變化次數, 陣列索引以 $ 表示
+
+        Args:
+            paths (list): 有變化的欄位路徑
+        """
+        names = [
+            '.'.join('$' if part.isdigit() else part for part in path.split('.'))
+            for path in paths
+        ]
+        with self.field_changes_lock:
+            self.field_changes.update(names)
+
+    def get_field_changes(self):
+        """取得 欄位變化次數
+
+        Returns:
+            dict: {欄位路徑: 次數}, 依次數排序
+        """
+        with self.field_changes_lock:
+            return dict(self.field_changes.most_common())
+
+    def generate_operation(self, database: str, collection: str, data: dict, old_data: dict = None, unset: list = None, query: dict = {}, check_colunms: list = [], exclude_columns: list = ['modified_date']):
+        """比對新舊資料 生成寫入操作
+
+        Args:
+            database (str): 指定資料庫名稱.
+            collection (str): 指定集合名稱.
+            data (dict): 新增或更新資料
+            old_data (dict, optional): 舊資料, 不存在則為 None. Defaults to None.
+            unset (list, optional): 移除欄位 名稱. Defaults to None.
+            query (dict, optional): 更新資料時的查詢條件. Defaults to {}.
+            check_colunms (list, optional): 更新時 只檢查指定欄位是否更改. Defaults to [].
+            exclude_columns (list, optional): 指定排除比對的欄位. Defaults to ['modified_date'].
+
+        Returns:
+            InsertOne | UpdateOne | None: 寫入操作, 無變化則為 None
+        """
+        fingerprint = None
+        if self.fingerprint_field:
+            fingerprint = self.generate_fingerprint(data, columns=check_colunms, exclude_columns=exclude_columns)
+            data[self.fingerprint_field] = fingerprint
+
+        if len(query) > 0 and old_data:
+            update_query = {}
+            if unset:
+                unset_data = {}
+                for filed in unset:
+                    unset_data[filed] = 1
+                update_query['$unset'] = unset_data
+            data['modified_date'] = datetime.now()
+            if data.get('_id'):
+                del data['_id']
+            update_query['$set'] = data
+            if not self.test:
+                if fingerprint is not None:
+                    is_change = old_data.get(self.fingerprint_field) != fingerprint
+                    if not is_change:
+                        self.logger.debug('指紋無變化 %s', fingerprint)
+                elif self.delta_update:
+                    diff_data = data
+                    if isinstance(check_colunms, list) and len(check_colunms) > 0:
+                        # 只比對指定欄位
+                        diff_data = {key: value for key, value in data.items() if key in check_colunms}
+                    set_data, unset_paths = self.diff_changes(old_data, diff_data)
+                    if unset:
+                        # 指定移除的欄位 其下的路徑不可同時 $set 或 $unset (path conflict)
+                        set_data = {path: value for path, value in set_data.items() if not self.is_sub_path(path, unset)}
+                        unset_paths = [path for path in unset_paths if not self.is_sub_path(path, unset)]
+                    changed_paths = [
+                        path for path in list(set_data.keys()) + unset_paths
+                        if path.split('.')[0] not in exclude_columns
+                    ]
+                    is_change = len(changed_paths) > 0
+                    if is_change:
+                        self.logger.debug('變化欄位: %s', changed_paths)
+                        self.record_field_changes(changed_paths)
+                        set_data['modified_date'] = data['modified_date']
+                        update_query['$set'] = set_data
+                        unset_data = update_query.get('$unset', {})
+                        for path in unset_paths:
+                            unset_data[path] = 1
+                        if unset_data:
+                            update_query['$unset'] = unset_data
+                elif isinstance(check_colunms, list) and len(check_colunms) > 0:
+                    is_change = self.has_change(
+                        old_data=old_data,
+                        new_data=data,
+                        columns=check_colunms,
+                        exclude_columns=exclude_columns
+                    )
+                else:
+                    is_change = self.has_change(
+                        old_data=old_data,
+                        new_data=data,
+                        exclude_columns=exclude_columns
+                    )
+
+                if is_change:
+                    self.logger.info('更新資料 mongodb %s.%s 查詢條件: %s', database, collection, query)
+                    self.logger.debug('內容: %s', update_query)
+                    return UpdateOne(query, update_query)
+            return None
+        else:
+            data['creation_date'] = datetime.now()
+            data['modified_date'] = datetime.now()
+            self.logger.info('新增資料 mongodb %s.%s', database, collection)
+            self.logger.debug('內容: %s', data)
+            return InsertOne(data)
+
+    def create_indexes(self, database: str, collection: str, index_names: list = []):
+        """建立索引 若不存在則建立
+        同一組索引只確認一次, 之後的寫入直接略過;
+        已存在的索引由 index_registry 快取, 每個集合只讀取一次 index_information
+
+        Args:
+            database (str): 指定資料庫名稱.
+            collection (str): 指定集合名稱.
+            index_names (list, optional): 索引欄位. Defaults to [].
+        """
+        if len(index_names) == 0:
+            return
+        key = (database, collection, repr(index_names))
+        if key in self.ensured_indexes:
+            return
+        index_registry.ensure_indexes(self.mongo_client, database, collection, index_names, test=self.test)
+        self.ensured_indexes.add(key)
+
+    def register_indexes(self, database: str, collection: str, index_names: list = []):
+        """登記 需要的索引, MongoSync 執行前建立, 不在寫入時檢查
+
+        Args:
+            database (str): 指定資料庫名稱.
+            collection (str): 指定集合名稱.
+            index_names (list, optional): 索引欄位. Defaults to [].
+        """
+        self.index_settings.append((database, collection, index_names))
+
+    def ensure_registered_indexes(self):
+        """建立 登記的索引 若不存在則建立
+        """
+        for database, collection, index_names in self.index_settings:
+            self.create_indexes(database, collection, index_names)
+
     def save_to_mongo(self, database: str, collection: str, data: dict, unset: list = None, index_names: list = [], query: dict = {}, check_colunms: list = [], exclude_columns: list = ['modified_date'], **kwargs):
         """儲存資料至mongo
 
@@ -125,14 +611,19 @@ class MongoFuncBasic(TestBasic):
             exclude_columns (list, optional): 指定排除比對的欄位. Defaults to ['modified_date'].
             check_colunm (list[str], optional): 更新時 只檢查指定欄位是否更改. Defaults to [].
             name: 顯示辨識用名稱
+            callback: 批次寫入模式 寫入完成後呼叫 callback(future)
+
+        Returns:
+            bool: 是否新增或更新, 批次寫入模式下回傳 Future
         """
+        callback = kwargs.get('callback')
         try:
             name = kwargs.get('name', None)
 
             if name:
-                self.logger.info(f'儲存資料 {name} 至mongo {database} {collection}')
+                self.logger.info('儲存資料 %s 至mongo %s %s', name, database, collection)
             else:
-                self.logger.info(f'儲存資料至mongo {database} {collection}')
+                self.logger.info('儲存資料至mongo %s %s', database, collection)
             # 更新或新增 則設定成 True
             data_changes = False
 
@@ -140,60 +631,312 @@ class MongoFuncBasic(TestBasic):
             if data.get('_id'):
                 del data['_id']
 
-            old_data = col.find_one(query)
-
-            if len(query) > 0 and old_data:
-                update_query = {}
-                if unset:
-                    unset_data = {}
-                    for filed in unset:
-                        unset_data[filed] = 1
-                    update_query['$unset'] = unset_data
-                data['modified_date'] = datetime.now()
-                if data.get('_id'):
-                    del data['_id']
-                update_query['$set'] = data
-                if not self.test:
-                    if isinstance(check_colunms, list) and len(check_colunms) > 0:
-                        is_change = self.has_change(
-                            old_data=old_data,
-                            new_data=data,
-                            columns=check_colunms,
-                            exclude_columns=exclude_columns
-                        )
-                    else:
-                        is_change = self.has_change(
-                            old_data=old_data,
-                            new_data=data,
-                            exclude_columns=exclude_columns
-                        )
+            # 批次寫入模式 相同查詢條件尚未寫入時 需先寫入 才能取得舊資料
+            if self.bulk_writer and len(query) > 0 and self.bulk_writer.is_pending(database, collection, query):
+                self.bulk_writer.flush(database, collection)
 
-                    if is_change:
-                        self.logger.info(f'更新資料 mongodb {database}.{collection} 查詢條件: {query}')
-                        self.logger.debug(f'內容: {update_query}')
-                        col.update_one(query, update_query)
-                        data_changes = True
-            else:
-                data['creation_date'] = datetime.now()
-                data['modified_date'] = datetime.now()
-                self.logger.info(f'新增資料 mongodb {database}.{collection}')
-                self.logger.debug(f'內容: {data}')
-                if not self.test:
-                    col.insert_one(data)
+            old_data = col.find_one(query, self.get_old_data_projection())
+
+            operation = self.generate_operation(
+                database,
+                collection,
+                data,
+                old_data=old_data,
+                unset=unset,
+                query=query,
+                check_colunms=check_colunms,
+                exclude_columns=exclude_columns
+            )
+            self.record_operation(operation)
+            if operation is not None and not self.test:
+                if self.bulk_writer:
+                    data_changes = self.bulk_writer.add(
+                        database,
+                        collection,
+                        operation,
+                        document=operation._doc,
+                        query=query,
+                        callback=callback
+                    )
+                else:
+                    self.acquire_write([operation._doc])
+                    start = monotonic()
+                    if isinstance(operation, UpdateOne):
+                        col.update_one(query, operation._doc)
+                    else:
+                        col.insert_one(data)
+                    self.record_metric('write', start)
+                    self.observe_write(start)
                     data_changes = True
 
-            if len(index_names) > 0:
-                self.logger.info(f'新增 index {database}.{collection}')
-                self.logger.debug(f'內容: {index_names}')
-                existing_indexes = col.index_information()
-                for index_name in index_names:
-                    if index_name not in existing_indexes:
-                        if not self.test:
-                            col.create_index(index_name)
+            self.create_indexes(database, collection, index_names)
 
+            if self.bulk_writer and not isinstance(data_changes, Future):
+                return self.generate_future(data_changes, callback=callback)
             return data_changes
         except Exception as err:
             self.logger.error(f'儲存資料至mongo 發生錯誤: {err}', exc_info=True)
+            self.record_metric('errors')
+            if self.bulk_writer:
+                return self.generate_future(err=err, callback=callback)
+
+    def group_old_data_queries(self, queries: list):
+        """依查詢欄位 將相等比對的查詢條件分組
+
+        Args:
+            queries (list[dict]): 查詢條件
+
+        Returns:
+            tuple: ({('comic_id',): [index, ...]}, [非相等比對的 index])
+        """
+        groups = {}
+        others = []
+        for index, query in enumerate(queries):
+            if len(query) == 0:
+                continue
+            if self.matcher.is_equality(query):
+                groups.setdefault(tuple(sorted(query.keys())), []).append(index)
+            else:
+                others.append(index)
+        return groups, others
+
+    def generate_old_data_fetches(self, queries: list, groups: dict, chunk_size: int = 1000, projection: dict = None):
+        """生成 取得舊資料的查詢, 全部查詢條件為同一欄位時使用 $in, 否則使用 $or
+
+        Args:
+            queries (list[dict]): 查詢條件
+            groups (dict): group_old_data_queries 的分組
+            chunk_size (int, optional): 每次查詢最多條件數. Defaults to 1000.
+            projection (dict, optional): 回傳欄位, 會加入查詢欄位以便對應. Defaults to None.
+
+        Yields:
+            tuple: (查詢欄位, 這次查詢的 index, 查詢條件, projection)
+        """
+        for fields, indexes in groups.items():
+            for chunk_start in range(0, len(indexes), chunk_size):
+                chunk = indexes[chunk_start:chunk_start + chunk_size]
+                if len(fields) == 1:
+                    values = [queries[index][fields[0]] for index in chunk]
+                    fetch_query = {fields[0]: {'$in': values}}
+                else:
+                    fetch_query = {'$or': [queries[index] for index in chunk]}
+                fetch_projection = None
+                if projection:
+                    fetch_projection = {**projection, **{field: 1 for field in fields}}
+                yield fields, chunk, fetch_query, fetch_projection
+
+    def map_old_datas(self, queries: list, fields: tuple, chunk: list, datas: list, old_datas: list):
+        """將查詢結果 對應回各查詢條件
+
+        Args:
+            queries (list[dict]): 查詢條件
+            fields (tuple): 查詢欄位
+            chunk (list): 這次查詢的 index
+            datas (list): 查詢結果
+            old_datas (list): 與 queries 順序相同的舊資料, 對應結果寫入此 list
+        """
+        try:
+            mapping = {}
+            for data in datas:
+                key = tuple(self.matcher.get_value(data, field) for field in fields)
+                mapping.setdefault(key, data)
+            for index in chunk:
+                old_datas[index] = mapping.get(tuple(queries[index][field] for field in fields))
+        except TypeError:
+            # 欄位值無法作為 key (ex: dict, list), 改為逐筆比對
+            for index in chunk:
+                for data in datas:
+                    if self.matcher.match(data, queries[index]):
+                        old_datas[index] = data
+                        break
+
+    def get_old_datas(self, database: str, collection: str, queries: list, chunk_size: int = 1000, projection: dict = None):
+        """以單次查詢取得多筆查詢條件的舊資料
+
+        全部查詢條件為同一欄位時使用 $in, 否則使用 $or
+        非相等比對的查詢條件 無法在記憶體中對應, 改為逐筆 find_one
+
+        Args:
+            database (str): 指定資料庫名稱.
+            collection (str): 指定集合名稱.
+            queries (list[dict]): 查詢條件
+            chunk_size (int, optional): 每次查詢最多條件數. Defaults to 1000.
+            projection (dict, optional): 回傳欄位, 會加入查詢欄位以便對應. Defaults to None.
+
+        Returns:
+            list: 與 queries 順序相同的舊資料, 不存在則為 None
+        """
+        col = self.mongo_client[database][collection]
+        old_datas = [None] * len(queries)
+
+        groups, others = self.group_old_data_queries(queries)
+        for index in others:
+            old_datas[index] = col.find_one(queries[index], projection)
+
+        for fields, chunk, fetch_query, fetch_projection in self.generate_old_data_fetches(queries, groups, chunk_size, projection):
+            self.map_old_datas(queries, fields, chunk, list(col.find(fetch_query, fetch_projection)), old_datas)
+        return old_datas
+
+    def generate_operations(self, database: str, collection: str, items: list, old_datas: list, unset: list = None, check_colunms: list = [], exclude_columns: list = ['modified_date']):
+        """比對多筆新舊資料 生成寫入操作
+        同批次內 重複的查詢條件 需等前一筆寫入後 再逐筆儲存
+
+        Args:
+            database (str): 指定資料庫名稱.
+            collection (str): 指定集合名稱.
+            items (list[tuple[dict, dict]]): (查詢條件, 資料)
+            old_datas (list): 與 items 順序相同的舊資料
+            unset (list, optional): 移除欄位 名稱. Defaults to None.
+            check_colunms (list, optional): 更新時 只檢查指定欄位是否更改. Defaults to [].
+            exclude_columns (list, optional): 指定排除比對的欄位. Defaults to ['modified_date'].
+
+        Returns:
+            tuple: (寫入操作, 寫入操作對應的 index, 重複查詢條件的 index)
+        """
+        operations = []
+        operation_indexes = []
+        seen_queries = set()
+        duplicates = []
+        for index, ((query, data), old_data) in enumerate(zip(items, old_datas)):
+            if data.get('_id'):
+                del data['_id']
+
+            if len(query) > 0:
+                key = self.matcher.generate_key(query)
+                if key in seen_queries:
+                    duplicates.append(index)
+                    continue
+                seen_queries.add(key)
+
+            operation = self.generate_operation(
+                database,
+                collection,
+                data,
+                old_data=old_data,
+                unset=unset,
+                query=query,
+                check_colunms=check_colunms,
+                exclude_columns=exclude_columns
+            )
+            self.record_operation(operation)
+            if operation is not None and not self.test:
+                operations.append(operation)
+                operation_indexes.append(index)
+        return operations, operation_indexes, duplicates
+
+    def record_bulk_write_errors(self, err: BulkWriteError, items: list, operation_indexes: list, results: list):
+        """紀錄 bulk_write 各筆寫入錯誤, 錯誤的資料結果設為 None
+
+        Args:
+            err (BulkWriteError): 寫入錯誤
+            items (list[tuple[dict, dict]]): (查詢條件, 資料)
+            operation_indexes (list): 寫入操作對應的 index
+            results (list): 每筆資料的結果
+        """
+        for write_error in err.details.get('writeErrors', []):
+            index = operation_indexes[write_error['index']]
+            results[index] = None
+            self.logger.error(f'儲存資料至mongo 發生錯誤: {write_error.get("errmsg")}\n內容: {items[index][1]}')
+            self.record_metric('errors')
+
+    def save_many_to_mongo(self, database: str, collection: str, items: list, unset: list = None, index_names: list = [], check_colunms: list = [], exclude_columns: list = ['modified_date'], **kwargs):
+        """批次儲存資料至mongo
+        以單次查詢取得全部舊資料, 比對後只寫入有變化的資料
+
+        Args:
+            database (str): 指定資料庫名稱.
+            collection (str): 指定集合名稱.
+            items (list[tuple[dict, dict]]): (查詢條件, 資料) ex: [({'comic_id': 1}, {'comic_id': 1, 'name': 'a'})]
+            unset (list, optional): 移除欄位 名稱. Defaults to None.
+            index_names (list, optional): 索引欄位 若不存在則建立索引. Defaults to [].
+            check_colunms (list[str], optional): 更新時 只檢查指定欄位是否更改. Defaults to [].
+            exclude_columns (list, optional): 指定排除比對的欄位. Defaults to ['modified_date'].
+            name: 顯示辨識用名稱
+            callback: 批次寫入模式 寫入完成後呼叫 callback(future)
+
+        Returns:
+            list: 每筆資料是否新增或更新, 批次寫入模式下為 Future
+        """
+        callback = kwargs.get('callback')
+        results = [False] * len(items)
+        try:
+            name = kwargs.get('name', None)
+            if name:
+                self.logger.info('批次儲存資料 %s 至mongo %s %s 筆數: %d', name, database, collection, len(items))
+            else:
+                self.logger.info('批次儲存資料至mongo %s %s 筆數: %d', database, collection, len(items))
+
+            col = self.mongo_client[database][collection]
+            queries = [query for query, _ in items]
+
+            if self.bulk_writer:
+                for query in queries:
+                    if len(query) > 0 and self.bulk_writer.is_pending(database, collection, query):
+                        self.bulk_writer.flush(database, collection)
+                        break
+
+            old_datas = self.get_old_datas(database, collection, queries, projection=self.get_old_data_projection())
+            operations, operation_indexes, duplicates = self.generate_operations(
+                database,
+                collection,
+                items,
+                old_datas,
+                unset=unset,
+                check_colunms=check_colunms,
+                exclude_columns=exclude_columns
+            )
+
+            if self.bulk_writer:
+                for index, operation in zip(operation_indexes, operations):
+                    results[index] = self.bulk_writer.add(
+                        database,
+                        collection,
+                        operation,
+                        document=operation._doc,
+                        query=items[index][0],
+                        callback=callback
+                    )
+            elif len(operations) > 0:
+                for index in operation_indexes:
+                    results[index] = True
+                self.acquire_write([operation._doc for operation in operations])
+                start = monotonic()
+                has_error = False
+                try:
+                    col.bulk_write(operations, ordered=False)
+                except BulkWriteError as err:
+                    has_error = True
+                    self.record_bulk_write_errors(err, items, operation_indexes, results)
+                self.record_metric('write', start)
+                self.observe_write(start, len(operations), error=has_error)
+
+            for index in duplicates:
+                query, data = items[index]
+                results[index] = self.save_to_mongo(
+                    database,
+                    collection,
+                    data,
+                    unset=unset,
+                    query=query,
+                    check_colunms=check_colunms,
+                    exclude_columns=exclude_columns,
+                    callback=callback
+                )
+
+            self.create_indexes(database, collection, index_names)
+
+            if self.bulk_writer:
+                results = [
+                    result if isinstance(result, Future) else self.generate_future(result, callback=callback)
+                    for result in results
+                ]
+            return results
+        except Exception as err:
+            self.logger.error(f'批次儲存資料至mongo 發生錯誤: {err}', exc_info=True)
+            self.record_metric('errors')
+            if self.bulk_writer:
+                return [self.generate_future(err=err, callback=callback) for _ in items]
+            return [None] * len(items)
 
 
 class MongoSyncFuncBasic(MongoFuncBasic, MongoSyncFunc):
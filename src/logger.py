@@ -1,6 +1,9 @@
-from logging.handlers import TimedRotatingFileHandler, RotatingFileHandler
+from logging.handlers import TimedRotatingFileHandler, RotatingFileHandler, QueueHandler, QueueListener
 from datetime import datetime
+from threading import Lock
+import copy
 import logging
+import queue
 import socket
 import os
 
@@ -27,8 +30,102 @@ import os
 '''
 
 
+class LogQueueHandler(QueueHandler):
+
+    def __init__(self, log_queue: queue.Queue, policy: str = 'drop') -> None:
+        """將 log 放入佇列, 由 LogQueueListener 格式化及輸出
+        放入前組成訊息, 參數 (ex: 之後會被修改的 dict) 及 traceback 不跨執行緒保留
+
+        Args:
+            log_queue (queue.Queue): 佇列
+            policy (str, optional): 佇列已滿時 drop: 捨棄, block: 等待. Defaults to 'drop'.
+        """
+        super().__init__(log_queue)
+        self.policy = policy
+        self.dropped = 0
+        self.exc_formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord):
+        """組成訊息 及 traceback 文字, 清除 args、exc_info (同 QueueHandler.prepare)
+        時間、名稱等格式 仍由 listener 的 handler 處理
+
+        Args:
+            record (logging.LogRecord): _description_
+
+        Returns:
+            logging.LogRecord: 放入佇列的 record 複本
+        """
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self.exc_formatter.formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        if self.policy == 'block':
+            self.queue.put(record)
+        else:
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+
+
+class LogQueueListener(QueueListener):
+
+    def __init__(self, log_queue: queue.Queue) -> None:
+        """單一執行緒 從佇列取出 log, 依 logger 名稱 交給原本的 handler 格式化及輸出
+
+        Args:
+            log_queue (queue.Queue): 佇列
+        """
+        super().__init__(log_queue)
+        # {logger 名稱: [handler]}
+        self.routes = {}
+        self.lock = Lock()
+
+    def add_handler(self, name: str, handler: logging.Handler):
+        """加入 logger 的 handler
+
+        Args:
+            name (str): logger 名稱
+            handler (logging.Handler): _description_
+        """
+        with self.lock:
+            self.routes[name] = self.routes.get(name, []) + [handler]
+
+    def get_handlers(self, name: str):
+        """取得 logger 的 handler
+
+        Args:
+            name (str): logger 名稱
+
+        Returns:
+            list: _description_
+        """
+        with self.lock:
+            return self.routes.get(name, [])
+
+    def handle(self, record: logging.LogRecord):
+        for handler in self.get_handlers(record.name):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def enqueue_sentinel(self):
+        # 佇列已滿時 仍需等待放入結束訊號
+        self.queue.put(self._sentinel)
+
+
 class Log():
 
+    # 佇列模式 全部 Log 共用一個佇列及 listener
+    queue_handler = None
+    queue_listener = None
+    log_names = set()
+
     def __init__(self, log_name: str = None) -> None:
         """
         Args:
@@ -44,6 +141,9 @@ class Log():
 
         self.logger = logging.getLogger(self.log_name)
         self.logger.setLevel(logging.WARNING)
+        Log.log_names.add(self.log_name)
+        if Log.queue_listener is not None:
+            Log.route_to_queue(self.log_name)
 
         self.formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
@@ -109,7 +209,7 @@ class Log():
         handler.namer = my_namer
         handler.setFormatter(self.formatter)
         if self.has_handler(handler) == False:
-            self.logger.addHandler(handler)
+            self.add_handler(handler)
 
     def set_file_handler(self, size: int = 1 * 1024 * 1024, file_amount: int = 1) -> RotatingFileHandler:
         """設置log檔案大小限制
@@ -132,7 +232,7 @@ class Log():
         handler = RotatingFileHandler(self.log_file, maxBytes=size, backupCount=file_amount)
         handler.setFormatter(self.formatter)
         if self.has_handler(handler) == False:
-            self.logger.addHandler(handler)
+            self.add_handler(handler)
 
     def set_msg_handler(self) -> logging.StreamHandler:
         """設置log steam
@@ -143,7 +243,7 @@ class Log():
         handler = logging.StreamHandler()
         handler.setFormatter(self.formatter)
         if self.has_handler(handler) == False:
-            self.logger.addHandler(handler)
+            self.add_handler(handler)
 
     def set_log_formatter(self, formatter: str):
         """設置log格式 formatter
@@ -181,27 +281,137 @@ class Log():
         Returns:
             _type_: _description_
         """
-        for h in self.logger.handlers:
+        handlers = list(self.logger.handlers)
+        if Log.queue_listener is not None:
+            handlers += Log.queue_listener.get_handlers(self.log_name)
+        for h in handlers:
             if isinstance(h, type(handler)):
                 return True
         return False
 
+    def add_handler(self, handler: logging.Handler):
+        """加入 handler, 佇列模式時 交由 listener 輸出
+
+        Args:
+            handler (logging.Handler): _description_
+        """
+        if Log.queue_listener is not None:
+            Log.queue_listener.add_handler(self.log_name, handler)
+        else:
+            self.logger.addHandler(handler)
+
+    @classmethod
+    def route_to_queue(cls, name: str):
+        """將 logger 的 handler 移至 listener, logger 改為放入佇列
+
+        Args:
+            name (str): logger 名稱
+        """
+        logger = logging.getLogger(name)
+        for handler in list(logger.handlers):
+            if handler is not cls.queue_handler:
+                logger.removeHandler(handler)
+                cls.queue_listener.add_handler(name, handler)
+        if cls.queue_handler not in logger.handlers:
+            logger.addHandler(cls.queue_handler)
+
+    @classmethod
+    def start_queue(cls, max_size: int = 10000, policy: str = 'drop'):
+        """啟用 佇列模式
+        log 只放入佇列, 由單一 listener 執行緒格式化及寫入, 呼叫的執行緒不等待 I/O
+        訊息在放入佇列時組成, 參數 (args) 為呼叫時的內容
+
+        Args:
+            max_size (int, optional): 佇列上限. Defaults to 10000.
+            policy (str, optional): 佇列已滿時 drop: 捨棄, block: 等待. Defaults to 'drop'.
+        """
+        if cls.queue_listener is not None:
+            return
+        log_queue = queue.Queue(max_size)
+        cls.queue_handler = LogQueueHandler(log_queue, policy)
+        cls.queue_listener = LogQueueListener(log_queue)
+        for name in list(cls.log_names):
+            cls.route_to_queue(name)
+        cls.queue_listener.start()
+
+    @classmethod
+    def flush_queue(cls):
+        """等待 佇列中的 log 全部輸出
+        """
+        if cls.queue_listener is None:
+            return
+        cls.queue_handler.queue.join()
+        for handlers in list(cls.queue_listener.routes.values()):
+            for handler in handlers:
+                handler.flush()
+        if cls.queue_handler.dropped:
+            logging.getLogger(__name__).warning(f'log 佇列已滿 捨棄 {cls.queue_handler.dropped} 筆')
+            cls.queue_handler.dropped = 0
+
+    @classmethod
+    def restore_handlers(cls):
+        """handler 移回 logger, 需在 listener 停止後執行
+        """
+        for name, handlers in cls.queue_listener.routes.items():
+            logger = logging.getLogger(name)
+            logger.removeHandler(cls.queue_handler)
+            for handler in handlers:
+                logger.addHandler(handler)
+        cls.queue_handler = None
+        cls.queue_listener = None
+
+    @classmethod
+    def stop_queue(cls):
+        """停止 佇列模式, 輸出佇列中的 log 後 handler 移回 logger
+        """
+        if cls.queue_listener is None:
+            return
+        cls.flush_queue()
+        cls.queue_listener.stop()
+        cls.restore_handlers()
+
+    @classmethod
+    def reset_after_fork(cls):
+        """子程序 (fork) 沒有 listener 執行緒, 改回直接輸出
+        """
+        if cls.queue_listener is not None:
+            cls.queue_listener.lock = Lock()
+            cls.restore_handlers()
+
     def disable_log(self):
         """關閉log
         """
         logging.disable()
 
-    def debug(self, message: str, exc_info: bool = False):
-        self.logger.debug(message, exc_info=exc_info)
+    def is_enabled_for(self, level: str):
+        """是否 會紀錄該等級的log, 組成訊息成本高時 先檢查
+
+        Args:
+            level (str): DEBUG,INFO,WARNING,ERROR,CRITICAL
+
+        Returns:
+            bool: _description_
+        """
+        return self.logger.isEnabledFor(logging.getLevelName(level))
+
+    # message 可使用 % 格式 並以 args 帶入參數, 不紀錄時不會組成訊息
+    # ex: logger.debug('內容: %s', data)
+
+    def debug(self, message: str, *args, exc_info: bool = False):
+        self.logger.debug(message, *args, exc_info=exc_info)
+
+    def info(self, message: str, *args, exc_info: bool = False):
+        self.logger.info(message, *args, exc_info=exc_info)
+
+    def warning(self, message: str, *args, exc_info: bool = False):
+        self.logger.warning(message, *args, exc_info=exc_info)
 
-    def info(self, message: str, exc_info: bool = False):
-        self.logger.info(message, exc_info=exc_info)
+    def error(self, message: str, *args, exc_info: bool = False):
+        self.logger.error(message, *args, exc_info=exc_info)
 
-    def warning(self, message: str, exc_info: bool = False):
-        self.logger.warning(message, exc_info=exc_info)
+    def critical(self, message: str, *args, exc_info: bool = False):
+        self.logger.critical(message, *args, exc_info=exc_info)
 
-    def error(self, message: str, exc_info: bool = False):
-        self.logger.error(message, exc_info=exc_info)
 
-    def critical(self, message: str, exc_info: bool = False):
-        self.logger.critical(message, exc_info=exc_info)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=Log.reset_after_fork)
@@ -0,0 +1,773 @@
+from src.logger import Log
+from src.mongo_func import AsyncMongoSyncFunc
+from src.mongo_index import index_registry
+from src.mongo_metrics import MongoProgress
+from src.mongo_pool import MongoConnect
+from src.mongo_bulk import AsyncMongoBulkWriter
+from src.mongo_sync import MongoSync
+from src.basic import MongoFuncBasic
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from time import monotonic
+import asyncio
+import bson
+
+
+class AsyncMongoFuncBasic(MongoFuncBasic):
+
+    # 批次寫入類別
+    bulk_writer_class = AsyncMongoBulkWriter
+
+    def __init__(self, log_name: str = 'AsyncMongoFuncBasic', **kwargs) -> None:
+        """非同步版 MongoFuncBasic
+        mongo_client 為 AsyncIOMotorClient (motor), save_to_mongo、save_many_to_mongo、flush_bulk_write 需使用 await,
+        批次寫入模式下回傳 asyncio.Future
+
+            log_name (str, optional): log名稱. Defaults to 'AsyncMongoFuncBasic'.
+            log_level : log等級, 預設 WARNING
+            size : 每次執行幾筆資料, 預設 100
+            name  (str, optional): Defaults to '未命名 Mongo 連線'
+            mongo_host (str, optional): Defaults to '127.0.0.1'
+            mongo_port (str, optional): Defaults to '27017'
+            mongo_username (str, optional)
+            mongo_password (str, optional)
+        """
+        super().__init__(log_name, **kwargs)
+
+    def create_mongo_client(self):
+        """依 mongo_setting 建立 非同步 mongo 連線
+
+        Returns:
+            AsyncIOMotorClient: motor 連線物件
+        """
+        return AsyncIOMotorClient(MongoConnect(**self.mongo_setting).generate_mongo_uri())
+
+    async def flush_bulk_write(self):
+        """寫入 批次寫入的全部暫存資料
+        """
+        if self.bulk_writer:
+            await self.bulk_writer.close()
+
+    async def acquire_write(self, documents: list):
+        """寫入前 依寫入速率限制等待
+
+        Args:
+            documents (list): 寫入內容, 有位元組限制時計算大小
+        """
+        if self.write_governor is None:
+            return
+        nbytes = sum(len(bson.encode(document)) for document in documents) if self.write_governor.bytes_per_sec else 0
+        await asyncio.sleep(self.write_governor.reserve(len(documents), nbytes))
+
+    def generate_future(self, result=None, err: Exception = None, callback=None) -> asyncio.Future:
+        """生成 已完成的 asyncio.Future, 批次寫入模式下 未寫入的結果使用
+
+        Args:
+            result (optional): 結果. Defaults to None.
+            err (Exception, optional): 錯誤. Defaults to None.
+            callback (optional): 完成後呼叫 callback(future). Defaults to None.
+
+        Returns:
+            asyncio.Future: _description_
+        """
+        future = asyncio.get_running_loop().create_future()
+        if err:
+            future.set_exception(err)
+        else:
+            future.set_result(result)
+        if callback:
+            callback(future)
+        return future
+
+    async def create_indexes(self, database: str, collection: str, index_names: list = []):
+        """建立索引 若不存在則建立, 同一組索引只確認一次
+
+        Args:
+            database (str): 指定資料庫名稱.
+            collection (str): 指定集合名稱.
+            index_names (list, optional): 索引欄位. Defaults to [].
+        """
+        if len(index_names) == 0:
+            return
+        key = (database, collection, repr(index_names))
+        if key in self.ensured_indexes:
+            return
+        missing = index_registry.get_missing(self.mongo_client, database, collection, index_names)
+        col = self.mongo_client[database][collection]
+        if missing is None:
+            index_registry.set_index_information(self.mongo_client, database, collection, await col.index_information())
+            missing = index_registry.get_missing(self.mongo_client, database, collection, index_names)
+        if not self.test and len(missing) > 0:
+            for spec in missing:
+                self.logger.info(f'新增 index {database}.{collection}: {list(spec)}')
+                await col.create_index(list(spec))
+            index_registry.invalidate(self.mongo_client, database, collection)
+        self.ensured_indexes.add(key)
+
+    async def ensure_registered_indexes(self):
+        """建立 登記的索引 若不存在則建立
+        """
+        for database, collection, index_names in self.index_settings:
+            await self.create_indexes(database, collection, index_names)
+
+    async def save_to_mongo(self, database: str, collection: str, data: dict, unset: list = None, index_names: list = [], query: dict = {}, check_colunms: list = [], exclude_columns: list = ['modified_date'], **kwargs):
+        """儲存資料至mongo
+
+        Args:
+            database (str): 指定資料庫名稱.
+            collection (str): 指定集合名稱.
+            data (dict): 新增或更新資料 ex: {'code': '1', 'name':'2'}
+            unset (list, optional): 移除欄位 名稱. Defaults to None. ex: ['code']
+            query (optional): 更新資料時需輸入查詢條件. Defaults to None. ex: comic_id=1
+            index_names (list, optional): 索引欄位 若不存在則建立索引. Defaults to [].
+            exclude_columns (list, optional): 指定排除比對的欄位. Defaults to ['modified_date'].
+            check_colunm (list[str], optional): 更新時 只檢查指定欄位是否更改. Defaults to [].
+            name: 顯示辨識用名稱
+            callback: 批次寫入模式 寫入完成後呼叫 callback(future)
+
+        Returns:
+            bool: 是否新增或更新, 批次寫入模式下回傳 asyncio.Future
+        """
+        callback = kwargs.get('callback')
+        try:
+            name = kwargs.get('name', None)
+
+            if name:
+                self.logger.info('儲存資料 %s 至mongo %s %s', name, database, collection)
+            else:
+                self.logger.info('儲存資料至mongo %s %s', database, collection)
+            # 更新或新增 則設定成 True
+            data_changes = False
+
+            col = self.mongo_client[database][collection]
+            if data.get('_id'):
+                del data['_id']
+
+            # 批次寫入模式 相同查詢條件尚未寫入時 需先寫入 才能取得舊資料
+            if self.bulk_writer and len(query) > 0 and self.bulk_writer.is_pending(database, collection, query):
+                await self.bulk_writer.flush(database, collection)
+
+            old_data = await col.find_one(query, self.get_old_data_projection())
+
+            operation = self.generate_operation(
+                database,
+                collection,
+                data,
+                old_data=old_data,
+                unset=unset,
+                query=query,
+                check_colunms=check_colunms,
+                exclude_columns=exclude_columns
+            )
+            self.record_operation(operation)
+            if operation is not None and not self.test:
+                if self.bulk_writer:
+                    data_changes = await self.bulk_writer.add(
+                        database,
+                        collection,
+                        operation,
+                        document=operation._doc,
+                        query=query,
+                        callback=callback
+                    )
+                else:
+                    await self.acquire_write([operation._doc])
+                    start = monotonic()
+                    if isinstance(operation, UpdateOne):
+                        await col.update_one(query, operation._doc)
+                    else:
+                        await col.insert_one(data)
+                    self.record_metric('write', start)
+                    self.observe_write(start)
+                    data_changes = True
+
+            await self.create_indexes(database, collection, index_names)
+
+            if self.bulk_writer and not asyncio.isfuture(data_changes):
+                return self.generate_future(data_changes, callback=callback)
+            return data_changes
+        except Exception as err:
+            self.logger.error(f'儲存資料至mongo 發生錯誤: {err}', exc_info=True)
+            self.record_metric('errors')
+            if self.bulk_writer:
+                return self.generate_future(err=err, callback=callback)
+
+    async def get_old_datas(self, database: str, collection: str, queries: list, chunk_size: int = 1000, projection: dict = None):
+        """以單次查詢取得多筆查詢條件的舊資料, 同 MongoFuncBasic.get_old_datas
+
+        Args:
+            database (str): 指定資料庫名稱.
+            collection (str): 指定集合名稱.
+            queries (list[dict]): 查詢條件
+            chunk_size (int, optional): 每次查詢最多條件數. Defaults to 1000.
+            projection (dict, optional): 回傳欄位, 會加入查詢欄位以便對應. Defaults to None.
+
+        Returns:
+            list: 與 queries 順序相同的舊資料, 不存在則為 None
+        """
+        col = self.mongo_client[database][collection]
+        old_datas = [None] * len(queries)
+
+        groups, others = self.group_old_data_queries(queries)
+        for index in others:
+            old_datas[index] = await col.find_one(queries[index], projection)
+
+        for fields, chunk, fetch_query, fetch_projection in self.generate_old_data_fetches(queries, groups, chunk_size, projection):
+            datas = await col.find(fetch_query, fetch_projection).to_list(length=None)
+            self.map_old_datas(queries, fields, chunk, datas, old_datas)
+        return old_datas
+
+    async def save_many_to_mongo(self, database: str, collection: str, items: list, unset: list = None, index_names: list = [], check_colunms: list = [], exclude_columns: list = ['modified_date'], **kwargs):
+        """批次儲存資料至mongo
+        以單次查詢取得全部舊資料, 比對後只寫入有變化的資料
+
+        Args:
+            database (str): 指定資料庫名稱.
+            collection (str): 指定集合名稱.
+            items (list[tuple[dict, dict]]): (查詢條件, 資料) ex: [({'comic_id': 1}, {'comic_id': 1, 'name': 'a'})]
+            unset (list, optional): 移除欄位 名稱. Defaults to None.
+            index_names (list, optional): 索引欄位 若不存在則建立索引. Defaults to [].
+            check_colunms (list[str], optional): 更新時 只檢查指定欄位是否更改. Defaults to [].
+            exclude_columns (list, optional): 指定排除比對的欄位. Defaults to ['modified_date'].
+            name: 顯示辨識用名稱
+            callback: 批次寫入模式 寫入完成後呼叫 callback(future)
+
+        Returns:
+            list: 每筆資料是否新增或更新, 批次寫入模式下為 asyncio.Future
+        """
+        callback = kwargs.get('callback')
+        results = [False] * len(items)
+        try:
+            name = kwargs.get('name', None)
+            if name:
+                self.logger.info('批次儲存資料 %s 至mongo %s %s 筆數: %d', name, database, collection, len(items))
+            else:
+                self.logger.info('批次儲存資料至mongo %s %s 筆數: %d', database, collection, len(items))
+
+            col = self.mongo_client[database][collection]
+            queries = [query for query, _ in items]
+
+            if self.bulk_writer:
+                for query in queries:
+                    if len(query) > 0 and self.bulk_writer.is_pending(database, collection, query):
+                        await self.bulk_writer.flush(database, collection)
+                        break
+
+            old_datas = await self.get_old_datas(database, collection, queries, projection=self.get_old_data_projection())
+            operations, operation_indexes, duplicates = self.generate_operations(
+                database,
+                collection,
+                items,
+                old_datas,
+                unset=unset,
+                check_colunms=check_colunms,
+                exclude_columns=exclude_columns
+            )
+
+            if self.bulk_writer:
+                for index, operation in zip(operation_indexes, operations):
+                    results[index] = await self.bulk_writer.add(
+                        database,
+                        collection,
+                        operation,
+                        document=operation._doc,
+                        query=items[index][0],
+                        callback=callback
+                    )
+            elif len(operations) > 0:
+                for index in operation_indexes:
+                    results[index] = True
+                await self.acquire_write([operation._doc for operation in operations])
+                start = monotonic()
+                has_error = False
+                try:
+                    await col.bulk_write(operations, ordered=False)
+                except BulkWriteError as err:
+                    has_error = True
+                    self.record_bulk_write_errors(err, items, operation_indexes, results)
+                self.record_metric('write', start)
+                self.observe_write(start, len(operations), error=has_error)
+
+            for index in duplicates:
+                query, data = items[index]
+                results[index] = await self.save_to_mongo(
+                    database,
+                    collection,
+                    data,
+                    unset=unset,
+                    query=query,
+                    check_colunms=check_colunms,
+                    exclude_columns=exclude_columns,
+                    callback=callback
+                )
+
+            await self.create_indexes(database, collection, index_names)
+
+            if self.bulk_writer:
+                results = [
+                    result if asyncio.isfuture(result) else self.generate_future(result, callback=callback)
+                    for result in results
+                ]
+            return results
+        except Exception as err:
+            self.logger.error(f'批次儲存資料至mongo 發生錯誤: {err}', exc_info=True)
+            self.record_metric('errors')
+            if self.bulk_writer:
+                return [self.generate_future(err=err, callback=callback) for _ in items]
+            return [None] * len(items)
+
+
+class AsyncMongoSyncFuncBasic(AsyncMongoFuncBasic, AsyncMongoSyncFunc):
+
+    def __init__(self, log_name: str = 'AsyncMongoSyncFuncBasic', **kwargs) -> None:
+        """
+            log_name (str, optional): log名稱. Defaults to 'AsyncMongoSyncFuncBasic'.
+            log_level : log等級, 預設 WARNING
+            size : 每次執行幾筆資料, 預設 100
+            name  (str, optional): Defaults to '未命名 Mongo 連線'
+            mongo_host (str, optional): Defaults to '127.0.0.1'
+            mongo_port (str, optional): Defaults to '27017'
+            mongo_username (str, optional)
+            mongo_password (str, optional)
+        """
+        super().__init__(log_name, **kwargs)
+
+
+class AsyncMongoSync(MongoSync):
+
+    # 非同步模式 不支援且會改變處理結果的 add_func 參數, add_func 時 ValueError
+    unsupported_settings = ('partitions', 'stream', 'incremental', 'watermark_key', 'scan_group', 'checkpoint_name', 'raw_bson')
+    # 非同步模式 不需要的讀取設定 (同時執行數量由 run(workers) 控制), 忽略
+    ignored_settings = ('prefetch', 'prefetch_consumers', 'concurrency', 'adaptive_batch')
+
+    def __init__(self, log_name: str = 'AsyncMongoSync', **kwargs) -> None:
+        """非同步版 MongoSync
+        以 asyncio 同時執行多筆資料的處理函式, 同時執行數量由 run(workers) 限制
+        add_func 用法與 MongoSync 相同, 處理函式可為 async def 或一般函式 (以 asyncio.to_thread 執行)
+        支援 query、limit、start、pagination、sort_key、projection、pipeline、order_key、collect_errors,
+        不支援 分區、stream、增量模式、共用讀取、進度紀錄及多程序模式, 設定時 ValueError
+
+        Args:
+            參數同 MongoSync
+        """
+        if kwargs.get('shared_scan'):
+            raise ValueError('非同步模式 不支援共用讀取 shared_scan')
+        super().__init__(log_name, **kwargs)
+        self.mongo_client = None
+        self.semaphore = None
+
+    def add_func(self, func, database: str, collection: str, limit: int = 0, query: dict = {}, **kwargs):
+        """新增 要執行的函式, 參數同 MongoSync.add_func
+
+        Raises:
+            ValueError: 非同步模式 不支援的參數 (分區、stream、增量模式、共用讀取、進度紀錄、raw_bson)
+        """
+        unsupported = [
+            key for key in self.unsupported_settings
+            if kwargs.get(key) and not (key == 'partitions' and int(kwargs[key]) <= 1)
+        ]
+        if unsupported:
+            raise ValueError(f'非同步模式 不支援的參數: {unsupported}')
+        ignored = [key for key in self.ignored_settings if kwargs.get(key)]
+        if ignored:
+            self.logger.warning(f'非同步模式 忽略的參數: {ignored}, 同時執行數量由 run(workers) 控制')
+        super().add_func(func, database, collection, limit=limit, query=query, **kwargs)
+
+    def set_checkpoint_store(self, store, interval: float = 30):
+        """非同步模式 不支援進度紀錄
+
+        Raises:
+            ValueError: _description_
+        """
+        raise ValueError('非同步模式 不支援進度紀錄')
+
+    def create_mongo_client(self):
+        """建立 非同步 mongo 連線
+
+        Returns:
+            AsyncIOMotorClient: motor 連線物件
+        """
+        return AsyncIOMotorClient(self.uri)
+
+    async def get_mongo_total_amount(self, mongo_client, collection: str, database: str, query: dict = {}):
+        """取得 mongo 資料總數量
+
+        Args:
+            mongo_client (AsyncIOMotorClient): 非同步 mongo 連線
+            database (str): 資料庫
+            collection (str): 集合
+            query (dict, optional): 查詢條件. Defaults to {}.
+
+        Returns:
+            _type_: _description_
+        """
+        try:
+            return await mongo_client[database][collection].count_documents(query)
+        except Exception as err:
+            self.logger.error(
+                f'取得 mongo {database} {collection} 資料總數量 發生錯誤: {err}', exc_info=True)
+            return None
+
+    async def get_skip_batches(self, col, query: dict = {}, start: int = 0, size: int = 100, projection: dict = None):
+        """以 skip/limit 分批取得資料
+
+        Args:
+            col (AsyncIOMotorCollection): 集合
+            query (dict, optional): 查詢條件. Defaults to {}.
+            start (int, optional): 起始位置. Defaults to 0.
+            size (int, optional): 每批筆數. Defaults to 100.
+            projection (dict, optional): 回傳欄位. Defaults to None.
+
+        Yields:
+            list: 每批資料
+        """
+        while True:
+            datas = await col.find(query, projection).skip(start).limit(size).to_list(length=None)
+            if len(datas) == 0:
+                break
+
+            yield datas
+
+            if len(datas) < size:
+                break
+            start += size
+
+    async def get_keyset_batches(self, col, query: dict = {}, sort_key: str = '_id', start: int = 0, size: int = 100, projection: dict = None):
+        """以 keyset ({sort_key: {$gt: 上一批最後一筆}}) 分批取得資料
+
+        Args:
+            col (AsyncIOMotorCollection): 集合
+            query (dict, optional): 查詢條件. Defaults to {}.
+            sort_key (str, optional): 排序欄位, 需建立索引. Defaults to '_id'.
+            start (int, optional): 起始位置, 僅第一批使用 skip. Defaults to 0.
+            size (int, optional): 每批筆數. Defaults to 100.
+            projection (dict, optional): 回傳欄位, 需包含 sort_key 及 _id. Defaults to None.
+
+        Yields:
+            list: 每批資料
+        """
+        sort = self.get_keyset_sort(sort_key)
+        last_key = None
+        last_id = None
+        while True:
+            if last_id is None:
+                cursor = col.find(query, projection).sort(sort).skip(start)
+            else:
+                cursor = col.find(
+                    self.generate_keyset_query(query, sort_key=sort_key, last_key=last_key, last_id=last_id),
+                    projection
+                ).sort(sort)
+
+            datas = await cursor.limit(size).to_list(length=None)
+            if len(datas) == 0:
+                break
+
+            last_key = self.get_field_value(datas[-1], sort_key)
+            last_id = datas[-1]['_id']
+
+            yield datas
+
+            if len(datas) < size:
+                break
+
+    async def get_cursor_pipeline_batches(self, col, pipeline: list, query: dict = {}, start: int = 0, size: int = 100):
+        """以單一 aggregate cursor 分批取得 pipeline 結果, 同 MongoSync.get_cursor_pipeline_batches
+
+        Args:
+            col (AsyncIOMotorCollection): 集合
+            pipeline (list): aggregation pipeline
+            query (dict, optional): 查詢條件, 加在 pipeline 最前面. Defaults to {}.
+            start (int, optional): 略過前幾筆結果. Defaults to 0.
+            size (int, optional): 每批筆數. Defaults to 100.
+
+        Yields:
+            list: 每批資料
+        """
+        source_query, stages = self.split_pipeline(pipeline, query)
+        if len(source_query) > 0:
+            stages.insert(0, {'$match': source_query})
+        if start:
+            stages.append({'$skip': start})
+
+        cursor = col.aggregate(stages, allowDiskUse=True, batchSize=size)
+        try:
+            datas = []
+            async for data in cursor:
+                datas.append(data)
+                if len(datas) >= size:
+                    yield datas
+                    datas = []
+            if len(datas) > 0:
+                yield datas
+        finally:
+            await cursor.close()
+
+    async def get_keyset_pipeline_batches(self, col, pipeline: list, query: dict = {}, sort_key: str = '_id', start: int = 0, size: int = 100):
+        """以 keyset 分頁來源資料, 每頁以 $match 限制範圍後執行 pipeline, 同 MongoSync.get_keyset_pipeline_batches
+
+        Args:
+            col (AsyncIOMotorCollection): 集合
+            pipeline (list): aggregation pipeline, 開頭的 $match 作為來源查詢條件
+            query (dict, optional): 查詢條件. Defaults to {}.
+            sort_key (str, optional): 排序欄位, 需建立索引. Defaults to '_id'.
+            start (int, optional): 起始位置, 僅第一頁使用 skip. Defaults to 0.
+            size (int, optional): 每頁來源筆數. Defaults to 100.
+
+        Yields:
+            list: 每頁的 pipeline 結果, 無結果的頁不回傳
+        """
+        source_query, stages = self.split_pipeline(pipeline, query)
+        async for keys in self.get_keyset_batches(col, query=source_query, sort_key=sort_key, start=start, size=size, projection={'_id': 1, sort_key: 1}):
+            page_query = self.generate_page_query(source_query, sort_key, keys[0], keys[-1])
+            datas = await col.aggregate([{'$match': page_query}] + stages, allowDiskUse=True, batchSize=max(size, 1)).to_list(length=None)
+            if len(datas) > 0:
+                yield datas
+
+    def get_batches(self, col, query: dict = {}, pagination: str = 'skip', sort_key: str = '_id', start: int = 0, size: int = 100, projection: dict = None, pipeline: list = None):
+        """依分頁方式 分批取得資料
+
+        Args:
+            col (AsyncIOMotorCollection): 集合
+            query (dict, optional): 查詢條件. Defaults to {}.
+            pagination (str, optional): 分頁方式 skip 或 keyset. Defaults to 'skip'.
+            sort_key (str, optional): keyset 分頁排序欄位. Defaults to '_id'.
+            start (int, optional): 起始位置. Defaults to 0.
+            size (int, optional): 每批筆數. Defaults to 100.
+            projection (dict, optional): 回傳欄位. Defaults to None.
+            pipeline (list, optional): aggregation pipeline, 同 MongoSync.get_batches. Defaults to None.
+
+        Returns:
+            async_generator: 每批資料
+        """
+        if pipeline is not None:
+            if pagination == 'keyset':
+                return self.get_keyset_pipeline_batches(col, pipeline, query=query, sort_key=sort_key, start=start, size=size)
+            return self.get_cursor_pipeline_batches(col, pipeline, query=query, start=start, size=size)
+        if pagination == 'keyset':
+            return self.get_keyset_batches(col, query=query, sort_key=sort_key, start=start, size=size, projection=projection)
+        elif pagination == 'skip':
+            return self.get_skip_batches(col, query=query, start=start, size=size, projection=projection)
+        else:
+            raise ValueError(f'pagination 設定錯誤: {pagination}')
+
+    async def run_func(self, func, data, mongo_client, metrics_label: str, progress: MongoProgress, collect_errors: bool = False):
+        """執行 處理函式, 同時執行數量由 semaphore 限制
+
+        Args:
+            func (_type_): 執行的函式, 可為 async def 或一般函式
+            data (dict): 資料
+            mongo_client : mongo 連線
+            metrics_label (str): 統計名稱
+            progress (MongoProgress): 處理進度
+            collect_errors (bool, optional): 紀錄錯誤後繼續處理. Defaults to False.
+        """
+        async with self.semaphore:
+            # save_to_mongo 依此紀錄 新增、更新筆數, 每個 task 各自設定
+            self.metrics.set_label(metrics_label)
+            progress.update()
+            func_start = monotonic()
+            try:
+                if asyncio.iscoroutinefunction(func):
+                    await func(data=data, mongo_client=mongo_client)
+                else:
+                    await asyncio.to_thread(func, data=data, mongo_client=mongo_client)
+            except Exception as err:
+                if not collect_errors:
+                    raise
+                self.record_error(metrics_label, data, err)
+            self.metrics.observe(metrics_label, 'func', monotonic() - func_start)
+            self.metrics.inc(metrics_label, 'processed')
+
+    async def run_datas(self, func, datas: list, mongo_client, metrics_label: str, progress: MongoProgress, collect_errors: bool = False):
+        """依序執行 資料的處理函式 (order_key 相同的一組資料)
+
+        Args:
+            func (_type_): 執行的函式
+            datas (list): 資料
+            mongo_client : mongo 連線
+            metrics_label (str): 統計名稱
+            progress (MongoProgress): 處理進度
+            collect_errors (bool, optional): 紀錄錯誤後繼續處理. Defaults to False.
+        """
+        for data in datas:
+            await self.run_func(func, data, mongo_client, metrics_label, progress, collect_errors)
+            if self.test:
+                # 測試模式 每筆停止一秒
+                await asyncio.sleep(self.sleep_sec)
+
+    async def process_mongo_datas(self, func, database: str, collection: str, **kwargs):
+        """處理 mongo 資料
+        處理第 k 批資料的同時 讀取第 k+1 批
+
+        Args:
+            collection (str): 集合
+            func (_type_): 執行的函式
+            database (str): 資料庫.
+            query (dict, optional): 查詢條件. Defaults to {}.
+            limit (int, optional): 執行幾筆
+            start (int, optional): 從第幾筆開始. Defaults to 0.
+            pagination (str, optional): 分頁方式 skip 或 keyset. Defaults to 'skip'.
+            sort_key (str, optional): keyset 分頁排序欄位, 需建立索引. Defaults to '_id'.
+            projection (dict | list, optional): 回傳欄位. Defaults to None.
+            pipeline (list, optional): aggregation pipeline, 取代 find(query). Defaults to None.
+            order_key (str, optional): 相同值的資料依序執行. Defaults to None.
+            collect_errors (bool, optional): 處理函式發生錯誤時 紀錄後繼續處理, 見 get_errors. Defaults to False.
+            mongo_client : 若處理函式的 mongo 主機與批量資料處理的不同, 需帶入 mongo_client
+
+        Returns:
+            int: 處理筆數
+        """
+        count = 0
+        tasks = []
+        metrics_label = None
+        try:
+            query = kwargs.get('query', {})
+            limit = int(kwargs.get('limit', 0))
+            start = int(kwargs.get('start', 0))
+            # 若處理函式的 mongo 主機不同, 需帶入 mongo_client
+            func_mongo_client = kwargs.get('mongo_client', self.mongo_client)
+            col = self.mongo_client[database][collection]
+
+            if limit:
+                self.logger.debug(f'限制執行 {limit} 筆')
+
+            # aggregation pipeline 的結果筆數 需執行完才能得知
+            total = None if kwargs.get('pipeline') else await self.get_mongo_total_amount(
+                mongo_client=self.mongo_client, database=database, collection=collection, query=query)
+            self.logger.info(f'總量: {total}')
+
+            metrics_label = self.get_metrics_label(func)
+            self.metrics.start(metrics_label, self.get_progress_total(total, limit))
+            progress = MongoProgress(self.logger, '', self.get_progress_total(total, limit), **self.progress_setting)
+
+            batches = self.get_batches(
+                col,
+                query=query,
+                pagination=kwargs.get('pagination', 'skip'),
+                sort_key=kwargs.get('sort_key', '_id'),
+                start=start,
+                size=self.size,
+                projection=self.get_task_projection(**kwargs),
+                pipeline=kwargs.get('pipeline')
+            )
+
+            fetch_start = monotonic()
+            async for datas in batches:
+                self.metrics.observe(metrics_label, 'fetch', monotonic() - fetch_start)
+                self.metrics.inc(metrics_label, 'read', len(datas))
+                # 讀取下一批時 上一批仍在執行
+                if len(tasks) > 0:
+                    await asyncio.gather(*tasks)
+                    tasks = []
+
+                if limit:
+                    datas = datas[:limit - count]
+                count += len(datas)
+
+                for group in self.group_datas(datas, kwargs.get('order_key')):
+                    tasks.append(asyncio.create_task(self.run_datas(
+                        func, group, func_mongo_client, metrics_label, progress, kwargs.get('collect_errors', False))))
+                    if self.test:
+                        # 測試模式 逐筆執行
+                        await tasks.pop()
+
+                if limit and count >= limit:
+                    self.logger.debug(f'已執行 {count} 筆, 中止程式')
+                    break
+                fetch_start = monotonic()
+
+            if len(tasks) > 0:
+                await asyncio.gather(*tasks)
+            self.logger.info(f'處理完成 {count}/{total}')
+        except Exception as err:
+            for task in tasks:
+                task.cancel()
+            # 等待取消完成, 避免 task 未結束即被回收
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.logger.error(f'處理 mongo 資料 發生錯誤: {err}', exc_info=True)
+            self.metrics.inc(self.get_metrics_label(func), 'errors')
+        finally:
+            if metrics_label:
+                self.metrics.finish(metrics_label)
+        return count
+
+    async def ensure_indexes(self):
+        """執行前 建立處理函式物件登記的索引 (register_indexes)
+        """
+        for instance in self.get_instances():
+            if hasattr(instance, 'ensure_registered_indexes'):
+                try:
+                    result = instance.ensure_registered_indexes()
+                    if asyncio.iscoroutine(result):
+                        await result
+                except Exception as err:
+                    self.logger.error(f'建立索引 {instance.__class__.__name__} 發生錯誤: {err}', exc_info=True)
+
+    async def flush_bulk_writes(self):
+        """寫入 處理函式物件批次寫入的暫存資料
+        """
+        for instance in self.get_instances():
+            if hasattr(instance, 'flush_bulk_write'):
+                result = instance.flush_bulk_write()
+                if asyncio.iscoroutine(result):
+                    await result
+
+    async def run_async(self, workers: int = 100):
+        """非同步執行
+
+        Args:
+            workers (int, optional): 處理函式同時執行數量. Defaults to 100.
+
+        Returns:
+            dict: 各函式處理筆數 {func: count}
+        """
+        results = {}
+        self.semaphore = asyncio.Semaphore(workers)
+        self.metrics.reset_progress()
+        self.mongo_client = self.create_mongo_client()
+        try:
+            await self.ensure_indexes()
+            self.start_write_governor()
+            if self.metrics_setting:
+                self.metrics.start_reporter(**self.metrics_setting)
+            funcs = []
+            coroutines = []
+            for func, details in self.funcs.items():
+                self.logger.debug(f'執行函式: {func.__self__.__class__.__name__} {func.__name__} 參數: {details}')
+                if isinstance(details, dict):
+                    funcs.append(func)
+                    coroutines.append(self.process_mongo_datas(func=func, **details))
+
+            results = dict(zip(funcs, await asyncio.gather(*coroutines)))
+            await self.flush_bulk_writes()
+
+            if self.metrics_setting:
+                self.metrics.stop_reporter()
+                if self.metrics_setting.get('path'):
+                    self.metrics.write_prometheus(self.metrics_setting['path'])
+            self.metrics.log_summary()
+            if self.write_governor is not None:
+                self.logger.info(f'寫入速率限制統計: {self.write_governor.get_stats()}')
+            for func, count in results.items():
+                self.logger.info(f'執行完成: {func.__self__.__class__.__name__} {func.__name__} 共處理 {count} 筆')
+            for metrics_label, errors in self.get_errors().items():
+                self.logger.warning(f'處理錯誤: {metrics_label} 前 {min(len(errors), 10)} 筆 {errors[:10]}')
+        finally:
+            self.stop_write_governor()
+            self.mongo_client.close()
+            # 佇列模式 等待 log 全部輸出
+            Log.flush_queue()
+        return results
+
+    def run(self, workers: int = 100):
+        """執行
+
+        Args:
+            workers (int, optional): 處理函式同時執行數量. Defaults to 100.
+
+        Returns:
+            dict: 各函式處理筆數 {func: count}
+        """
+        return asyncio.run(self.run_async(workers=workers))
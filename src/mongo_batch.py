@@ -0,0 +1,184 @@
+from bson.raw_bson import RawBSONDocument
+from collections import deque
+from threading import Condition, Thread
+import bson
+
+
+class AdaptiveBatchSizer():
+
+    def __init__(self, size: int = 100, min_size: int = 10, max_size: int = 10000, target_seconds: float = 0.2, target_bytes: int = 16 * 1024 * 1024, avg_obj_size: float = None) -> None:
+        """依實際讀取時間及資料大小 調整每批筆數
+        每批讀取時間接近 target_seconds, 每批資料量不超過 target_bytes, 筆數介於 min_size ~ max_size
+
+        Args:
+            size (int, optional): 初始每批筆數. Defaults to 100.
+            min_size (int, optional): 每批最少筆數. Defaults to 10.
+            max_size (int, optional): 每批最多筆數. Defaults to 10000.
+            target_seconds (float, optional): 每批目標讀取秒數. Defaults to 0.2.
+            target_bytes (int, optional): 每批資料量上限. Defaults to 16 * 1024 * 1024 (16M).
+            avg_obj_size (float, optional): 平均每筆大小 (collStats avgObjSize), 無法量測資料大小時使用. Defaults to None.
+        """
+        self.min_size = max(int(min_size), 1)
+        self.max_size = max(int(max_size), self.min_size)
+        self.target_seconds = target_seconds
+        self.target_bytes = target_bytes
+        self.size = min(max(int(size), self.min_size), self.max_size)
+
+        # 每筆讀取秒數 及 大小 (指數移動平均)
+        self.doc_seconds = None
+        self.doc_bytes = avg_obj_size
+        self.alpha = 0.3
+
+    def get_size(self):
+        """取得 下一批筆數
+
+        Returns:
+            int: 筆數
+        """
+        return self.size
+
+    def smooth(self, current, value: float):
+        """指數移動平均
+
+        Args:
+            current (float): 目前平均, None 為尚無資料
+            value (float): 新數值
+
+        Returns:
+            float: 平均
+        """
+        if current is None:
+            return value
+        return current + self.alpha * (value - current)
+
+    def update(self, count: int, seconds: float, nbytes: int = None):
+        """依上一批的讀取結果 調整下一批筆數
+        筆數少於設定時 (最後一批) 不調整
+
+        Args:
+            count (int): 上一批筆數
+            seconds (float): 上一批讀取秒數
+            nbytes (int, optional): 上一批資料量, None 為使用 avg_obj_size. Defaults to None.
+
+        Returns:
+            int: 下一批筆數
+        """
+        if count <= 0 or count < self.size:
+            return self.size
+
+        self.doc_seconds = self.smooth(self.doc_seconds, seconds / count)
+        if nbytes is not None:
+            self.doc_bytes = self.smooth(self.doc_bytes, nbytes / count)
+
+        size = self.max_size
+        if self.doc_seconds > 0:
+            size = min(size, self.target_seconds / self.doc_seconds)
+        if self.doc_bytes:
+            size = min(size, self.target_bytes / self.doc_bytes)
+
+        # 每次最多調整兩倍 避免單批誤差造成劇烈變化
+        size = min(max(size, self.size / 2), self.size * 2)
+        self.size = int(min(max(size, self.min_size), self.max_size))
+        return self.size
+
+
+class BatchPrefetcher():
+
+    def __init__(self, batches, depth: int = 2, max_bytes: int = None) -> None:
+        """預先讀取資料
+        讀取執行緒持續讀取下一批 放入佇列, 處理與讀取同時進行
+        佇列達到 depth 批 或 max_bytes 時 讀取執行緒等待 (至少保留一批)
+
+        Args:
+            batches (generator): 每批資料
+            depth (int, optional): 佇列最多批數. Defaults to 2.
+            max_bytes (int, optional): 佇列資料量上限, None 為不限制. Defaults to None.
+        """
+        self.batches = batches
+        self.depth = max(int(depth), 1)
+        self.max_bytes = max_bytes
+
+        # [(資料, 資料量)]
+        self.queue = deque()
+        self.bytes = 0
+        self.condition = Condition()
+        self.done = False
+        self.stopped = False
+        self.error = None
+
+        self.reader = Thread(target=self.read, name='BatchPrefetcher', daemon=True)
+        self.reader.start()
+
+    def get_bytes(self, datas: list):
+        """估計 一批資料量, RawBSONDocument 為實際大小, 其餘以第一筆估計
+
+        Args:
+            datas (list): 一批資料
+
+        Returns:
+            int: 位元組
+        """
+        if len(datas) == 0:
+            return 0
+        if isinstance(datas[0], RawBSONDocument):
+            return sum(len(data.raw) for data in datas)
+        return len(bson.encode(datas[0])) * len(datas)
+
+    def is_full(self):
+        """佇列是否已滿, 需在 lock 內執行
+
+        Returns:
+            bool: _description_
+        """
+        if len(self.queue) == 0:
+            return False
+        if len(self.queue) >= self.depth:
+            return True
+        return self.max_bytes is not None and self.bytes >= self.max_bytes
+
+    def read(self):
+        """讀取執行緒
+        """
+        try:
+            for datas in self.batches:
+                nbytes = self.get_bytes(datas) if self.max_bytes is not None else 0
+                with self.condition:
+                    while self.is_full() and not self.stopped:
+                        self.condition.wait()
+                    if self.stopped:
+                        break
+                    self.queue.append((datas, nbytes))
+                    self.bytes += nbytes
+                    self.condition.notify_all()
+        except Exception as err:
+            self.error = err
+        finally:
+            if hasattr(self.batches, 'close'):
+                self.batches.close()
+            with self.condition:
+                self.done = True
+                self.condition.notify_all()
+
+    def __iter__(self):
+        while True:
+            with self.condition:
+                while len(self.queue) == 0 and not self.done:
+                    self.condition.wait()
+                if len(self.queue) == 0:
+                    break
+                datas, nbytes = self.queue.popleft()
+                self.bytes -= nbytes
+                self.condition.notify_all()
+            yield datas
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        """停止讀取
+        """
+        with self.condition:
+            self.stopped = True
+            self.queue.clear()
+            self.bytes = 0
+            self.condition.notify_all()
+        self.reader.join()
@@ -0,0 +1,409 @@
+from src.logger import Log
+
+from concurrent.futures import Future
+from pymongo.errors import BulkWriteError, WriteError
+from threading import Event, Lock, Thread
+import asyncio
+import bson
+import time
+
+
+class MongoBulkWriter():
+
+    def __init__(self, mongo_client, max_size: int = 1000, max_bytes: int = 8 * 1024 * 1024, max_seconds: float = 1.0, **kwargs) -> None:
+        """批次寫入 mongo
+        依 (資料庫, 集合) 暫存 InsertOne / UpdateOne, 達到筆數、大小或時間上限時 以 unordered bulk_write 寫入
+
+        Args:
+            mongo_client (MongoClient): pymongo 連線物件
+            max_size (int, optional): 每批最多筆數. Defaults to 1000.
+            max_bytes (int, optional): 每批最大位元組. Defaults to 8 * 1024 * 1024 (8M).
+            max_seconds (float, optional): 資料最長暫存秒數. Defaults to 1.0.
+            log_level (str, optional): log等級. Defaults to WARNING.
+            metrics (MongoMetrics, optional): 統計, 以 資料庫.集合 紀錄寫入延遲及錯誤. Defaults to None.
+            write_governor (WriteGovernor, optional): 寫入速率限制. Defaults to None.
+        """
+        self.logger = Log('MongoBulkWriter')
+        self.logger.set_level(str(kwargs.get('log_level', 'WARNING')).upper())
+        self.logger.set_msg_handler()
+
+        self.mongo_client = mongo_client
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.metrics = kwargs.get('metrics')
+        self.write_governor = kwargs.get('write_governor')
+
+        # {(database, collection): {'operations': [], 'futures': [], 'keys': set(), 'bytes': 0, 'created': float}}
+        self.buffers = {}
+        # 寫入中的查詢條件 {(database, collection): set()}
+        self.in_flight = {}
+        self.flush_locks = {}
+        self.lock = Lock()
+
+        self.stop_event = Event()
+        self.timer = None
+
+    def generate_key(self, query: dict):
+        """生成 查詢條件 識別值
+
+        Args:
+            query (dict): 查詢條件
+
+        Returns:
+            bytes: 識別值
+        """
+        return bson.encode(query)
+
+    def start_timer(self):
+        """啟動 定時寫入執行序
+        """
+        if self.timer is None or not self.timer.is_alive():
+            self.stop_event.clear()
+            self.timer = Thread(target=self.flush_timer, name='MongoBulkWriter', daemon=True)
+            self.timer.start()
+
+    def flush_timer(self):
+        """定時檢查 超過 max_seconds 的暫存資料並寫入
+        """
+        interval = max(self.max_seconds / 2, 0.05)
+        while not self.stop_event.wait(interval):
+            for database, collection in self.get_expired():
+                self.flush(database, collection)
+
+    def add(self, database: str, collection: str, operation, document: dict = None, query: dict = None, callback=None) -> Future:
+        """加入 寫入操作
+
+        Args:
+            database (str): 資料庫
+            collection (str): 集合
+            operation (InsertOne | UpdateOne): 寫入操作
+            document (dict, optional): 寫入內容, 計算大小及錯誤訊息用. Defaults to None.
+            query (dict, optional): 查詢條件, 寫入完成前 is_pending 會回傳 True. Defaults to None.
+            callback (optional): 寫入完成後呼叫 callback(future). Defaults to None.
+
+        Returns:
+            Future: 寫入成功為 True, 失敗則為寫入錯誤
+        """
+        future = Future()
+        future.document = document
+        if callback:
+            future.add_done_callback(callback)
+
+        if self.append(database, collection, operation, future, document=document, query=query):
+            self.flush(database, collection)
+        else:
+            self.start_timer()
+        return future
+
+    def append(self, database: str, collection: str, operation, future, document: dict = None, query: dict = None):
+        """暫存 寫入操作
+
+        Args:
+            database (str): 資料庫
+            collection (str): 集合
+            operation (InsertOne | UpdateOne): 寫入操作
+            future (Future): 寫入結果
+            document (dict, optional): 寫入內容, 計算大小用. Defaults to None.
+            query (dict, optional): 查詢條件. Defaults to None.
+
+        Returns:
+            bool: 是否達到上限 需寫入
+        """
+        namespace = (database, collection)
+        nbytes = len(bson.encode(document)) if document else 0
+        with self.lock:
+            buffer = self.buffers.get(namespace)
+            if buffer is None:
+                buffer = {
+                    'operations': [],
+                    'futures': [],
+                    'keys': set(),
+                    'bytes': 0,
+                    'created': time.monotonic()
+                }
+                self.buffers[namespace] = buffer
+            buffer['operations'].append(operation)
+            buffer['futures'].append(future)
+            buffer['bytes'] += nbytes
+            if query:
+                buffer['keys'].add(self.generate_key(query))
+            return len(buffer['operations']) >= self.max_size or buffer['bytes'] >= self.max_bytes
+
+    def get_expired(self):
+        """取得 超過 max_seconds 的暫存資料
+
+        Returns:
+            list: [(database, collection)]
+        """
+        now = time.monotonic()
+        with self.lock:
+            return [
+                namespace for namespace, buffer in self.buffers.items()
+                if now - buffer['created'] >= self.max_seconds
+            ]
+
+    def is_pending(self, database: str, collection: str, query: dict):
+        """查詢條件 是否有尚未寫入完成的操作
+
+        Args:
+            database (str): 資料庫
+            collection (str): 集合
+            query (dict): 查詢條件
+
+        Returns:
+            bool: _description_
+        """
+        key = self.generate_key(query)
+        namespace = (database, collection)
+        with self.lock:
+            buffer = self.buffers.get(namespace)
+            if buffer and key in buffer['keys']:
+                return True
+            return key in self.in_flight.get(namespace, set())
+
+    def flush(self, database: str = None, collection: str = None):
+        """寫入 暫存資料, 未指定資料庫及集合時 寫入全部
+
+        Args:
+            database (str, optional): 資料庫. Defaults to None.
+            collection (str, optional): 集合. Defaults to None.
+        """
+        if database is None or collection is None:
+            with self.lock:
+                namespaces = list(self.buffers.keys())
+            for namespace in namespaces:
+                self.flush(*namespace)
+            return
+
+        namespace = (database, collection)
+        with self.lock:
+            flush_lock = self.flush_locks.setdefault(namespace, Lock())
+
+        # 同一集合依序寫入, 避免新增與更新順序錯亂
+        with flush_lock:
+            with self.lock:
+                buffer = self.buffers.pop(namespace, None)
+                if buffer is None:
+                    return
+                self.in_flight[namespace] = buffer['keys']
+
+            try:
+                self.write(database, collection, buffer['operations'], buffer['futures'], buffer['bytes'])
+            finally:
+                with self.lock:
+                    self.in_flight.pop(namespace, None)
+
+    def write(self, database: str, collection: str, operations: list, futures: list, nbytes: int = 0):
+        """執行 bulk_write, 並將結果對應回每筆資料
+
+        Args:
+            database (str): 資料庫
+            collection (str): 集合
+            operations (list): 寫入操作
+            futures (list): 對應的 Future
+            nbytes (int, optional): 寫入位元組, 寫入速率限制用. Defaults to 0.
+        """
+        self.logger.info('批次寫入 mongodb %s.%s 筆數: %d', database, collection, len(operations))
+        if self.write_governor is not None:
+            self.write_governor.acquire(len(operations), nbytes)
+        start = time.monotonic()
+        try:
+            self.mongo_client[database][collection].bulk_write(operations, ordered=False)
+            errors = {}
+        except BulkWriteError as err:
+            errors = self.get_write_errors(err)
+        except Exception as err:
+            self.set_exception(database, collection, futures, err, start)
+            return
+        self.set_results(database, collection, futures, errors, start)
+
+    def get_write_errors(self, err: BulkWriteError):
+        """取得 bulk_write 各筆的寫入錯誤
+
+        Args:
+            err (BulkWriteError): 寫入錯誤
+
+        Returns:
+            dict: {寫入操作 index: WriteError}
+        """
+        errors = {}
+        for write_error in err.details.get('writeErrors', []):
+            errors[write_error['index']] = WriteError(
+                write_error.get('errmsg'),
+                write_error.get('code'),
+                write_error
+            )
+        return errors
+
+    def set_exception(self, database: str, collection: str, futures: list, err: Exception, start: float):
+        """整批寫入失敗, 全部 Future 設為錯誤
+
+        Args:
+            database (str): 資料庫
+            collection (str): 集合
+            futures (list): 對應的 Future
+            err (Exception): 錯誤
+            start (float): 寫入開始時間 (monotonic)
+        """
+        self.logger.error(f'批次寫入 mongodb {database}.{collection} 發生錯誤: {err}', exc_info=True)
+        if self.write_governor is not None:
+            self.write_governor.observe(time.monotonic() - start, len(futures), error=True)
+        if self.metrics is not None:
+            self.metrics.inc(f'{database}.{collection}', 'errors', len(futures))
+        for future in futures:
+            future.set_exception(err)
+
+    def set_results(self, database: str, collection: str, futures: list, errors: dict, start: float):
+        """紀錄 寫入延遲, 並將結果對應回每筆資料
+
+        Args:
+            database (str): 資料庫
+            collection (str): 集合
+            futures (list): 對應的 Future
+            errors (dict): {寫入操作 index: WriteError}
+            start (float): 寫入開始時間 (monotonic)
+        """
+        if self.write_governor is not None:
+            self.write_governor.observe(time.monotonic() - start, len(futures), error=bool(errors))
+        if self.metrics is not None:
+            self.metrics.observe(f'{database}.{collection}', 'write', time.monotonic() - start)
+            if errors:
+                self.metrics.inc(f'{database}.{collection}', 'errors', len(errors))
+
+        for index, future in enumerate(futures):
+            if index in errors:
+                self.logger.error(f'批次寫入 mongodb {database}.{collection} 發生錯誤: {errors[index]}\n內容: {future.document}')
+                future.set_exception(errors[index])
+            else:
+                future.set_result(True)
+
+    def close(self):
+        """停止定時寫入 並寫入全部暫存資料
+        """
+        self.stop_event.set()
+        if self.timer is not None:
+            self.timer.join()
+            self.timer = None
+        self.flush()
+
+
+class AsyncMongoBulkWriter(MongoBulkWriter):
+
+    def __init__(self, mongo_client, max_size: int = 1000, max_bytes: int = 8 * 1024 * 1024, max_seconds: float = 1.0, **kwargs) -> None:
+        """非同步版 MongoBulkWriter
+        mongo_client 為 AsyncIOMotorClient, add、flush、close 需使用 await, add 回傳 asyncio.Future
+        參數同 MongoBulkWriter
+        """
+        super().__init__(mongo_client, max_size=max_size, max_bytes=max_bytes, max_seconds=max_seconds, **kwargs)
+
+    def start_timer(self):
+        """啟動 定時寫入 task
+        """
+        if self.timer is None or self.timer.done():
+            # asyncio.Event 綁定執行中的 event loop, 每次啟動重新建立
+            self.stop_event = asyncio.Event()
+            self.timer = asyncio.create_task(self.flush_timer())
+
+    async def flush_timer(self):
+        """定時檢查 超過 max_seconds 的暫存資料並寫入
+        """
+        interval = max(self.max_seconds / 2, 0.05)
+        while True:
+            try:
+                await asyncio.wait_for(self.stop_event.wait(), interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            for database, collection in self.get_expired():
+                await self.flush(database, collection)
+
+    async def add(self, database: str, collection: str, operation, document: dict = None, query: dict = None, callback=None) -> asyncio.Future:
+        """加入 寫入操作
+
+        Args:
+            database (str): 資料庫
+            collection (str): 集合
+            operation (InsertOne | UpdateOne): 寫入操作
+            document (dict, optional): 寫入內容, 計算大小及錯誤訊息用. Defaults to None.
+            query (dict, optional): 查詢條件, 寫入完成前 is_pending 會回傳 True. Defaults to None.
+            callback (optional): 寫入完成後呼叫 callback(future). Defaults to None.
+
+        Returns:
+            asyncio.Future: 寫入成功為 True, 失敗則為寫入錯誤
+        """
+        future = asyncio.get_running_loop().create_future()
+        future.document = document
+        if callback:
+            future.add_done_callback(callback)
+
+        if self.append(database, collection, operation, future, document=document, query=query):
+            await self.flush(database, collection)
+        else:
+            self.start_timer()
+        return future
+
+    async def flush(self, database: str = None, collection: str = None):
+        """寫入 暫存資料, 未指定資料庫及集合時 寫入全部
+
+        Args:
+            database (str, optional): 資料庫. Defaults to None.
+            collection (str, optional): 集合. Defaults to None.
+        """
+        if database is None or collection is None:
+            with self.lock:
+                namespaces = list(self.buffers.keys())
+            for namespace in namespaces:
+                await self.flush(*namespace)
+            return
+
+        namespace = (database, collection)
+        flush_lock = self.flush_locks.setdefault(namespace, asyncio.Lock())
+
+        # 同一集合依序寫入, 避免新增與更新順序錯亂
+        async with flush_lock:
+            with self.lock:
+                buffer = self.buffers.pop(namespace, None)
+                if buffer is None:
+                    return
+                self.in_flight[namespace] = buffer['keys']
+
+            try:
+                await self.write(database, collection, buffer['operations'], buffer['futures'], buffer['bytes'])
+            finally:
+                with self.lock:
+                    self.in_flight.pop(namespace, None)
+
+    async def write(self, database: str, collection: str, operations: list, futures: list, nbytes: int = 0):
+        """執行 bulk_write, 並將結果對應回每筆資料
+
+        Args:
+            database (str): 資料庫
+            collection (str): 集合
+            operations (list): 寫入操作
+            futures (list): 對應的 asyncio.Future
+            nbytes (int, optional): 寫入位元組, 寫入速率限制用. Defaults to 0.
+        """
+        self.logger.info('批次寫入 mongodb %s.%s 筆數: %d', database, collection, len(operations))
+        if self.write_governor is not None:
+            await asyncio.sleep(self.write_governor.reserve(len(operations), nbytes))
+        start = time.monotonic()
+        try:
+            await self.mongo_client[database][collection].bulk_write(operations, ordered=False)
+            errors = {}
+        except BulkWriteError as err:
+            errors = self.get_write_errors(err)
+        except Exception as err:
+            self.set_exception(database, collection, futures, err, start)
+            return
+        self.set_results(database, collection, futures, errors, start)
+
+    async def close(self):
+        """停止定時寫入 並寫入全部暫存資料
+        """
+        if self.timer is not None:
+            # 等待 寫入中的批次完成
+            self.stop_event.set()
+            await self.timer
+            self.timer = None
+        await self.flush()
@@ -0,0 +1,216 @@
+from abc import ABC, abstractmethod
+from bson import json_util
+from datetime import datetime
+from threading import Lock
+from time import monotonic
+import os
+
+
+class CheckpointStore(ABC):
+
+    """抽象類別
+
+    進度紀錄儲存方式
+    """
+
+    @abstractmethod
+    def load(self, name: str):
+        """讀取 進度紀錄
+
+        Args:
+            name (str): 紀錄名稱
+
+        Returns:
+            dict: 進度紀錄, 不存在則為 None
+        """
+        pass
+
+    @abstractmethod
+    def save(self, name: str, state: dict):
+        """儲存 進度紀錄
+
+        Args:
+            name (str): 紀錄名稱
+            state (dict): 進度紀錄
+        """
+        pass
+
+    @abstractmethod
+    def delete(self, name: str):
+        """刪除 進度紀錄
+
+        Args:
+            name (str): 紀錄名稱
+        """
+        pass
+
+
+class FileCheckpointStore(CheckpointStore):
+
+    def __init__(self, path: str = os.path.join('checkpoints', 'checkpoint.json')) -> None:
+        """以本機 json 檔案儲存進度紀錄
+
+        Args:
+            path (str, optional): 檔案路徑. Defaults to checkpoints/checkpoint.json.
+        """
+        self.path = path
+        self.lock = Lock()
+
+    def read(self):
+        """讀取 全部進度紀錄
+
+        Returns:
+            dict: {紀錄名稱: 進度紀錄}
+        """
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return json_util.loads(f.read())
+
+    def write(self, states: dict):
+        """寫入 全部進度紀錄
+
+        Args:
+            states (dict): {紀錄名稱: 進度紀錄}
+        """
+        dir_name = os.path.dirname(self.path)
+        if dir_name and not os.path.exists(dir_name):
+            os.makedirs(dir_name)
+        # 先寫入暫存檔再取代 避免寫入途中中斷 檔案損毀
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json_util.dumps(states, json_options=json_util.CANONICAL_JSON_OPTIONS))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def load(self, name: str):
+        with self.lock:
+            return self.read().get(name)
+
+    def save(self, name: str, state: dict):
+        with self.lock:
+            states = self.read()
+            states[name] = state
+            self.write(states)
+
+    def delete(self, name: str):
+        with self.lock:
+            states = self.read()
+            if name in states:
+                del states[name]
+                self.write(states)
+
+
+class MongoCheckpointStore(CheckpointStore):
+
+    def __init__(self, mongo_client, database: str, collection: str = 'checkpoints') -> None:
+        """以 mongo 集合儲存進度紀錄
+
+        Args:
+            mongo_client (MongoClient): pymongo 連線物件
+            database (str): 資料庫
+            collection (str, optional): 集合. Defaults to 'checkpoints'.
+        """
+        self.col = mongo_client[database][collection]
+
+    def load(self, name: str):
+        state = self.col.find_one({'_id': name})
+        if state:
+            del state['_id']
+        return state
+
+    def save(self, name: str, state: dict):
+        self.col.replace_one({'_id': name}, state, upsert=True)
+
+    def delete(self, name: str):
+        self.col.delete_one({'_id': name})
+
+
+class CheckpointTracker():
+
+    def __init__(self, store: CheckpointStore, name: str, resume: bool = False, interval: float = 30, flush=None) -> None:
+        """追蹤 單一掃描的處理進度
+        批次可能不依序完成, 只記錄已連續完成的最後一批
+
+        Args:
+            store (CheckpointStore): 進度紀錄儲存方式
+            name (str): 紀錄名稱
+            resume (bool, optional): 是否讀取上次的進度紀錄. Defaults to False.
+            interval (float, optional): 儲存間隔秒數. Defaults to 30.
+            flush (optional): 儲存前執行, 確保已處理的資料寫入完成. Defaults to None.
+        """
+        self.store = store
+        self.name = name
+        self.interval = interval
+        self.flush = flush
+
+        self.state = store.load(name) if resume else None
+        if not self.state:
+            self.state = {
+                'last_key': None,
+                'last_id': None,
+                'count': 0,
+                'done': False,
+                'created': datetime.now(),
+                'updated': None
+            }
+
+        self.lock = Lock()
+        self.batches = {}
+        self.completed = set()
+        self.seq = 0
+        self.next_seq = 0
+        self.saved_time = monotonic()
+
+    def add(self, last_key, last_id, count: int):
+        """加入 讀取的批次
+
+        Args:
+            last_key (_type_): 批次最後一筆的 sort_key 值
+            last_id (_type_): 批次最後一筆的 _id 值
+            count (int): 批次筆數
+
+        Returns:
+            int: 批次編號
+        """
+        with self.lock:
+            seq = self.seq
+            self.batches[seq] = (last_key, last_id, count)
+            self.seq += 1
+            return seq
+
+    def complete(self, seq: int):
+        """批次處理完成
+
+        Args:
+            seq (int): 批次編號
+        """
+        with self.lock:
+            self.completed.add(seq)
+            while self.next_seq in self.completed:
+                last_key, last_id, count = self.batches.pop(self.next_seq)
+                self.completed.remove(self.next_seq)
+                self.state['last_key'] = last_key
+                self.state['last_id'] = last_id
+                self.state['count'] += count
+                self.next_seq += 1
+
+            if monotonic() - self.saved_time >= self.interval:
+                self.save()
+
+    def save(self):
+        """儲存 進度紀錄
+        """
+        if self.flush:
+            self.flush()
+        self.state['updated'] = datetime.now()
+        self.store.save(self.name, self.state)
+        self.saved_time = monotonic()
+
+    def finish(self):
+        """掃描完成
+        """
+        with self.lock:
+            self.state['done'] = True
+            self.save()
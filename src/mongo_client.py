@@ -0,0 +1,189 @@
+from src.logger import Log
+from src.mongo_pattern import MongoUriPattern
+
+from pymongo import MongoClient
+from threading import Lock
+import atexit
+import os
+import re
+
+
+def normalize_mongo_uri(uri: str):
+    """統一 mongo uri 格式, 相同連線設定的 uri 轉換後相同
+    補上 mongodb://, 主機名稱轉小寫並排序, 連線參數排序
+
+    Args:
+        uri (str): mongo uri
+
+    Returns:
+        str: 統一格式的 mongo uri
+    """
+    uri = uri.strip()
+    if '://' not in uri:
+        uri = f'mongodb://{uri}'
+    scheme, rest = uri.split('://', 1)
+    rest, _, options = rest.partition('?')
+    rest, _, database = rest.partition('/')
+    userinfo, at, hosts = rest.rpartition('@')
+    hosts = ','.join(sorted(host.lower() for host in hosts.split(',') if host))
+    uri = f'{scheme.lower()}://{userinfo}{at}{hosts}/{database}'
+    if options:
+        uri = f'{uri}?{"&".join(sorted(option for option in options.split("&") if option))}'
+    return uri
+
+
+def generate_mongo_uri(host: str = '127.0.0.1', port: str = '27017', username: str = None, password: str = None):
+    """依連線設定 生成 mongo uri
+    host 已是 uri 或 主機:埠號 時直接使用
+
+    Args:
+        host (str, optional): 主機 或 uri. Defaults to '127.0.0.1'.
+        port (str, optional): 埠號. Defaults to '27017'.
+        username (str, optional): 帳號. Defaults to None.
+        password (str, optional): 密碼. Defaults to None.
+
+    Returns:
+        str: 統一格式的 mongo uri
+    """
+    if bool(MongoUriPattern.uri_pattern.match(host)):
+        uri = host
+    elif bool(MongoUriPattern.ip_pattern.match(host)):
+        uri = host
+    elif bool(MongoUriPattern.host_pattern.match(host)):
+        uri = host
+    else:
+        if port:
+            uri = f'{host}:{port}'
+        else:
+            uri = f'{host}'
+
+        if username and password:
+            uri = f'{username}:{password}@{uri}'
+    return normalize_mongo_uri(uri)
+
+
+def mask_mongo_uri(uri: str):
+    """隱藏 uri 中的帳號密碼, 顯示用
+
+    Args:
+        uri (str): mongo uri
+
+    Returns:
+        str: 隱藏帳號密碼的 uri
+    """
+    return re.sub(r'://[^@/]*@', '://***@', uri)
+
+
+class MongoClientRegistry():
+
+    def __init__(self, **kwargs) -> None:
+        """共用 mongo 連線
+        相同 (uri, 連線參數) 共用同一個 MongoClient, 以參考計數管理, 無人使用時關閉
+        MongoClient 為 thread-safe 且自帶連線池, 不需每個物件各自建立
+
+        Args:
+            log_level (str, optional): log等級. Defaults to WARNING.
+        """
+        self.logger = Log('MongoClientRegistry')
+        self.logger.set_level(str(kwargs.get('log_level', 'WARNING')).upper())
+        self.logger.set_msg_handler()
+
+        # {(uri, 連線參數): [MongoClient, 參考計數]}
+        self.clients = {}
+        # {id(MongoClient): (uri, 連線參數)}
+        self.keys = {}
+        self.lock = Lock()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self.reset_after_fork)
+
+    def reset_after_fork(self):
+        """子程序 (fork) 不可使用主程序的連線, 清除紀錄 重新建立
+        """
+        self.clients = {}
+        self.keys = {}
+        self.lock = Lock()
+
+    def generate_key(self, uri: str, options: dict):
+        """生成 共用連線的 key
+
+        Args:
+            uri (str): mongo uri
+            options (dict): MongoClient 連線參數
+
+        Returns:
+            tuple: (統一格式的 uri, 連線參數)
+        """
+        return (
+            normalize_mongo_uri(uri),
+            tuple(sorted((key, repr(value)) for key, value in options.items()))
+        )
+
+    def get_client(self, uri: str, **options) -> MongoClient:
+        """取得 共用連線, 參考計數加一
+
+        Args:
+            uri (str): mongo uri
+            options: MongoClient 連線參數
+
+        Returns:
+            MongoClient: pymongo 連線物件
+        """
+        key = self.generate_key(uri, options)
+        with self.lock:
+            entry = self.clients.get(key)
+            if entry is None:
+                self.logger.info(f'建立 mongo 連線 {mask_mongo_uri(key[0])}')
+                # MongoClient 建立時不會等待連線 在背景連線
+                entry = [MongoClient(key[0], **options), 0]
+                self.clients[key] = entry
+                self.keys[id(entry[0])] = key
+            entry[1] += 1
+            return entry[0]
+
+    def release_client(self, mongo_client: MongoClient):
+        """釋放 共用連線, 參考計數減一, 無人使用時關閉
+        非共用的連線直接關閉
+
+        Args:
+            mongo_client (MongoClient): pymongo 連線物件
+        """
+        with self.lock:
+            key = self.keys.get(id(mongo_client))
+            entry = self.clients.get(key) if key else None
+            if entry is None or entry[0] is not mongo_client:
+                mongo_client.close()
+                return
+            entry[1] -= 1
+            if entry[1] > 0:
+                return
+            del self.clients[key]
+            del self.keys[id(mongo_client)]
+        self.logger.info(f'關閉 mongo 連線 {mask_mongo_uri(key[0])}')
+        mongo_client.close()
+
+    def get_reference_counts(self):
+        """取得 各連線的參考計數
+
+        Returns:
+            dict: {uri: 參考計數}, uri 隱藏帳號密碼, 相同 uri 不同連線參數的計數合計
+        """
+        counts = {}
+        with self.lock:
+            for key, entry in self.clients.items():
+                uri = mask_mongo_uri(key[0])
+                counts[uri] = counts.get(uri, 0) + entry[1]
+        return counts
+
+    def close_all(self):
+        """關閉 全部共用連線
+        """
+        with self.lock:
+            entries = list(self.clients.values())
+            self.clients = {}
+            self.keys = {}
+        for mongo_client, _ in entries:
+            mongo_client.close()
+
+
+client_registry = MongoClientRegistry()
+atexit.register(client_registry.close_all)
@@ -12,3 +12,16 @@ class MongoSyncFunc(ABC):
     @abstractmethod
     def mongo_func(self, data, **kwargs):
         pass
+
+
+class AsyncMongoSyncFunc(ABC):
+
+    """抽象類別
+
+    使用 AsyncMongoSync 類別
+    加入 funcs 的規範
+    """
+
+    @abstractmethod
+    async def mongo_func(self, data, **kwargs):
+        pass
@@ -0,0 +1,255 @@
+from src.logger import Log
+
+from threading import Event, Lock, Thread
+from time import monotonic, sleep
+
+
+class WriteGovernor():
+
+    def __init__(self, ops_per_sec: float = 1000, bytes_per_sec: float = None, min_scale: float = 0.05, max_scale: float = 10, target_latency: float = 0.1, max_lag: float = None, **kwargs) -> None:
+        """寫入速率限制, 同一次執行的全部處理函式共用
+        以 token bucket 限制每秒寫入筆數及位元組, 並依寫入延遲 (及 secondary 延遲) 以 AIMD 調整速率:
+        延遲正常且已用滿速率時 每次增加 increase, 延遲過高、寫入錯誤或 secondary 延遲過大時 乘以 decrease
+
+        Args:
+            ops_per_sec (float, optional): 初始每秒寫入筆數. Defaults to 1000.
+            bytes_per_sec (float, optional): 初始每秒寫入位元組, None 為不限制. Defaults to None.
+            min_scale (float, optional): 速率最低為初始的幾倍. Defaults to 0.05.
+            max_scale (float, optional): 速率最高為初始的幾倍. Defaults to 10.
+            target_latency (float, optional): 單筆寫入 (insert_one / update_one) 的目標延遲秒數. Defaults to 0.1.
+            target_batch_latency (float, optional): 多筆寫入 (bulk_write) 每筆的目標延遲秒數, 整批延遲除以筆數後比較. Defaults to 0.01.
+            max_lag (float, optional): secondary 最大延遲秒數, 需帶入 mongo_client, None 為不檢查. Defaults to None.
+            mongo_client (MongoClient, optional): 檢查 replSetGetStatus 用的連線, start 前需設定. Defaults to None.
+            lag_interval (float, optional): 檢查 secondary 延遲間隔秒數, start 後在背景執行緒檢查. Defaults to 10.
+            increase (float, optional): 每次增加的倍數. Defaults to 0.1.
+            decrease (float, optional): 每次減少時乘以的倍數. Defaults to 0.5.
+            adjust_seconds (float, optional): 調整間隔秒數. Defaults to 1.
+            burst_seconds (float, optional): 閒置後最多累積幾秒的額度. Defaults to 1.
+            metrics (MongoMetrics, optional): 統計, 以 WriteGovernor 紀錄目前速率及 secondary 延遲. Defaults to None.
+            log_level (str, optional): log等級. Defaults to WARNING.
+        """
+        self.logger = Log('WriteGovernor')
+        self.logger.set_level(str(kwargs.get('log_level', 'WARNING')).upper())
+        self.logger.set_msg_handler()
+
+        self.ops_per_sec = ops_per_sec
+        self.bytes_per_sec = bytes_per_sec
+        self.min_scale = min_scale
+        self.max_scale = max(max_scale, min_scale)
+        self.target_latency = target_latency
+        self.target_batch_latency = float(kwargs.get('target_batch_latency', 0.01))
+        self.max_lag = max_lag
+        self.mongo_client = kwargs.get('mongo_client')
+        self.lag_interval = float(kwargs.get('lag_interval', 10))
+        self.increase = float(kwargs.get('increase', 0.1))
+        self.decrease = float(kwargs.get('decrease', 0.5))
+        self.adjust_seconds = float(kwargs.get('adjust_seconds', 1))
+        self.burst_seconds = float(kwargs.get('burst_seconds', 1))
+        self.metrics = kwargs.get('metrics')
+
+        self.lock = Lock()
+        self.scale = min(max(1.0, self.min_scale), self.max_scale)
+        now = monotonic()
+        self.ops_tokens = self.ops_per_sec * self.burst_seconds
+        self.bytes_tokens = (self.bytes_per_sec or 0) * self.burst_seconds
+        self.updated = now
+
+        # 目前調整區間的寫入統計, 單筆寫入 (count, seconds) 與 多筆寫入 (batches, batch_seconds, batch_ops) 分開計算延遲
+        self.window = self.create_window(now)
+        self.lag = None
+        self.lag_checked = None
+        self.stop_event = Event()
+        self.lag_thread = None
+        self.stats = {'throttled': 0, 'wait_seconds': 0.0, 'increases': 0, 'decreases': 0}
+
+    def create_window(self, now: float):
+        """建立 調整區間的寫入統計
+
+        Args:
+            now (float): monotonic 時間
+
+        Returns:
+            dict: _description_
+        """
+        return {'started': now, 'count': 0, 'seconds': 0.0, 'batches': 0, 'batch_seconds': 0.0, 'batch_ops': 0, 'ops': 0, 'errors': 0}
+
+    def get_rates(self):
+        """取得 目前速率, 需在 lock 內執行
+
+        Returns:
+            tuple: (每秒筆數, 每秒位元組 或 None)
+        """
+        bytes_rate = self.bytes_per_sec * self.scale if self.bytes_per_sec else None
+        return self.ops_per_sec * self.scale, bytes_rate
+
+    def refill(self, now: float):
+        """補充額度, 需在 lock 內執行
+
+        Args:
+            now (float): monotonic 時間
+        """
+        elapsed = now - self.updated
+        self.updated = now
+        ops_rate, bytes_rate = self.get_rates()
+        self.ops_tokens = min(self.ops_tokens + elapsed * ops_rate, ops_rate * self.burst_seconds)
+        if bytes_rate:
+            self.bytes_tokens = min(self.bytes_tokens + elapsed * bytes_rate, bytes_rate * self.burst_seconds)
+
+    def reserve(self, ops: int = 1, nbytes: int = 0):
+        """預約額度, 不等待 (非同步模式 以 asyncio.sleep 等待回傳秒數)
+        額度可預支 (ex: bulk_write 筆數大於每秒筆數), 之後的寫入依序等待
+
+        Args:
+            ops (int, optional): 寫入筆數. Defaults to 1.
+            nbytes (int, optional): 寫入位元組. Defaults to 0.
+
+        Returns:
+            float: 需等待秒數
+        """
+        with self.lock:
+            self.refill(monotonic())
+            ops_rate, bytes_rate = self.get_rates()
+            self.ops_tokens -= ops
+            wait = max(-self.ops_tokens / ops_rate, 0)
+            if bytes_rate:
+                self.bytes_tokens -= nbytes
+                wait = max(wait, -self.bytes_tokens / bytes_rate)
+            if wait > 0:
+                self.stats['throttled'] += 1
+                self.stats['wait_seconds'] += wait
+        return wait
+
+    def acquire(self, ops: int = 1, nbytes: int = 0):
+        """寫入前取得額度, 額度不足時等待
+
+        Args:
+            ops (int, optional): 寫入筆數. Defaults to 1.
+            nbytes (int, optional): 寫入位元組. Defaults to 0.
+
+        Returns:
+            float: 等待秒數
+        """
+        wait = self.reserve(ops, nbytes)
+        if wait > 0:
+            sleep(wait)
+        return wait
+
+    def observe(self, seconds: float, ops: int = 1, error: bool = False):
+        """紀錄 寫入結果, 每 adjust_seconds 秒調整一次速率
+
+        Args:
+            seconds (float): 寫入秒數
+            ops (int, optional): 寫入筆數. Defaults to 1.
+            error (bool, optional): 是否寫入錯誤. Defaults to False.
+        """
+        with self.lock:
+            if ops > 1:
+                self.window['batches'] += 1
+                self.window['batch_seconds'] += seconds
+                self.window['batch_ops'] += ops
+            else:
+                self.window['count'] += 1
+                self.window['seconds'] += seconds
+            self.window['ops'] += ops
+            if error:
+                self.window['errors'] += 1
+
+            now = monotonic()
+            if now - self.window['started'] >= self.adjust_seconds:
+                self.adjust(now)
+
+    def adjust(self, now: float):
+        """依調整區間的寫入統計 調整速率, 需在 lock 內執行
+
+        Args:
+            now (float): monotonic 時間
+        """
+        window = self.window
+        self.window = self.create_window(now)
+        if window['count'] == 0 and window['batches'] == 0:
+            return
+
+        # 單筆寫入 以每次延遲比較, 多筆寫入 以整批延遲除以筆數比較, 避免 bulk_write 整批延遲一定超過單筆的目標
+        latency = window['seconds'] / window['count'] if window['count'] else 0
+        batch_latency = window['batch_seconds'] / window['batch_ops'] if window['batch_ops'] else 0
+        slow = latency > self.target_latency or batch_latency > self.target_batch_latency
+        ops_rate, _ = self.get_rates()
+        if window['errors'] or slow or (self.max_lag is not None and self.lag is not None and self.lag > self.max_lag):
+            scale = max(self.scale * self.decrease, self.min_scale)
+            if scale < self.scale:
+                self.stats['decreases'] += 1
+                self.logger.info('降低寫入速率 %.0f -> %.0f 筆/秒 延遲: %.3f 秒 每筆批次延遲: %.4f 秒 錯誤: %d secondary 延遲: %s',
+                                 ops_rate, self.ops_per_sec * scale, latency, batch_latency, window['errors'], self.lag)
+        elif window['ops'] >= ops_rate * (now - window['started']) * 0.8:
+            # 已接近用滿速率時 才增加, 避免閒置時速率無限增加
+            scale = min(self.scale + self.increase, self.max_scale)
+            if scale > self.scale:
+                self.stats['increases'] += 1
+        else:
+            scale = self.scale
+        self.refill(now)
+        self.scale = scale
+        if self.metrics is not None:
+            self.metrics.set_gauge('WriteGovernor', 'ops_per_sec', self.ops_per_sec * self.scale)
+
+    def start(self):
+        """開始 在背景執行緒 每 lag_interval 秒檢查 secondary 延遲, 寫入的執行緒不需等待檢查
+        未設定 max_lag 或 mongo_client 時 不檢查
+        """
+        if self.max_lag is None or self.mongo_client is None or self.lag_thread is not None:
+            return
+        self.stop_event.clear()
+        self.lag_thread = Thread(target=self.poll_lag, name='WriteGovernor.lag', daemon=True)
+        self.lag_thread.start()
+
+    def stop(self):
+        """停止 檢查 secondary 延遲
+        """
+        self.stop_event.set()
+        if self.lag_thread is not None:
+            self.lag_thread.join()
+            self.lag_thread = None
+
+    def poll_lag(self):
+        """背景執行緒 定時檢查 secondary 延遲, 檢查失敗 (max_lag 設為 None) 時結束
+        """
+        while self.max_lag is not None and not self.stop_event.is_set():
+            self.check_lag()
+            self.stop_event.wait(self.lag_interval)
+
+    def check_lag(self):
+        """以 replSetGetStatus 取得 secondary 最大延遲秒數
+        非 replica set 或無權限時 停止檢查
+        """
+        lag = None
+        try:
+            status = self.mongo_client.admin.command('replSetGetStatus')
+            members = status.get('members', [])
+            primary = [member['optimeDate'] for member in members if member.get('stateStr') == 'PRIMARY' and member.get('optimeDate')]
+            secondaries = [member['optimeDate'] for member in members if member.get('stateStr') == 'SECONDARY' and member.get('optimeDate')]
+            if primary and secondaries:
+                lag = max((primary[0] - optime).total_seconds() for optime in secondaries)
+        except Exception as err:
+            self.logger.warning(f'取得 secondary 延遲 發生錯誤, 停止檢查: {err}')
+            self.max_lag = None
+        with self.lock:
+            self.lag = lag
+            self.lag_checked = monotonic()
+        if self.metrics is not None and lag is not None:
+            self.metrics.set_gauge('WriteGovernor', 'replication_lag_seconds', lag)
+
+    def get_stats(self):
+        """取得 統計
+
+        Returns:
+            dict: 目前速率、被限制次數、等待秒數、增減次數、secondary 延遲
+        """
+        with self.lock:
+            ops_rate, bytes_rate = self.get_rates()
+            return {
+                'ops_per_sec': ops_rate,
+                'bytes_per_sec': bytes_rate,
+                'scale': self.scale,
+                'lag': self.lag,
+                **self.stats
+            }
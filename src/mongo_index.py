@@ -0,0 +1,145 @@
+from src.logger import Log
+
+from threading import Lock
+
+
+class MongoIndexRegistry():
+
+    def __init__(self, **kwargs) -> None:
+        """索引紀錄
+        依 (連線, 資料庫, 集合) 快取已存在的索引, 只在第一次使用時讀取 index_information,
+        建立索引後清除該集合的快取
+
+        Args:
+            log_level (str, optional): log等級. Defaults to WARNING.
+        """
+        self.logger = Log('MongoIndexRegistry')
+        self.logger.set_level(str(kwargs.get('log_level', 'WARNING')).upper())
+        self.logger.set_msg_handler()
+
+        # {(mongo_client, database, collection): set(索引欄位)}
+        self.indexes = {}
+        # 每個集合一個 lock, 避免同時讀取或建立同一集合的索引
+        self.locks = {}
+        self.lock = Lock()
+
+    def get_lock(self, key: tuple):
+        """取得 集合的 lock
+
+        Args:
+            key (tuple): (mongo_client, database, collection)
+
+        Returns:
+            Lock: _description_
+        """
+        with self.lock:
+            if key not in self.locks:
+                self.locks[key] = Lock()
+            return self.locks[key]
+
+    def generate_key_spec(self, index):
+        """索引欄位 轉為可比對的格式
+        'name' 與 [('name', 1)] 視為相同索引
+
+        Args:
+            index (str | list | tuple | dict): 索引欄位, create_index 可接受的格式
+
+        Returns:
+            tuple: ((欄位, 方向), ...)
+        """
+        if isinstance(index, str):
+            return ((index, 1),)
+        if isinstance(index, dict):
+            return tuple(index.items())
+        if isinstance(index, tuple) and len(index) == 2 and isinstance(index[0], str) and not isinstance(index[1], (list, tuple)):
+            return (index,)
+        return tuple(
+            (item, 1) if isinstance(item, str) else tuple(item)
+            for item in index
+        )
+
+    def get_missing(self, mongo_client, database: str, collection: str, index_names: list):
+        """取得 尚未建立的索引
+
+        Args:
+            mongo_client (MongoClient): pymongo 連線物件
+            database (str): 資料庫
+            collection (str): 集合
+            index_names (list): 索引欄位
+
+        Returns:
+            list: 尚未建立的索引, 尚未讀取索引資訊則為 None
+        """
+        with self.lock:
+            existing = self.indexes.get((mongo_client, database, collection))
+        if existing is None:
+            return None
+        specs = [self.generate_key_spec(index) for index in index_names]
+        return [spec for spec in specs if spec not in existing]
+
+    def set_index_information(self, mongo_client, database: str, collection: str, index_information: dict):
+        """紀錄 集合的索引資訊
+
+        Args:
+            mongo_client (MongoClient): pymongo 連線物件
+            database (str): 資料庫
+            collection (str): 集合
+            index_information (dict): col.index_information() 的結果
+        """
+        existing = set(
+            tuple((field, direction) for field, direction in info['key'])
+            for info in index_information.values()
+        )
+        with self.lock:
+            self.indexes[(mongo_client, database, collection)] = existing
+
+    def invalidate(self, mongo_client, database: str, collection: str):
+        """清除 集合的索引快取
+
+        Args:
+            mongo_client (MongoClient): pymongo 連線物件
+            database (str): 資料庫
+            collection (str): 集合
+        """
+        with self.lock:
+            self.indexes.pop((mongo_client, database, collection), None)
+
+    def ensure_indexes(self, mongo_client, database: str, collection: str, index_names: list = [], test: bool = False):
+        """建立索引 若不存在則建立
+
+        Args:
+            mongo_client (MongoClient): pymongo 連線物件
+            database (str): 資料庫
+            collection (str): 集合
+            index_names (list, optional): 索引欄位. Defaults to [].
+            test (bool, optional): 測試模式 不建立索引. Defaults to False.
+
+        Returns:
+            list: 建立的索引
+        """
+        if len(index_names) == 0:
+            return []
+        missing = self.get_missing(mongo_client, database, collection, index_names)
+        if missing is not None and len(missing) == 0:
+            return []
+
+        created = []
+        with self.get_lock((mongo_client, database, collection)):
+            col = mongo_client[database][collection]
+            # 取得 lock 後重新確認, 其他執行緒可能已建立
+            missing = self.get_missing(mongo_client, database, collection, index_names)
+            if missing is None:
+                self.set_index_information(mongo_client, database, collection, col.index_information())
+                missing = self.get_missing(mongo_client, database, collection, index_names)
+            if test:
+                return []
+            for spec in missing:
+                self.logger.info(f'新增 index {database}.{collection}: {list(spec)}')
+                col.create_index(list(spec))
+                created.append(spec)
+            if created:
+                self.invalidate(mongo_client, database, collection)
+        return created
+
+
+index_registry = MongoIndexRegistry()
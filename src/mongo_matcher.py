@@ -0,0 +1,370 @@
+from bson import Decimal128, ObjectId, Regex, Timestamp
+from collections.abc import Mapping
+from datetime import datetime
+import bson
+import re
+
+
+class MongoQueryMatcher():
+
+    """
+        在記憶體中 比對資料是否符合 mongo 查詢條件
+        支援 欄位相等、$eq $ne $gt $gte $lt $lte $in $nin $exists $regex 及 $and $or $nor,
+        a.b 巢狀欄位會展開陣列 (同 mongo), 不同 BSON 型別 (ex: 數字與字串、數字與布林) 不相等也不比較大小
+    """
+
+    comparison_operators = ('$eq', '$ne', '$gt', '$gte', '$lt', '$lte', '$in', '$nin', '$exists', '$regex', '$options')
+    logical_operators = ('$and', '$or', '$nor')
+
+    # $options 對應的 re flags
+    regex_flags = {'i': re.IGNORECASE, 'm': re.MULTILINE, 's': re.DOTALL, 'x': re.VERBOSE}
+
+    def get_value(self, data: dict, key: str, default=None):
+        """取得欄位值, 支援 a.b 巢狀欄位 (不展開陣列)
+
+        Args:
+            data (dict): 資料
+            key (str): 欄位名稱
+            default (optional): 不存在時的回傳值. Defaults to None.
+
+        Returns:
+            _type_: 欄位值, 不存在則為 default
+        """
+        value = data
+        for name in key.split('.'):
+            if not isinstance(value, Mapping) or name not in value:
+                return default
+            value = value[name]
+        return value
+
+    def get_values(self, value, names: list):
+        """取得 巢狀欄位的全部值, 路徑經過陣列時 展開陣列中的子文件 (ex: items.no 取得每個 items 元素的 no)
+        數字名稱同時作為陣列索引 (ex: items.0.no)
+
+        Args:
+            value (_type_): 資料
+            names (list): 欄位路徑 ex: ['items', 'no']
+
+        Returns:
+            list: 欄位值, 不存在則為空 list
+        """
+        if len(names) == 0:
+            return [value]
+        name, rest = names[0], names[1:]
+        if isinstance(value, Mapping):
+            if name in value:
+                return self.get_values(value[name], rest)
+            return []
+        if isinstance(value, list):
+            values = []
+            if name.isdigit() and int(name) < len(value):
+                values += self.get_values(value[int(name)], rest)
+            for item in value:
+                if isinstance(item, Mapping):
+                    values += self.get_values(item, names)
+            return values
+        return []
+
+    def generate_key(self, query: dict):
+        """生成 查詢條件 識別值
+
+        Args:
+            query (dict): 查詢條件
+
+        Returns:
+            bytes: 識別值
+        """
+        return bson.encode(query)
+
+    def is_operator(self, value):
+        """是否為 運算子條件 ex: {'$gt': 1}
+
+        Args:
+            value (_type_): 欄位的查詢條件
+
+        Returns:
+            bool: _description_
+        """
+        return isinstance(value, dict) and any(str(name).startswith('$') for name in value.keys())
+
+    def is_regex(self, value):
+        """是否為 正規表示式
+
+        Args:
+            value (_type_): 查詢值
+
+        Returns:
+            bool: _description_
+        """
+        return isinstance(value, (re.Pattern, Regex))
+
+    def is_equality(self, query: dict):
+        """查詢條件 是否只包含欄位相等比對 ex: {'comic_id': 1, 'info.type': 'a'}
+
+        Args:
+            query (dict): 查詢條件
+
+        Returns:
+            bool: _description_
+        """
+        for key, value in query.items():
+            if key.startswith('$'):
+                return False
+            if self.is_operator(value) or self.is_regex(value):
+                return False
+        return True
+
+    def is_supported(self, query: dict):
+        """查詢條件 是否可在記憶體中比對
+
+        Args:
+            query (dict): 查詢條件
+
+        Returns:
+            bool: _description_
+        """
+        for key, value in query.items():
+            if key in self.logical_operators:
+                if not isinstance(value, (list, tuple)) or not all(isinstance(item, dict) and self.is_supported(item) for item in value):
+                    return False
+            elif key.startswith('$'):
+                return False
+            elif self.is_operator(value):
+                if not all(name in self.comparison_operators for name in value.keys()):
+                    return False
+                if '$options' in value and '$regex' not in value:
+                    return False
+                if '$regex' in value and not isinstance(value['$regex'], (str, re.Pattern, Regex)):
+                    return False
+        return True
+
+    def get_fields(self, query: dict):
+        """取得 查詢條件使用的欄位
+
+        Args:
+            query (dict): 查詢條件
+
+        Returns:
+            list: 欄位名稱
+        """
+        fields = []
+        for key, value in query.items():
+            if key in self.logical_operators:
+                for item in value:
+                    fields += [field for field in self.get_fields(item) if field not in fields]
+            elif key not in fields:
+                fields.append(key)
+        return fields
+
+    def get_type_order(self, value):
+        """取得 BSON 型別順序, 相同順序的值才可比較 (數字 int/float/Decimal128 為同一類, 布林另為一類)
+
+        Args:
+            value (_type_): 值
+
+        Returns:
+            int: 型別順序, 不支援的型別為 None
+        """
+        if value is None:
+            return 2
+        if isinstance(value, bool):
+            return 9
+        if isinstance(value, (int, float, Decimal128)):
+            return 3
+        if isinstance(value, str):
+            return 4
+        if isinstance(value, Mapping):
+            return 5
+        if isinstance(value, (list, tuple)):
+            return 6
+        if isinstance(value, bytes):
+            return 7
+        if isinstance(value, ObjectId):
+            return 8
+        if isinstance(value, datetime):
+            return 10
+        if isinstance(value, Timestamp):
+            return 11
+        if self.is_regex(value):
+            return 12
+        return None
+
+    def to_comparable(self, value):
+        """轉為 Python 可比較的值 (Decimal128 轉為 Decimal)
+
+        Args:
+            value (_type_): 值
+
+        Returns:
+            _type_: _description_
+        """
+        if isinstance(value, Decimal128):
+            return value.to_decimal()
+        return value
+
+    def equals(self, value, target):
+        """值 是否相等, 不同 BSON 型別不相等, 子文件需欄位順序相同
+
+        Args:
+            value (_type_): 資料值
+            target (_type_): 查詢值
+
+        Returns:
+            bool: _description_
+        """
+        type_order = self.get_type_order(value)
+        if type_order != self.get_type_order(target):
+            return False
+        if type_order == 5:
+            return list(value.keys()) == list(target.keys()) and all(self.equals(value[key], target[key]) for key in value)
+        if type_order == 6:
+            return len(value) == len(target) and all(self.equals(item, target_item) for item, target_item in zip(value, target))
+        return self.to_comparable(value) == self.to_comparable(target)
+
+    def compare(self, value, operator: str, target):
+        """比較 單一值, 不同 BSON 型別 (ex: 數字與字串、數字與布林) 視為不符合
+
+        Args:
+            value (_type_): 資料值
+            operator (str): $eq $gt $gte $lt $lte
+            target (_type_): 查詢值
+
+        Returns:
+            bool: _description_
+        """
+        if operator == '$eq':
+            if self.is_regex(target):
+                return isinstance(value, str) and self.compile_regex(target).search(value) is not None
+            return self.equals(value, target)
+        if operator not in ('$gt', '$gte', '$lt', '$lte'):
+            raise ValueError(f'不支援的查詢條件: {operator}')
+        type_order = self.get_type_order(value)
+        if type_order is None or type_order != self.get_type_order(target):
+            return False
+        if type_order == 2:
+            # null 只有 $gte $lte 符合
+            return operator in ('$gte', '$lte')
+        value = self.to_comparable(value)
+        target = self.to_comparable(target)
+        try:
+            if operator == '$gt':
+                return value > target
+            if operator == '$gte':
+                return value >= target
+            if operator == '$lt':
+                return value < target
+            return value <= target
+        except TypeError:
+            return False
+
+    def compile_regex(self, pattern, options: str = ''):
+        """轉為 re.Pattern
+
+        Args:
+            pattern (str | re.Pattern | Regex): 正規表示式
+            options (str, optional): $options ex: 'i'. Defaults to ''.
+
+        Returns:
+            re.Pattern: _description_
+        """
+        if isinstance(pattern, Regex):
+            pattern = pattern.try_compile()
+        flags = 0
+        for option in options or '':
+            flags |= self.regex_flags.get(option, 0)
+        if isinstance(pattern, re.Pattern):
+            if not flags:
+                return pattern
+            return re.compile(pattern.pattern, pattern.flags | flags)
+        return re.compile(pattern, flags)
+
+    def match_value(self, values: list, operator: str, target):
+        """欄位值 是否符合條件, 陣列欄位 整個陣列或任一元素符合即可
+
+        Args:
+            values (list): get_values 取得的欄位值, 不存在為空 list
+            operator (str): 運算子
+            target (_type_): 查詢值
+
+        Returns:
+            bool: _description_
+        """
+        if operator == '$exists':
+            return (len(values) > 0) == bool(target)
+        if operator == '$ne':
+            return not self.match_value(values, '$eq', target)
+        if operator == '$in':
+            return any(self.match_value(values, '$eq', item) for item in target)
+        if operator == '$nin':
+            return not self.match_value(values, '$in', target)
+
+        if len(values) == 0:
+            # 欄位不存在 等同 null
+            return target is None and operator in ('$eq', '$gte', '$lte')
+        for value in values:
+            if self.compare(value, operator, target):
+                return True
+            if isinstance(value, list) and any(self.compare(item, operator, target) for item in value):
+                return True
+        return False
+
+    def match_operators(self, values: list, operators: dict):
+        """欄位值 是否符合全部運算子條件 ex: {'$gt': 1, '$lt': 5}
+
+        Args:
+            values (list): get_values 取得的欄位值
+            operators (dict): 運算子條件
+
+        Returns:
+            bool: _description_
+        """
+        for operator, target in operators.items():
+            if operator == '$options':
+                continue
+            if operator == '$regex':
+                operator = '$eq'
+                target = self.compile_regex(target, operators.get('$options', ''))
+            if not self.match_value(values, operator, target):
+                return False
+        return True
+
+    def match(self, data: dict, query: dict):
+        """資料 是否符合查詢條件
+
+        Args:
+            data (dict): 資料
+            query (dict): 查詢條件
+
+        Returns:
+            bool: _description_
+        """
+        if not self.is_supported(query):
+            raise ValueError(f'不支援的查詢條件: {query}')
+        return self.match_query(data, query)
+
+    def match_query(self, data: dict, query: dict):
+        """資料 是否符合查詢條件, 不檢查是否支援 (已確認 is_supported 時使用)
+
+        Args:
+            data (dict): 資料
+            query (dict): 查詢條件
+
+        Returns:
+            bool: _description_
+        """
+        for key, value in query.items():
+            if key == '$and':
+                if not all(self.match_query(data, item) for item in value):
+                    return False
+            elif key == '$or':
+                if not any(self.match_query(data, item) for item in value):
+                    return False
+            elif key == '$nor':
+                if any(self.match_query(data, item) for item in value):
+                    return False
+            elif self.is_operator(value):
+                if not self.match_operators(self.get_values(data, key.split('.')), value):
+                    return False
+            elif not self.match_value(self.get_values(data, key.split('.')), '$eq', value):
+                return False
+        return True
@@ -0,0 +1,484 @@
+from src.logger import Log
+
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Event, Lock, Thread
+from time import monotonic
+import os
+
+
+class MongoHistogram():
+
+    # 延遲區間上限 (秒)
+    buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+
+    def __init__(self) -> None:
+        """延遲分布, 依區間累計次數
+        """
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        """紀錄 一次延遲
+
+        Args:
+            seconds (float): 秒數
+        """
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def export(self):
+        """轉為 dict, 多程序模式 子程序回傳給主程序
+
+        Returns:
+            dict: {'counts', 'count', 'sum', 'max'}
+        """
+        return {'counts': list(self.counts), 'count': self.count, 'sum': self.sum, 'max': self.max}
+
+    def merge(self, data: dict):
+        """合併 其他延遲分布 (export 的結果)
+
+        Args:
+            data (dict): export 的結果
+        """
+        self.counts = [count + other for count, other in zip(self.counts, data['counts'])]
+        self.count += data['count']
+        self.sum += data['sum']
+        self.max = max(self.max, data['max'])
+
+    def quantile(self, q: float):
+        """估計 百分位數, 以所在區間的上限表示
+
+        Args:
+            q (float): 0 ~ 1
+
+        Returns:
+            float: 秒數
+        """
+        if self.count == 0:
+            return 0
+        target = q * self.count
+        total = 0
+        for bucket, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= target:
+                return min(bucket, self.max)
+        return self.max
+
+    def get_stats(self):
+        """取得 統計
+
+        Returns:
+            dict: count, avg, p50, p99, max (秒)
+        """
+        return {
+            'count': self.count,
+            'avg': self.sum / self.count if self.count else 0,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+            'max': self.max
+        }
+
+
+class MongoMetrics():
+
+    # 計數項目
+    # read: 讀取筆數, processed: 處理筆數, inserted / updated / unchanged: save_to_mongo 結果, errors: 錯誤次數
+    counter_names = ['read', 'processed', 'inserted', 'updated', 'unchanged', 'errors']
+    # 延遲項目
+    # fetch: 讀取一批資料, func: 執行一次處理函式, write: 寫入一次 (批次寫入為一批)
+    histogram_names = ['fetch', 'func', 'write']
+
+    def __init__(self, **kwargs) -> None:
+        """處理量及延遲統計
+        依名稱 (處理函式) 分開紀錄, 可輸出 Prometheus 文字格式檔案 或 定時記錄摘要
+
+        Args:
+            log_level (str, optional): log等級. Defaults to WARNING.
+        """
+        self.logger = Log('MongoMetrics')
+        self.logger.set_level(str(kwargs.get('log_level', 'WARNING')).upper())
+        self.logger.set_msg_handler()
+
+        self.lock = Lock()
+        # {名稱: Counter}
+        self.counters = {}
+        # {名稱: {項目: MongoHistogram}}
+        self.histograms = {}
+        # {名稱: {項目: 數值}}
+        self.gauges = {}
+        # {名稱: {'total': 總量, 'active': 處理中數量, 'started': 開始時間, 'finished': 結束時間}}
+        self.progress = {}
+        # 目前執行緒 (非同步模式為 task) 處理中的名稱, save_to_mongo 依此紀錄
+        self.current = ContextVar(f'MongoMetrics.label.{id(self)}', default=None)
+
+        self.reporter = None
+        self.stop_event = Event()
+
+    def set_label(self, label: str):
+        """設定 目前執行緒 (非同步模式為 task) 處理中的名稱
+
+        Args:
+            label (str): 名稱
+        """
+        self.current.set(label)
+
+    def get_label(self, default: str = None):
+        """取得 目前執行緒 (非同步模式為 task) 處理中的名稱
+
+        Args:
+            default (str, optional): 未設定時的名稱. Defaults to None.
+
+        Returns:
+            str: 名稱
+        """
+        return self.current.get() or default
+
+    def inc(self, label: str, name: str, value: int = 1):
+        """計數增加
+
+        Args:
+            label (str): 名稱
+            name (str): 計數項目
+            value (int, optional): 增加數量. Defaults to 1.
+        """
+        with self.lock:
+            if label not in self.counters:
+                self.counters[label] = Counter()
+            self.counters[label][name] += value
+
+    def observe(self, label: str, name: str, seconds: float):
+        """紀錄 延遲
+
+        Args:
+            label (str): 名稱
+            name (str): 延遲項目
+            seconds (float): 秒數
+        """
+        with self.lock:
+            histograms = self.histograms.setdefault(label, {})
+            if name not in histograms:
+                histograms[name] = MongoHistogram()
+            histograms[name].observe(seconds)
+
+    def set_gauge(self, label: str, name: str, value: float):
+        """設定 目前數值 (ex: 每批筆數)
+
+        Args:
+            label (str): 名稱
+            name (str): 項目
+            value (float): 數值
+        """
+        with self.lock:
+            self.gauges.setdefault(label, {})[name] = value
+
+    def export(self, clear: bool = False):
+        """取得 全部計數及延遲分布, 多程序模式 子程序回傳給主程序合併 (merge)
+
+        Args:
+            clear (bool, optional): 取得後清除, 下次只回傳之後的變化. Defaults to False.
+
+        Returns:
+            dict: {'counters': {名稱: {項目: 數量}}, 'histograms': {名稱: {項目: 延遲分布}}}
+        """
+        with self.lock:
+            data = {
+                'counters': {label: dict(counters) for label, counters in self.counters.items()},
+                'histograms': {
+                    label: {name: histogram.export() for name, histogram in histograms.items()}
+                    for label, histograms in self.histograms.items()
+                }
+            }
+            if clear:
+                self.counters = {}
+                self.histograms = {}
+        return data
+
+    def merge(self, data: dict):
+        """合併 其他統計的計數及延遲分布 (export 的結果)
+
+        Args:
+            data (dict): export 的結果
+        """
+        with self.lock:
+            for label, counters in data.get('counters', {}).items():
+                self.counters.setdefault(label, Counter()).update(counters)
+            for label, histograms in data.get('histograms', {}).items():
+                for name, histogram in histograms.items():
+                    self.histograms.setdefault(label, {}).setdefault(name, MongoHistogram()).merge(histogram)
+
+    @contextmanager
+    def timer(self, label: str, name: str):
+        """紀錄 區塊執行時間
+
+            with metrics.timer(label, 'write'):
+                ...
+
+        Args:
+            label (str): 名稱
+            name (str): 延遲項目
+        """
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.observe(label, name, monotonic() - start)
+
+    def start(self, label: str, total: int = None):
+        """開始處理, 計算處理速度及預估剩餘時間用
+        同一名稱可多次開始 (ex: 分區), 總量累加, 全部完成才算結束
+
+        Args:
+            label (str): 名稱
+            total (int, optional): 總量. Defaults to None.
+        """
+        with self.lock:
+            progress = self.progress.get(label)
+            if progress is None:
+                # processed 為開始時已處理筆數, 多次執行時 只計算本次的處理速度
+                processed = self.counters.get(label, {}).get('processed', 0)
+                progress = {'total': 0, 'active': 0, 'started': monotonic(), 'finished': None, 'processed': processed}
+                self.progress[label] = progress
+            if total is not None:
+                progress['total'] += total
+            progress['active'] += 1
+            progress['finished'] = None
+
+    def reset_progress(self):
+        """清除 處理進度 (總量、開始時間), 每次執行開始時使用, 避免累加上次執行的總量及時間
+        計數及延遲統計保留累計值
+        """
+        with self.lock:
+            self.progress = {}
+
+    def finish(self, label: str):
+        """處理完成
+
+        Args:
+            label (str): 名稱
+        """
+        with self.lock:
+            progress = self.progress.get(label)
+            if progress and progress['active'] > 0:
+                progress['active'] -= 1
+                if progress['active'] == 0:
+                    progress['finished'] = monotonic()
+
+    def get_stats(self):
+        """取得 統計
+
+        Returns:
+            dict: {名稱: {'counters', 'latency', 'elapsed', 'docs_per_sec', 'eta'}}
+        """
+        now = monotonic()
+        stats = {}
+        with self.lock:
+            labels = list(self.counters.keys()) + [label for label in self.histograms if label not in self.counters]
+            for label in labels:
+                counters = {name: 0 for name in self.counter_names}
+                counters.update(self.counters.get(label, {}))
+                item = {
+                    'counters': counters,
+                    'latency': {name: histogram.get_stats() for name, histogram in self.histograms.get(label, {}).items()},
+                    'gauges': dict(self.gauges.get(label, {}))
+                }
+                progress = self.progress.get(label)
+                if progress:
+                    elapsed = (progress['finished'] or now) - progress['started']
+                    processed = counters['processed'] - progress['processed']
+                    docs_per_sec = processed / elapsed if elapsed > 0 else 0
+                    remaining = progress['total'] - processed if progress['total'] else 0
+                    item['total'] = progress['total']
+                    item['elapsed'] = elapsed
+                    item['docs_per_sec'] = docs_per_sec
+                    # 預估剩餘秒數, 無法估計為 None
+                    item['eta'] = remaining / docs_per_sec if docs_per_sec > 0 and remaining > 0 else (0 if progress['finished'] else None)
+                stats[label] = item
+        return stats
+
+    def generate_prometheus(self, prefix: str = 'mongo_sync'):
+        """生成 Prometheus 文字格式
+
+        Args:
+            prefix (str, optional): 指標名稱前綴. Defaults to 'mongo_sync'.
+
+        Returns:
+            str: Prometheus 文字格式
+        """
+        stats = self.get_stats()
+        lines = []
+        for name in self.counter_names:
+            lines.append(f'# TYPE {prefix}_{name}_total counter')
+            for label, item in stats.items():
+                lines.append(f'{prefix}_{name}_total{{name="{label}"}} {item["counters"][name]}')
+
+        with self.lock:
+            names = list(self.histogram_names)
+            for histograms in self.histograms.values():
+                names += [name for name in histograms if name not in names]
+        for name in names:
+            lines.append(f'# TYPE {prefix}_{name}_seconds histogram')
+            with self.lock:
+                histograms = [(label, histograms[name]) for label, histograms in self.histograms.items() if name in histograms]
+                for label, histogram in histograms:
+                    total = 0
+                    for bucket, count in zip(histogram.buckets, histogram.counts):
+                        total += count
+                        le = '+Inf' if bucket == float('inf') else bucket
+                        lines.append(f'{prefix}_{name}_seconds_bucket{{name="{label}",le="{le}"}} {total}')
+                    lines.append(f'{prefix}_{name}_seconds_sum{{name="{label}"}} {histogram.sum}')
+                    lines.append(f'{prefix}_{name}_seconds_count{{name="{label}"}} {histogram.count}')
+
+        gauge_names = []
+        for item in stats.values():
+            gauge_names += [name for name in item['gauges'] if name not in gauge_names]
+        for name in gauge_names:
+            lines.append(f'# TYPE {prefix}_{name} gauge')
+            for label, item in stats.items():
+                if name in item['gauges']:
+                    lines.append(f'{prefix}_{name}{{name="{label}"}} {item["gauges"][name]}')
+
+        lines.append(f'# TYPE {prefix}_docs_per_second gauge')
+        for label, item in stats.items():
+            if 'docs_per_sec' in item:
+                lines.append(f'{prefix}_docs_per_second{{name="{label}"}} {item["docs_per_sec"]}')
+        lines.append(f'# TYPE {prefix}_eta_seconds gauge')
+        for label, item in stats.items():
+            if item.get('eta') is not None:
+                lines.append(f'{prefix}_eta_seconds{{name="{label}"}} {item["eta"]}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: str, prefix: str = 'mongo_sync'):
+        """寫入 Prometheus 文字格式檔案 (node_exporter textfile collector)
+
+        Args:
+            path (str): 檔案路徑
+            prefix (str, optional): 指標名稱前綴. Defaults to 'mongo_sync'.
+        """
+        try:
+            dir_name = os.path.dirname(path)
+            if dir_name and not os.path.exists(dir_name):
+                os.makedirs(dir_name)
+            # 先寫入暫存檔再取代 避免讀取到寫入一半的檔案
+            tmp_path = f'{path}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(self.generate_prometheus(prefix))
+            os.replace(tmp_path, path)
+        except Exception as err:
+            self.logger.error(f'寫入 Prometheus 檔案 發生錯誤: {err}', exc_info=True)
+
+    def generate_summary(self):
+        """生成 摘要
+
+        Returns:
+            list: 每個名稱一行摘要
+        """
+        summaries = []
+        for label, item in self.get_stats().items():
+            counters = item['counters']
+            summary = f'{label} 讀取: {counters["read"]} 處理: {counters["processed"]} 新增: {counters["inserted"]} 更新: {counters["updated"]} 無變化: {counters["unchanged"]} 錯誤: {counters["errors"]}'
+            if 'docs_per_sec' in item:
+                summary += f' 速度: {item["docs_per_sec"]:.1f} 筆/秒'
+            if item.get('eta') is not None:
+                summary += f' 剩餘: {item["eta"]:.0f} 秒'
+            for name, latency in item['latency'].items():
+                summary += f' {name} p50/p99: {latency["p50"] * 1000:.1f}/{latency["p99"] * 1000:.1f} ms'
+            summaries.append(summary)
+        return summaries
+
+    def log_summary(self):
+        """記錄 摘要
+        """
+        for summary in self.generate_summary():
+            self.logger.info(summary)
+
+    def start_reporter(self, interval: float = 60, path: str = None):
+        """定時記錄摘要, 並寫入 Prometheus 文字格式檔案
+
+        Args:
+            interval (float, optional): 間隔秒數. Defaults to 60.
+            path (str, optional): Prometheus 檔案路徑, None 為不寫入. Defaults to None.
+        """
+        self.stop_reporter()
+        self.stop_event.clear()
+
+        def report():
+            while not self.stop_event.wait(interval):
+                self.log_summary()
+                if path:
+                    self.write_prometheus(path)
+
+        self.reporter = Thread(target=report, name='MongoMetricsReporter', daemon=True)
+        self.reporter.start()
+
+    def stop_reporter(self):
+        """停止 定時記錄
+        """
+        self.stop_event.set()
+        if self.reporter is not None:
+            self.reporter.join()
+            self.reporter = None
+
+
+class MongoProgress():
+
+    def __init__(self, logger: Log, label: str = '', total: int = None, every: int = 10000, seconds: float = 10) -> None:
+        """處理進度, 每 every 筆 或 每 seconds 秒 紀錄一次 (取先到者), 含處理速度及預估剩餘時間
+        取代逐筆紀錄進度
+
+        Args:
+            logger (Log): 紀錄用的 Log
+            label (str, optional): 顯示名稱. Defaults to ''.
+            total (int, optional): 總量. Defaults to None.
+            every (int, optional): 間隔筆數, 0 為不依筆數. Defaults to 10000.
+            seconds (float, optional): 間隔秒數, 0 為不依時間. Defaults to 10.
+        """
+        self.logger = logger
+        self.label = label
+        self.total = total
+        self.every = every
+        self.seconds = seconds
+
+        self.count = 0
+        self.started = monotonic()
+        self.next_count = every if every else None
+        self.next_time = self.started + seconds if seconds else None
+        # 多個執行緒共用時 (prefetch_consumers > 1)
+        self.lock = Lock()
+
+    def update(self, count: int = 1):
+        """增加 處理筆數, 達到間隔時紀錄
+
+        Args:
+            count (int, optional): 增加筆數. Defaults to 1.
+        """
+        with self.lock:
+            self.count += count
+            if self.next_count is not None and self.count >= self.next_count:
+                self.report()
+            elif self.next_time is not None and monotonic() >= self.next_time:
+                self.report()
+
+    def report(self):
+        """紀錄 目前進度
+        """
+        now = monotonic()
+        elapsed = now - self.started
+        rate = self.count / elapsed if elapsed > 0 else 0
+        if self.total and rate > 0:
+            eta = max(self.total - self.count, 0) / rate
+            self.logger.info('%s%d/%d %.1f 筆/秒 預估剩餘 %.0f 秒', self.label, self.count, self.total, rate, eta)
+        else:
+            self.logger.info('%s%d %.1f 筆/秒', self.label, self.count, rate)
+
+        if self.next_count is not None:
+            self.next_count = (self.count // self.every + 1) * self.every
+        if self.next_time is not None:
+            self.next_time = now + self.seconds
@@ -1,8 +1,12 @@
 from src.logger import Log
+from src.mongo_client import client_registry, generate_mongo_uri
 from src.mongo_pattern import MongoUriPattern
 
+from collections import deque
+from contextlib import contextmanager
 from pymongo import MongoClient
-import random
+from threading import Condition
+from time import monotonic
 import uuid
 
 
@@ -42,7 +46,7 @@ class MongoConnect():
         return self.get_mongo_client()
 
     def get_mongo_client(self, **kwargs) -> MongoClient:
-        """取得 mongo 連線
+        """取得 mongo 連線, 相同 uri 共用同一個連線 (client_registry)
 
         Returns:
             _type_: _description_
@@ -52,27 +56,7 @@ class MongoConnect():
             port = kwargs.get('port', self.mongo_port)
             username = kwargs.get('username', self.mongo_username)
             password = kwargs.get('password', self.mongo_password)
-
-            mup = MongoUriPattern()
-            uri_pattern = mup.uri_pattern
-            ip_pattern = mup.ip_pattern
-            host_pattern = mup.host_pattern
-            if bool(uri_pattern.match(host)):
-                uri = host
-            elif bool(ip_pattern.match(host)):
-                uri = host
-            elif bool(host_pattern.match(host)):
-                uri = host
-            else:
-                if port:
-                    uri = f'{host}:{port}'
-                else:
-                    uri = f'{host}'
-
-                if username and password:
-                    uri = f'{username}:{password}@{uri}'
-
-                uri = f'mongodb://{uri}'
+            uri = generate_mongo_uri(host, port, username, password)
 
             self.mongo_setting = {
                 'mongo_host': host,
@@ -83,7 +67,7 @@ class MongoConnect():
             }
 
             self.logger.debug(f'mongo_client 設定:\n{self.mongo_setting}')
-            mongo_client = MongoClient(uri)
+            mongo_client = client_registry.get_client(uri)
             return mongo_client
         except Exception as err:
             self.logger.error(f'取得 mongo 連線 發生錯誤: {err}', exc_info=True)
@@ -93,27 +77,7 @@ class MongoConnect():
         port = kwargs.get('port', self.mongo_port)
         username = kwargs.get('username', self.mongo_username)
         password = kwargs.get('password', self.mongo_password)
-
-        mup = MongoUriPattern()
-        uri_pattern = mup.uri_pattern
-        ip_pattern = mup.ip_pattern
-        host_pattern = mup.host_pattern
-        if bool(uri_pattern.match(host)):
-            uri = host
-        elif bool(ip_pattern.match(host)):
-            uri = host
-        elif bool(host_pattern.match(host)):
-            uri = host
-        else:
-            if port:
-                uri = f'{host}:{port}'
-            else:
-                uri = f'{host}'
-
-            if username and password:
-                uri = f'{username}:{password}@{uri}'
-
-            uri = f'mongodb://{uri}'
+        return generate_mongo_uri(host, port, username, password)
 
     def get_mongo_client_setting(self):
         return self.mongo_setting
@@ -121,23 +85,43 @@ class MongoConnect():
 
 class MongoConnectPool():
 
-    pool = {}
-    in_use = []
-    idle = []
-
     def __init__(self, max_connect: int = 100, **kwargs) -> None:
-        """
+        """mongo 連線池
+        閒置連線以 deque 保存, 取得時優先使用最近釋放的連線,
+        連線數達到 max_connect 時 acquire 會等待其他連線釋放
+        每個連線 (connect_uuid) 皆為 client_registry 中 同一個 MongoClient 的參考 (參考計數加一),
+        不會建立新的 socket, 連線數只限制同時使用的數量, 實際 socket 數量由 MongoClient 的 maxPoolSize 控制
+
             connect_name: 名稱,預設 Mongo 連線
             log_level: log 等級
             logger: Log物件
             max_connect: 最多連線數, 預設 100
         """
         self.connect_name = kwargs.get('connect_name', 'Mongo 連線')
+        self.log_level = str(kwargs.get('log_level', 'WARNING')).upper()
         self.logger = Log('MongoConnectPool')
-        self.logger.set_level(str(kwargs.get('log_level', 'WARNING')).upper())
+        self.logger.set_level(self.log_level)
         self.logger.set_msg_handler()
         self.max_connect = max_connect
 
+        # {connect_uuid: MongoClient}
+        self.pool = {}
+        self.in_use = set()
+        self.idle = deque()
+        # 建立中的連線數, 建立連線時不佔用 lock
+        self.creating = 0
+        self.condition = Condition()
+
+        self.stats = {
+            'acquire': 0,
+            'hit': 0,
+            'created': 0,
+            'wait': 0,
+            'wait_seconds': 0.0,
+            'timeout': 0,
+            'high_water': 0
+        }
+
     def set_mongo_connect_uri(self, uri: str):
         """設定 mongo 連線
 
@@ -159,15 +143,16 @@ class MongoConnectPool():
         Args:
             connect_uuid (_type_): _description_
         """
-        if connect_uuid in self.in_use:
-            self.logger.info(f'切換狀態 {connect_uuid}: 閒置')
-            self.in_use.remove(connect_uuid)
-            self.idle.append(connect_uuid)
-
-        if connect_uuid in self.idle:
-            self.logger.info(f'切換狀態 {connect_uuid}: 使用中')
-            self.idle.remove(connect_uuid)
-            self.in_use.append(connect_uuid)
+        with self.condition:
+            if connect_uuid in self.in_use:
+                self.logger.info('切換狀態 %s: 閒置', connect_uuid)
+                self.in_use.remove(connect_uuid)
+                self.idle.append(connect_uuid)
+                self.condition.notify()
+            elif connect_uuid in self.idle:
+                self.logger.info('切換狀態 %s: 使用中', connect_uuid)
+                self.idle.remove(connect_uuid)
+                self.in_use.add(connect_uuid)
 
     def generate_uuid(self):
         """生成 uuid
@@ -175,36 +160,168 @@ class MongoConnectPool():
         Returns:
             _type_: _description_
         """
-        try:
-            if len(self.pool) < self.max_connect:
-                connect_uuid = uuid.uuid1()
-                if connect_uuid not in self.pool.keys():
-                    return connect_uuid
-            else:
-                return None
-        except Exception as err:
-            self.logger.error(f'生成 uuid 發生錯誤: {err}')
+        return uuid.uuid4()
+
+    def create_connect(self):
+        """建立 mongo 連線
+
+        Returns:
+            MongoClient: pymongo 連線物件
+        """
+        mongo_client = MongoConnect(
+            mongo_host=self.uri,
+            name=f'{self.connect_name}',
+            log_level=self.log_level
+        ).get_mongo_client()
+        if mongo_client is None:
+            raise ConnectionError(f'建立 mongo 連線失敗 {self.connect_name}')
+        return mongo_client
 
     def add_connect(self):
-        """新增連線
+        """新增閒置連線
+
+        Raises:
+            ConnectionError: 建立連線失敗
 
         Returns:
-            _type_: _description_
+            _type_: 連線 uuid, 連線數已達上限則為 None
         """
         try:
+            with self.condition:
+                if len(self.pool) + self.creating >= self.max_connect:
+                    return None
+                self.creating += 1
+            try:
+                mongo_client = self.create_connect()
+            finally:
+                with self.condition:
+                    self.creating -= 1
             connect_uuid = self.generate_uuid()
-            if connect_uuid != None:
-                self.pool[connect_uuid] = MongoConnect(
-                    mongo_host=self.uri,
-                    name=f'{self.connect_name} {connect_uuid}'
-                ).get_mongo_client()
+            with self.condition:
+                self.pool[connect_uuid] = mongo_client
                 self.idle.append(connect_uuid)
-                self.logger.info(f'新增連線 {connect_uuid}')
-                return connect_uuid
-            else:
-                return None
+                self.stats['created'] += 1
+                self.condition.notify()
+            self.logger.info(f'新增連線 {connect_uuid}')
+            return connect_uuid
         except Exception as err:
             self.logger.error(f'新增連線 發生錯誤: {err}')
+            raise
+
+    def acquire(self, timeout: float = None):
+        """取得連線, 連線數已達上限時 等待其他連線釋放
+
+        Args:
+            timeout (float, optional): 最長等待秒數, None 為不限制. Defaults to None.
+
+        Raises:
+            TimeoutError: 等待逾時
+
+        Returns:
+            _type_: 連線 uuid
+        """
+        start = monotonic()
+        waited = False
+        with self.condition:
+            self.stats['acquire'] += 1
+            while True:
+                if self.idle:
+                    # 使用最近釋放的連線
+                    connect_uuid = self.idle.pop()
+                    self.in_use.add(connect_uuid)
+                    self.stats['hit'] += 1
+                    self.record_wait(start, waited)
+                    return connect_uuid
+                if len(self.pool) + self.creating < self.max_connect:
+                    self.creating += 1
+                    break
+                waited = True
+                remaining = None if timeout is None else timeout - (monotonic() - start)
+                if remaining is not None and remaining <= 0:
+                    self.stats['timeout'] += 1
+                    raise TimeoutError(f'取得連線逾時 {timeout} 秒, 使用中連線: {len(self.in_use)}')
+                self.condition.wait(remaining)
+
+        # 建立連線時 不佔用 lock
+        try:
+            mongo_client = self.create_connect()
+        except Exception:
+            with self.condition:
+                self.creating -= 1
+                self.condition.notify()
+            raise
+
+        connect_uuid = self.generate_uuid()
+        with self.condition:
+            self.creating -= 1
+            self.pool[connect_uuid] = mongo_client
+            self.in_use.add(connect_uuid)
+            self.stats['created'] += 1
+            self.record_wait(start, waited)
+        self.logger.info(f'新增連線 {connect_uuid}')
+        return connect_uuid
+
+    def record_wait(self, start: float, waited: bool):
+        """紀錄 等待時間及使用中連線數最高值, 需在 lock 內執行
+
+        Args:
+            start (float): 開始取得連線的時間
+            waited (bool): 是否曾等待
+        """
+        if waited:
+            self.stats['wait'] += 1
+            self.stats['wait_seconds'] += monotonic() - start
+        self.stats['high_water'] = max(self.stats['high_water'], len(self.in_use))
+
+    def release(self, connect_uuid):
+        """釋放連線
+
+        Args:
+            connect_uuid (_type_): 連線 uuid
+
+        Raises:
+            RuntimeError: 非使用中連線
+        """
+        with self.condition:
+            if connect_uuid not in self.in_use:
+                raise RuntimeError(f'{connect_uuid} 非使用中連線')
+            self.in_use.remove(connect_uuid)
+            self.idle.append(connect_uuid)
+            self.condition.notify()
+
+    @contextmanager
+    def connect(self, timeout: float = None):
+        """取得連線, 離開時釋放
+
+            with mongo_pool.connect() as mongo_client:
+                ...
+
+        Args:
+            timeout (float, optional): 最長等待秒數, None 為不限制. Defaults to None.
+
+        Yields:
+            MongoClient: pymongo 連線物件
+        """
+        connect_uuid = self.acquire(timeout=timeout)
+        try:
+            yield self.pool[connect_uuid]
+        finally:
+            self.release(connect_uuid)
+
+    def get_stats(self):
+        """取得 連線池統計
+
+        Returns:
+            dict: 取得次數、重複使用率、等待次數及時間、逾時次數、使用中連線數最高值 等
+        """
+        with self.condition:
+            stats = dict(self.stats)
+            stats['total'] = len(self.pool)
+            stats['idle'] = len(self.idle)
+            stats['in_use'] = len(self.in_use)
+        stats['hit_rate'] = stats['hit'] / stats['acquire'] if stats['acquire'] else 0
+        stats['avg_wait_seconds'] = stats['wait_seconds'] / stats['wait'] if stats['wait'] else 0
+        return stats
 
     def get_connect_pool(self):
         """取得 連線池
@@ -220,7 +337,8 @@ class MongoConnectPool():
         Returns:
             _type_: _description_
         """
-        return self.idle
+        with self.condition:
+            return list(self.idle)
 
     def get_in_use_connect(self):
         """取得 使用中連線
@@ -228,7 +346,8 @@ class MongoConnectPool():
         Returns:
             _type_: _description_
         """
-        return self.in_use
+        with self.condition:
+            return list(self.in_use)
 
     def del_connect(self, connect_uuid: str):
         """刪除連線
@@ -238,45 +357,58 @@ class MongoConnectPool():
         """
         try:
             self.logger.info(f"執行刪除連線: {connect_uuid}")
+            with self.condition:
+                if connect_uuid in self.idle:
+                    self.idle.remove(connect_uuid)
+                    self.logger.debug("檢查閒置連線")
 
-            if connect_uuid in self.idle:
-                self.idle.remove(connect_uuid)
-                self.logger.debug("檢查閒置連線")
+                if connect_uuid in self.in_use:
+                    self.in_use.remove(connect_uuid)
+                    self.logger.debug("檢查使用中連線")
 
-            if connect_uuid in self.in_use:
-                self.in_use.remove(connect_uuid)
-                self.logger.debug("檢查使用中連線")
+                mongo_client = self.pool.pop(connect_uuid, None)
+                # 空出連線數 喚醒等待中的 acquire
+                self.condition.notify()
 
-            if self.pool.get(connect_uuid):
-                self.pool[connect_uuid].close()
-                del self.pool[connect_uuid]
+            if mongo_client is not None:
+                client_registry.release_client(mongo_client)
                 self.logger.info(f"{connect_uuid} 已刪除")
             else:
                 self.logger.info(f"{connect_uuid} 不存在")
         except Exception as err:
             self.logger.error(f'刪除連線 發生錯誤: {err}')
 
-    def get_connect(self):
+    def close_all(self):
+        """關閉 全部閒置連線, 使用中連線釋放後仍可使用
+        """
+        for connect_uuid in self.get_idle_connect():
+            self.del_connect(connect_uuid)
+
+    def get_connect(self, timeout: float = None):
         """取得連線
+
+        Args:
+            timeout (float, optional): 最長等待秒數, None 為不限制. Defaults to None.
+
+        Raises:
+            TimeoutError: 等待逾時
+            ConnectionError: 建立連線失敗
+
+        Returns:
+            _type_: 連線 uuid
         """
         try:
-            if len(self.idle) == 0:
-                self.add_connect()
-            self.logger.info(f"執行取得連線")
-            connect_uuid = random.choice(self.idle)
-            self.switch_status(connect_uuid)
-            return connect_uuid
+            self.logger.info("執行取得連線")
+            return self.acquire(timeout=timeout)
         except Exception as err:
             self.logger.error(f'取得連線 發生錯誤: {err}')
+            raise
 
     def release_connect(self, connect_uuid):
         """釋放連線
         """
         try:
-            self.logger.info(f"執行釋放連線 {connect_uuid}")
-            if connect_uuid in self.in_use:
-                self.switch_status(connect_uuid)
-            else:
-                raise RuntimeError(f'{connect_uuid} 非使用中連線')
+            self.logger.info("執行釋放連線 %s", connect_uuid)
+            self.release(connect_uuid)
         except Exception as err:
             self.logger.error(f'釋放連線 發生錯誤: {err}')
@@ -0,0 +1,65 @@
+from src.mongo_metrics import MongoMetrics
+
+from time import monotonic, sleep
+import bson
+import os
+import pickle
+
+
+# 子程序的處理函式 {func_id: func}, 由 init_process_worker 建立
+worker_funcs = {}
+# 子程序的統計, 每批的變化回傳給主程序合併
+worker_metrics = None
+
+
+def init_process_worker(funcs: bytes):
+    """子程序初始化, 每個子程序只執行一次
+    反序列化處理函式時 MongoFuncBasic 會建立子程序自己的 MongoClient
+
+    Args:
+        funcs (bytes): pickle 序列化的處理函式 {func_id: func}
+    """
+    global worker_metrics
+    worker_funcs.update(pickle.loads(funcs))
+    worker_metrics = MongoMetrics()
+    for func in worker_funcs.values():
+        instance = getattr(func, '__self__', None)
+        if hasattr(instance, 'set_metrics'):
+            instance.set_metrics(worker_metrics)
+
+
+def process_raw_batch(func_id: int, raw_datas: bytes, sleep_sec: float = 0, metrics_label: str = None):
+    """子程序 處理一批資料
+
+    Args:
+        func_id (int): 處理函式編號
+        raw_datas (bytes): 多筆 BSON 資料串接
+        sleep_sec (float, optional): 測試模式 每筆停止秒數. Defaults to 0.
+        metrics_label (str, optional): 統計名稱, save_to_mongo 的新增、更新等筆數以此紀錄. Defaults to None.
+
+    Returns:
+        dict: 處理結果 {'count': 處理筆數, 'seconds': 執行秒數, 'pid': 子程序 pid, 'metrics': 本批的統計變化}
+    """
+    func = worker_funcs[func_id]
+    instance = getattr(func, '__self__', None)
+    mongo_client = getattr(instance, 'mongo_client', None)
+
+    worker_metrics.set_label(metrics_label)
+    start_time = monotonic()
+    count = 0
+    for data in bson.decode_all(raw_datas):
+        func(data=data, mongo_client=mongo_client)
+        count += 1
+        if sleep_sec:
+            sleep(sleep_sec)
+
+    # 批次寫入模式 回報結果前 需先寫入暫存資料
+    if hasattr(instance, 'flush_bulk_write'):
+        instance.flush_bulk_write()
+
+    return {
+        'count': count,
+        'seconds': monotonic() - start_time,
+        'pid': os.getpid(),
+        'metrics': worker_metrics.export(clear=True)
+    }
@@ -0,0 +1,184 @@
+from src.logger import Log
+from src.mongo_matcher import MongoQueryMatcher
+from src.mongo_metrics import MongoMetrics
+
+from bson.raw_bson import RawBSONDocument
+from collections import Counter
+from threading import Lock
+from time import monotonic
+import copy
+
+
+class MongoScanGroup():
+
+    def __init__(self, name: str, funcs: dict, metrics: MongoMetrics, record_error=None, **kwargs) -> None:
+        """共用讀取
+        讀取相同集合的多個處理函式 以一次讀取 (查詢條件聯集) 取得資料,
+        每筆資料在記憶體中比對各函式的查詢條件, 分配給符合的函式
+
+        Args:
+            name (str): 群組名稱
+            funcs (dict): {處理函式: add_func 參數}, 查詢條件需可在記憶體中比對 (MongoQueryMatcher.is_supported)
+            metrics (MongoMetrics): 處理量及延遲統計
+            record_error (_type_, optional): collect_errors 時 紀錄錯誤 record_error(統計名稱, 資料, 錯誤). Defaults to None.
+            log_level (str, optional): log等級. Defaults to WARNING.
+        """
+        self.logger = Log('MongoScanGroup')
+        self.logger.set_level(str(kwargs.get('log_level', 'WARNING')).upper())
+        self.logger.set_msg_handler()
+
+        self.name = name
+        self.funcs = funcs
+        self.metrics = metrics
+        self.record_error = record_error
+        self.matcher = MongoQueryMatcher()
+
+        # 各函式的統計名稱 及 已分配筆數
+        self.labels = {func: f'{func.__self__.__class__.__name__}.{func.__name__}' for func in funcs}
+        self.counts = Counter()
+        self.lock = Lock()
+
+    def generate_query(self):
+        """生成 查詢條件聯集, 任一函式無查詢條件時 讀取全部資料
+
+        Returns:
+            dict: 查詢條件
+        """
+        queries = {}
+        for details in self.funcs.values():
+            query = details.get('query') or {}
+            if len(query) == 0:
+                return {}
+            queries.setdefault(self.matcher.generate_key(query), query)
+        queries = list(queries.values())
+        if len(queries) == 1:
+            return queries[0]
+        return {'$or': queries}
+
+    def generate_projection(self):
+        """生成 回傳欄位聯集, 加入比對查詢條件需要的欄位
+        任一函式未設定 或為排除模式 ({'a': 0}) 時 回傳全部欄位
+
+        Returns:
+            dict: projection, None 為回傳全部欄位
+        """
+        fields = {}
+        for details in self.funcs.values():
+            projection = details.get('projection')
+            if not projection:
+                return None
+            if isinstance(projection, (list, tuple)):
+                projection = {field: 1 for field in projection}
+            if not any(value for key, value in projection.items() if key != '_id'):
+                return None
+            for field, value in projection.items():
+                if value:
+                    fields[field] = 1
+            for field in self.matcher.get_fields(details.get('query') or {}):
+                fields[field] = 1
+        return fields
+
+    def reserve(self, func):
+        """分配一筆資料給函式, 達到函式的 limit 後不再分配
+
+        Args:
+            func (_type_): 處理函式
+
+        Returns:
+            bool: 是否分配
+        """
+        limit = int(self.funcs[func].get('limit', 0))
+        with self.lock:
+            if limit and self.counts[func] >= limit:
+                return False
+            self.counts[func] += 1
+            return True
+
+    def is_done(self):
+        """全部函式 是否皆已達到 limit, 達到後不需繼續讀取
+
+        Returns:
+            bool: _description_
+        """
+        with self.lock:
+            for func, details in self.funcs.items():
+                limit = int(details.get('limit', 0))
+                if not limit or self.counts[func] < limit:
+                    return False
+            return True
+
+    def get_counts(self):
+        """取得 各函式已分配筆數
+
+        Returns:
+            dict: {處理函式: 筆數}
+        """
+        with self.lock:
+            return {func: self.counts[func] for func in self.funcs}
+
+    def start(self):
+        """開始處理, 各函式開始計算處理速度
+        """
+        for func in self.funcs:
+            self.metrics.start(self.labels[func])
+
+    def finish(self):
+        """處理完成
+        """
+        for func in self.funcs:
+            self.metrics.finish(self.labels[func])
+
+    def flush_bulk_write(self):
+        """寫入 各函式批次寫入的暫存資料, 儲存進度紀錄前使用
+        """
+        for func in self.funcs:
+            instance = getattr(func, '__self__', None)
+            if hasattr(instance, 'flush_bulk_write'):
+                instance.flush_bulk_write()
+
+    def copy_data(self, data):
+        """複製資料 給每個函式, 避免函式修改資料 (ex: save_to_mongo 刪除 _id、加入 modified_date) 影響其他函式
+        RawBSONDocument 不可修改 不需複製
+
+        Args:
+            data (dict): 資料
+
+        Returns:
+            dict: _description_
+        """
+        if isinstance(data, RawBSONDocument):
+            return data
+        return copy.deepcopy(data)
+
+    def mongo_func(self, data, mongo_client=None, **kwargs):
+        """分配資料給符合查詢條件的函式, 結果與各函式分別讀取相同
+        先以原始資料比對全部函式的查詢條件, 再依序執行, 除最後一個函式外 各函式收到資料的複本
+        各函式的 mongo_client 參數優先, collect_errors 的函式發生錯誤時 紀錄後繼續分配給其他函式
+
+        Args:
+            data (dict): 資料
+            mongo_client (MongoClient, optional): 預設的 mongo_client. Defaults to None.
+        """
+        funcs = [
+            func for func, details in self.funcs.items()
+            if self.matcher.match_query(data, details.get('query') or {}) and self.reserve(func)
+        ]
+        label = self.metrics.get_label()
+        try:
+            for index, func in enumerate(funcs):
+                details = self.funcs[func]
+                func_data = data if index == len(funcs) - 1 else self.copy_data(data)
+
+                # save_to_mongo 依此紀錄 新增、更新筆數
+                self.metrics.set_label(self.labels[func])
+                func_start = monotonic()
+                try:
+                    func(data=func_data, mongo_client=details.get('mongo_client', mongo_client))
+                except Exception as err:
+                    if not details.get('collect_errors') or self.record_error is None:
+                        raise
+                    self.record_error(self.labels[func], data, err)
+                self.metrics.observe(self.labels[func], 'func', monotonic() - func_start)
+                self.metrics.inc(self.labels[func], 'processed')
+        finally:
+            self.metrics.set_label(label)
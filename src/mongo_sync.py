@@ -1,11 +1,28 @@
+from src.logger import Log
+from src.mongo_client import client_registry, generate_mongo_uri
 from src.mongo_pattern import MongoUriPattern
 from src.mongo_pool import MongoConnectPool
+from src.mongo_process import init_process_worker, process_raw_batch
+from src.mongo_batch import AdaptiveBatchSizer, BatchPrefetcher
+from src.mongo_checkpoint import CheckpointStore, CheckpointTracker
+from src.mongo_governor import WriteGovernor
+from src.mongo_metrics import MongoMetrics, MongoProgress
+from src.mongo_matcher import MongoQueryMatcher
+from src.mongo_scan import MongoScanGroup
 from src.basic import TestBasic
 
 
-from concurrent.futures import ThreadPoolExecutor
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from collections.abc import Mapping
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
 from pymongo import MongoClient
-from time import sleep
+from bson import ObjectId
+from datetime import datetime, timedelta
+from itertools import islice
+from threading import Event, Lock
+from time import monotonic, sleep
+import pickle
 
 
 class MongoSync(TestBasic):
@@ -21,10 +38,23 @@ class MongoSync(TestBasic):
             mongo_port (str, optional): Defaults to '27017'
             mongo_username (str, optional)
             mongo_password (str, optional)
+            max_connect (int, optional): 連線池最多連線數. Defaults to 100.
+            progress_every (int, optional): 處理進度 每幾筆紀錄一次 (INFO). Defaults to 10000.
+            progress_seconds (float, optional): 處理進度 每幾秒紀錄一次 (INFO). Defaults to 10.
+            log_queue (bool, optional): log 佇列模式, 由單一執行緒輸出 log, 處理執行緒不等待 I/O. Defaults to False.
+            log_queue_size (int, optional): log 佇列上限. Defaults to 10000.
+            log_queue_policy (str, optional): log 佇列已滿時 drop: 捨棄, block: 等待. Defaults to 'drop'.
+            max_error_samples (int, optional): collect_errors 時 每個處理函式最多保留幾筆錯誤資料. Defaults to 100.
+            shared_scan (bool, optional): 讀取相同集合的處理函式 自動共用一次讀取 (多執行緒模式), 見 add_func scan_group. Defaults to False.
 
         Returns:
             _type_: _description_
         """
+        if kwargs.get('log_queue'):
+            Log.start_queue(
+                max_size=int(kwargs.get('log_queue_size', 10000)),
+                policy=kwargs.get('log_queue_policy', 'drop')
+            )
         super().__init__(log_name, **kwargs)
 
         # mongo 連線設定
@@ -34,7 +64,10 @@ class MongoSync(TestBasic):
         self.mongo_password = kwargs.get('mongo_password')
         self.generate_mongo_uri()
 
-        self.mongo_pool = MongoConnectPool()
+        self.mongo_pool = MongoConnectPool(
+            max_connect=int(kwargs.get('max_connect', 100)),
+            log_level=kwargs.get('log_level', 'WARNING')
+        )
         self.mongo_pool.set_mongo_connect_uri(self.uri)
 
         self.default_setting = {
@@ -46,6 +79,351 @@ class MongoSync(TestBasic):
 
         self.funcs = {}
 
+        self.checkpoint_store = None
+        self.checkpoint_interval = 30
+
+        # 停止 stream 模式
+        self.stop_event = Event()
+
+        # 增量模式 本次執行各函式看到的最大 watermark {func: {'value': 最大值, 'failed': 是否失敗}}
+        self.watermark_results = {}
+        self.watermark_lock = Lock()
+
+        # 處理量及延遲統計
+        self.metrics = MongoMetrics(log_level=kwargs.get('log_level', 'WARNING'))
+        self.metrics_setting = None
+        # 處理進度 紀錄間隔
+        self.progress_setting = {
+            'every': int(kwargs.get('progress_every', 10000)),
+            'seconds': float(kwargs.get('progress_seconds', 10))
+        }
+
+        # collect_errors 時 各處理函式的錯誤資料 {類別.函式: [{'_id': _id, 'error': 錯誤}]}
+        self.errors = {}
+        self.errors_lock = Lock()
+        self.max_error_samples = int(kwargs.get('max_error_samples', 100))
+
+        # 共用讀取
+        self.shared_scan = bool(kwargs.get('shared_scan', False))
+
+        # 寫入速率限制, lag_client 為 檢查 secondary 延遲 向共用連線取得的連線, 執行完成時釋放
+        self.write_governor = None
+        self.lag_client = None
+
+    def set_metrics_output(self, path: str = None, interval: float = 60):
+        """設置 統計輸出
+        執行期間每 interval 秒記錄摘要, 並寫入 Prometheus 文字格式檔案, 執行完成時再輸出一次
+
+        Args:
+            path (str, optional): Prometheus 檔案路徑, None 為只記錄摘要. Defaults to None.
+            interval (float, optional): 間隔秒數. Defaults to 60.
+        """
+        self.metrics_setting = {'path': path, 'interval': interval}
+
+    def set_write_governor(self, write_governor: WriteGovernor = None, **kwargs):
+        """設置 寫入速率限制, 全部處理函式共用 (多執行緒模式)
+        依寫入延遲及 secondary 延遲自動調整速率, 避免寫入過快造成主機負載過高
+
+        Args:
+            write_governor (WriteGovernor, optional): 寫入速率限制, None 則以 kwargs 建立. Defaults to None.
+            kwargs: WriteGovernor 參數 ex: ops_per_sec, bytes_per_sec, target_latency, max_lag
+
+        Returns:
+            WriteGovernor: 寫入速率限制
+        """
+        if write_governor is None:
+            # 未帶入 mongo_client 時 執行時才向共用連線取得 檢查 secondary 延遲的連線
+            write_governor = WriteGovernor(metrics=self.metrics, log_level=self.log_level, **kwargs)
+        self.write_governor = write_governor
+        for func in self.funcs:
+            if hasattr(func.__self__, 'set_write_governor'):
+                func.__self__.set_write_governor(write_governor)
+        return write_governor
+
+    def start_write_governor(self):
+        """開始 寫入速率限制 的 secondary 延遲檢查
+        未帶入 mongo_client 時 向共用連線取得, stop_write_governor 時釋放
+        """
+        write_governor = self.write_governor
+        if write_governor is None or write_governor.max_lag is None:
+            return
+        if write_governor.mongo_client is None:
+            self.lag_client = client_registry.get_client(self.uri)
+            write_governor.mongo_client = self.lag_client
+        write_governor.start()
+
+    def stop_write_governor(self):
+        """停止 寫入速率限制 的 secondary 延遲檢查, 並釋放 start_write_governor 取得的連線
+        """
+        if self.write_governor is not None:
+            self.write_governor.stop()
+        if self.lag_client is not None:
+            if self.write_governor is not None and self.write_governor.mongo_client is self.lag_client:
+                self.write_governor.mongo_client = None
+            client_registry.release_client(self.lag_client)
+            self.lag_client = None
+
+    def get_metrics_label(self, func):
+        """取得 處理函式的統計名稱
+
+        Args:
+            func (_type_): 處理函式
+
+        Returns:
+            str: 類別.函式, 共用讀取為 MongoScanGroup.群組名稱
+        """
+        if isinstance(func.__self__, MongoScanGroup):
+            return f'MongoScanGroup.{func.__self__.name}'
+        return f'{func.__self__.__class__.__name__}.{func.__name__}'
+
+    def get_stats(self):
+        """取得 統計
+        各處理函式的 讀取、處理、新增、更新、無變化、錯誤筆數, 讀取/處理/寫入延遲, 處理速度及預估剩餘時間
+
+        Returns:
+            dict: {類別.函式: 統計}, 批次寫入的延遲以 資料庫.集合 紀錄
+        """
+        return self.metrics.get_stats()
+
+    def record_error(self, metrics_label: str, data, err: Exception):
+        """紀錄 處理函式單筆資料的錯誤, 不中止處理
+
+        Args:
+            metrics_label (str): 統計名稱
+            data (dict): 發生錯誤的資料
+            err (Exception): 錯誤
+        """
+        _id = data.get('_id') if isinstance(data, Mapping) else None
+        self.logger.error(f'{metrics_label} 處理資料 {_id} 發生錯誤: {err}', exc_info=True)
+        self.metrics.inc(metrics_label, 'errors')
+        with self.errors_lock:
+            errors = self.errors.setdefault(metrics_label, [])
+            if len(errors) < self.max_error_samples:
+                errors.append({'_id': _id, 'error': f'{type(err).__name__}: {err}'})
+
+    def get_errors(self):
+        """取得 collect_errors 時紀錄的錯誤資料, 錯誤總數見 get_stats 的 errors
+
+        Returns:
+            dict: {類別.函式: [{'_id': _id, 'error': 錯誤}]}
+        """
+        with self.errors_lock:
+            return {label: list(errors) for label, errors in self.errors.items()}
+
+    def set_checkpoint_store(self, store: CheckpointStore, interval: float = 30):
+        """設置 進度紀錄
+        keyset 分頁時 定期記錄各函式處理進度, run(resume=True) 可從上次紀錄繼續
+
+        Args:
+            store (CheckpointStore): 進度紀錄儲存方式, FileCheckpointStore 或 MongoCheckpointStore
+            interval (float, optional): 儲存間隔秒數. Defaults to 30.
+        """
+        self.checkpoint_store = store
+        self.checkpoint_interval = interval
+
+    def get_checkpoint_name(self, func, details: dict):
+        """取得 函式的進度紀錄名稱
+
+        Args:
+            func (_type_): 執行的函式
+            details (dict): add_func 參數
+
+        Returns:
+            str: 紀錄名稱, 預設為 類別.函式.資料庫.集合
+        """
+        if details.get('checkpoint_name'):
+            return details['checkpoint_name']
+        return f'{func.__self__.__class__.__name__}.{func.__name__}.{details["database"]}.{details["collection"]}'
+
+    def get_checkpoint_tracker(self, func, label: str = '', flush: bool = True, **kwargs):
+        """取得 進度追蹤
+
+        Args:
+            func (_type_): 執行的函式
+            label (str, optional): 顯示名稱. Defaults to ''.
+            flush (bool, optional): 儲存進度前 是否先寫入函式的批次寫入暫存資料. Defaults to True.
+
+        Returns:
+            CheckpointTracker: 未設置進度紀錄 或非 keyset 分頁時為 None
+        """
+        checkpoint_name = kwargs.get('checkpoint_name')
+        if self.checkpoint_store is None or not checkpoint_name:
+            return None
+        if kwargs.get('pagination', 'skip') != 'keyset':
+            self.logger.warning(f'{label}進度紀錄需使用 keyset 分頁, 不記錄進度')
+            return None
+        if kwargs.get('pipeline'):
+            self.logger.warning(f'{label}aggregation pipeline 不記錄進度')
+            return None
+
+        instance = getattr(func, '__self__', None)
+        tracker = CheckpointTracker(
+            self.checkpoint_store,
+            checkpoint_name,
+            resume=kwargs.get('resume', False),
+            interval=self.checkpoint_interval,
+            flush=getattr(instance, 'flush_bulk_write', None) if flush else None
+        )
+        if tracker.state['last_id'] is not None and not tracker.state['done']:
+            self.logger.info(f'{label}從進度紀錄繼續 已處理: {tracker.state["count"]} 筆')
+        return tracker
+
+    def clear_checkpoints(self, tasks: list):
+        """刪除 全部完成的函式進度紀錄
+
+        Args:
+            tasks (list[tuple]): [(func, 參數), ...]
+        """
+        names = {}
+        for func, task in tasks:
+            if task.get('checkpoint_name'):
+                names.setdefault(func, []).append(task['checkpoint_name'])
+
+        for func, checkpoint_names in names.items():
+            states = [self.checkpoint_store.load(name) for name in checkpoint_names]
+            if all(state and state.get('done') for state in states):
+                # 共用讀取的進度紀錄 不在 self.funcs
+                base_name = self.get_checkpoint_name(func, self.funcs.get(func, {'checkpoint_name': checkpoint_names[0]}))
+                for name in set(checkpoint_names + [base_name, f'{base_name}.bounds']):
+                    self.checkpoint_store.delete(name)
+                self.logger.info(f'刪除進度紀錄: {base_name}')
+
+    def get_watermark_name(self, func, details: dict):
+        """取得 函式的 watermark 紀錄名稱
+
+        Args:
+            func (_type_): 執行的函式
+            details (dict): add_func 參數
+
+        Returns:
+            str: 紀錄名稱
+        """
+        return f'{self.get_checkpoint_name(func, details)}.watermark'
+
+    def get_max_value(self, datas: list, key: str, value=None):
+        """取得 資料中欄位的最大值
+
+        Args:
+            datas (list): 資料
+            key (str): 欄位名稱
+            value (optional): 目前的最大值. Defaults to None.
+
+        Returns:
+            _type_: 最大值
+        """
+        for data in datas:
+            data_value = self.get_field_value(data, key)
+            if data_value is not None and (value is None or data_value > value):
+                value = data_value
+        return value
+
+    def generate_watermark_query(self, query: dict, watermark_key: str, watermark, overlap: float = 0):
+        """生成 增量模式查詢條件 watermark_key >= watermark - overlap
+
+        Args:
+            query (dict): 原查詢條件
+            watermark_key (str): watermark 欄位
+            watermark (_type_): 上次執行的 watermark
+            overlap (float, optional): 重疊秒數, 避免時間誤差漏掉資料, datetime 及 ObjectId 適用. Defaults to 0.
+
+        Returns:
+            dict: 查詢條件
+        """
+        if isinstance(watermark, datetime):
+            watermark = watermark - timedelta(seconds=overlap)
+        elif isinstance(watermark, ObjectId):
+            watermark = ObjectId.from_datetime(watermark.generation_time - timedelta(seconds=overlap))
+
+        watermark_query = {watermark_key: {'$gte': watermark}}
+        if len(query) > 0:
+            return {'$and': [query, watermark_query]}
+        return watermark_query
+
+    def apply_watermark(self, func, details: dict, backfill: bool = False):
+        """增量模式 依上次執行的 watermark 限制查詢範圍
+
+        Args:
+            func (_type_): 執行的函式
+            details (dict): add_func 參數
+            backfill (bool, optional): 忽略 watermark 重新處理全部資料. Defaults to False.
+
+        Returns:
+            dict: 函式參數
+        """
+        if self.checkpoint_store is None:
+            self.logger.warning('增量模式 需先 set_checkpoint_store, 處理全部資料')
+            return details
+
+        watermark_key = details.get('watermark_key', 'modified_date')
+        details = {**details, 'watermark_key': watermark_key}
+        state = self.checkpoint_store.load(self.get_watermark_name(func, details))
+        if backfill or not state:
+            self.logger.info(f'增量模式 處理全部資料: {func.__self__.__class__.__name__} {func.__name__}')
+            return details
+
+        self.logger.info(f'增量模式 {watermark_key} 從 {state["watermark"]} 開始: {func.__self__.__class__.__name__} {func.__name__}')
+        details['query'] = self.generate_watermark_query(
+            details.get('query', {}),
+            watermark_key,
+            state['watermark'],
+            overlap=float(details.get('watermark_overlap', 300))
+        )
+        return details
+
+    def record_watermark(self, func, value=None, failed: bool = False):
+        """記錄 本次執行看到的最大 watermark
+
+        Args:
+            func (_type_): 執行的函式
+            value (optional): watermark. Defaults to None.
+            failed (bool, optional): 處理失敗 本次不更新 watermark. Defaults to False.
+        """
+        with self.watermark_lock:
+            result = self.watermark_results.setdefault(func, {'value': None, 'failed': False})
+            if failed:
+                result['failed'] = True
+            elif value is not None and (result['value'] is None or value > result['value']):
+                result['value'] = value
+
+    def save_watermarks(self):
+        """儲存 全部處理成功的函式 watermark
+        """
+        for func, result in self.watermark_results.items():
+            details = self.funcs[func]
+            if result['failed']:
+                self.logger.warning(f'處理未完成 不更新 watermark: {func.__self__.__class__.__name__} {func.__name__}')
+                continue
+            if result['value'] is None:
+                continue
+
+            name = self.get_watermark_name(func, details)
+            state = self.checkpoint_store.load(name)
+            if state and state['watermark'] > result['value']:
+                continue
+            self.checkpoint_store.save(name, {
+                'watermark': result['value'],
+                'watermark_key': details.get('watermark_key', 'modified_date'),
+                'updated': datetime.now()
+            })
+            self.logger.info(f'更新 watermark {result["value"]}: {func.__self__.__class__.__name__} {func.__name__}')
+
+    def reset_watermark(self, func, value=None):
+        """重設 函式的 watermark, 下次執行從指定值開始 (補資料用)
+
+        Args:
+            func (_type_): 執行的函式
+            value (optional): watermark, None 為刪除 (下次處理全部資料). Defaults to None.
+        """
+        name = self.get_watermark_name(func, self.funcs[func])
+        if value is None:
+            self.checkpoint_store.delete(name)
+        else:
+            self.checkpoint_store.save(name, {
+                'watermark': value,
+                'watermark_key': self.funcs[func].get('watermark_key', 'modified_date'),
+                'updated': datetime.now()
+            })
+
     def generate_mongo_uri(self, **kwargs):
         """生成 mongo uri
         """
@@ -54,34 +432,29 @@ class MongoSync(TestBasic):
         username = kwargs.get('username', self.mongo_username)
         password = kwargs.get('password', self.mongo_password)
 
-        mup = MongoUriPattern()
-        uri_pattern = mup.uri_pattern
-        ip_pattern = mup.ip_pattern
-        host_pattern = mup.host_pattern
-        if bool(uri_pattern.match(host)):
-            uri = host
-        elif bool(ip_pattern.match(host)):
-            uri = host
-        elif bool(host_pattern.match(host)):
-            uri = host
-        else:
-            if port:
-                uri = f'{host}:{port}'
-            else:
-                uri = f'{host}'
+        uri = generate_mongo_uri(host, port, username, password)
 
-            if username and password:
-                uri = f'{username}:{password}@{uri}'
-
-            uri = f'mongodb://{uri}/'
-
-        if not bool(uri_pattern.match(uri)):
+        if not bool(MongoUriPattern.uri_pattern.match(uri)):
             raise ValueError(f'生成 mongo uri 發生錯誤: {uri}')
         else:
             self.logger.info(f'生成 mongo uri : {uri}')
         self.uri = uri
         return uri
 
+    def get_progress_total(self, total: int = None, limit: int = 0):
+        """取得 處理進度的總量, 限制筆數時取較小者
+
+        Args:
+            total (int, optional): 資料總量, 無法取得 (aggregation pipeline) 為 None. Defaults to None.
+            limit (int, optional): 限制筆數. Defaults to 0.
+
+        Returns:
+            int: 總量, 無法估計為 None
+        """
+        if total is None:
+            return limit or None
+        return min(total, limit) if limit else total
+
     def get_mongo_total_amount(self, mongo_client: MongoClient, collection: str, database: str, query: dict = {}):
         """取得 mongo 資料總數量
 
@@ -113,6 +486,527 @@ class MongoSync(TestBasic):
                 f'取得 mongo {database} {collection} 資料總數量 發生錯誤: {err}', exc_info=True)
             return None
 
+    def get_field_value(self, data: dict, key: str):
+        """取得欄位值, 支援 a.b 巢狀欄位
+
+        Args:
+            data (dict): 資料
+            key (str): 欄位名稱
+
+        Returns:
+            _type_: 欄位值, 不存在則為 None
+        """
+        value = data
+        for name in key.split('.'):
+            if not isinstance(value, Mapping):
+                return None
+            value = value.get(name)
+        return value
+
+    def get_keyset_sort(self, sort_key: str = '_id'):
+        """取得 keyset 分頁排序條件
+
+        Args:
+            sort_key (str, optional): 排序欄位. Defaults to '_id'.
+
+        Returns:
+            list: 排序條件
+        """
+        if sort_key == '_id':
+            return [('_id', 1)]
+        # sort_key 可能重複, 以 _id 作為第二排序條件 確保順序穩定
+        return [(sort_key, 1), ('_id', 1)]
+
+    def generate_keyset_query(self, query: dict, sort_key: str = '_id', last_key=None, last_id=None):
+        """生成 keyset 分頁查詢條件, 取得上一批最後一筆之後的資料
+
+        Args:
+            query (dict): 原查詢條件
+            sort_key (str, optional): 排序欄位, 需建立索引. Defaults to '_id'.
+            last_key (optional): 上一批最後一筆的 sort_key 值
+            last_id (optional): 上一批最後一筆的 _id 值
+
+        Returns:
+            dict: 查詢條件
+        """
+        if sort_key == '_id':
+            range_query = {'_id': {'$gt': last_id}}
+        else:
+            range_query = {
+                '$or': [
+                    {sort_key: {'$gt': last_key}},
+                    {sort_key: last_key, '_id': {'$gt': last_id}}
+                ]
+            }
+
+        if len(query) > 0:
+            return {'$and': [query, range_query]}
+        return range_query
+
+    def get_batch_sizer(self, col, **kwargs):
+        """取得 自動調整每批筆數, 未啟用 adaptive_batch 則為 None
+
+        Args:
+            col (Collection): 集合
+            adaptive_batch (bool, optional): 依讀取時間及資料大小 自動調整每批筆數. Defaults to False.
+            target_batch_seconds (float, optional): 每批目標讀取秒數. Defaults to 0.2.
+            target_batch_bytes (int, optional): 每批資料量上限. Defaults to 16M.
+            min_batch_size (int, optional): 每批最少筆數. Defaults to 10.
+            max_batch_size (int, optional): 每批最多筆數. Defaults to 10000.
+
+        Returns:
+            AdaptiveBatchSizer: _description_
+        """
+        if not kwargs.get('adaptive_batch'):
+            return None
+        avg_obj_size = None
+        try:
+            # 尚未讀取資料前 以集合平均大小限制每批資料量
+            avg_obj_size = col.database.command('collStats', col.name).get('avgObjSize')
+        except Exception as err:
+            self.logger.warning(f'取得 {col.name} 平均資料大小 發生錯誤: {err}')
+        return AdaptiveBatchSizer(
+            size=self.size,
+            min_size=int(kwargs.get('min_batch_size', 10)),
+            max_size=int(kwargs.get('max_batch_size', 10000)),
+            target_seconds=float(kwargs.get('target_batch_seconds', 0.2)),
+            target_bytes=int(kwargs.get('target_batch_bytes', 16 * 1024 * 1024)),
+            avg_obj_size=avg_obj_size
+        )
+
+    def update_batch_size(self, sizer: AdaptiveBatchSizer, datas: list, seconds: float):
+        """依這批的讀取時間及資料大小 調整下一批筆數
+
+        Args:
+            sizer (AdaptiveBatchSizer): 自動調整每批筆數
+            datas (list): 這批資料
+            seconds (float): 讀取秒數
+        """
+        nbytes = None
+        if isinstance(datas[0], RawBSONDocument):
+            nbytes = sum(len(data.raw) for data in datas)
+        size = sizer.get_size()
+        new_size = sizer.update(len(datas), seconds, nbytes)
+        if new_size != size:
+            self.logger.debug('每批筆數 %d -> %d', size, new_size)
+
+    def get_skip_batches(self, col, query: dict = {}, start: int = 0, size: int = 100, projection: dict = None, sizer: AdaptiveBatchSizer = None):
+        """以 skip/limit 分批取得資料
+
+        Args:
+            col (Collection): 集合
+            query (dict, optional): 查詢條件. Defaults to {}.
+            start (int, optional): 起始位置. Defaults to 0.
+            size (int, optional): 每批筆數. Defaults to 100.
+            projection (dict, optional): 回傳欄位. Defaults to None.
+            sizer (AdaptiveBatchSizer, optional): 自動調整每批筆數, 設定時 size 無作用. Defaults to None.
+
+        Yields:
+            list: 每批資料
+        """
+        while True:
+            if sizer:
+                size = sizer.get_size()
+            fetch_start = monotonic()
+            # cursor batch_size 與每批筆數相同 一次取回整批
+            datas = list(col.find(query, projection)[start:start + size].batch_size(size))
+            if len(datas) == 0:
+                break
+            if sizer:
+                self.update_batch_size(sizer, datas, monotonic() - fetch_start)
+
+            yield datas
+
+            if len(datas) < size:
+                break
+            start += size
+
+    def get_keyset_batches(self, col, query: dict = {}, sort_key: str = '_id', start: int = 0, size: int = 100, last_key=None, last_id=None, projection: dict = None, sizer: AdaptiveBatchSizer = None):
+        """以 keyset ({sort_key: {$gt: 上一批最後一筆}}) 分批取得資料
+        每批查詢皆走索引 不需重新掃過前面的資料, 資料異動時也不會重複或遺漏
+
+        Args:
+            col (Collection): 集合
+            query (dict, optional): 查詢條件. Defaults to {}.
+            sort_key (str, optional): 排序欄位, 需建立索引. Defaults to '_id'.
+            start (int, optional): 起始位置, 僅第一批使用 skip. Defaults to 0.
+            size (int, optional): 每批筆數. Defaults to 100.
+            last_key (optional): 從此 sort_key 值之後開始, 接續進度紀錄使用. Defaults to None.
+            last_id (optional): 從此 _id 值之後開始, 接續進度紀錄使用. Defaults to None.
+            projection (dict, optional): 回傳欄位, 需包含 sort_key 及 _id. Defaults to None.
+            sizer (AdaptiveBatchSizer, optional): 自動調整每批筆數, 設定時 size 無作用. Defaults to None.
+
+        Yields:
+            list: 每批資料
+        """
+        sort = self.get_keyset_sort(sort_key)
+        while True:
+            if sizer:
+                size = sizer.get_size()
+            fetch_start = monotonic()
+            if last_id is None:
+                cursor = col.find(query, projection).sort(sort).skip(start)
+            else:
+                cursor = col.find(
+                    self.generate_keyset_query(query, sort_key=sort_key, last_key=last_key, last_id=last_id),
+                    projection
+                ).sort(sort)
+
+            # cursor batch_size 與每批筆數相同 一次取回整批
+            datas = list(cursor.limit(size).batch_size(size))
+            if len(datas) == 0:
+                break
+            if sizer:
+                self.update_batch_size(sizer, datas, monotonic() - fetch_start)
+
+            # 處理函式可能修改資料 (ex: 刪除 _id), 需先記錄最後一筆
+            last_key = self.get_field_value(datas[-1], sort_key)
+            last_id = datas[-1]['_id']
+
+            yield datas
+
+            if len(datas) < size:
+                break
+
+    def split_pipeline(self, pipeline: list, query: dict = {}):
+        """拆分 pipeline 開頭的 $match, 與查詢條件合併為來源查詢條件
+
+        Args:
+            pipeline (list): aggregation pipeline
+            query (dict, optional): 查詢條件 (ex: 分區、增量模式). Defaults to {}.
+
+        Returns:
+            tuple: (來源查詢條件, 其餘 stages)
+        """
+        stages = list(pipeline)
+        queries = [query] if query else []
+        while stages and list(stages[0].keys()) == ['$match']:
+            queries.append(stages.pop(0)['$match'])
+        if len(queries) == 0:
+            return {}, stages
+        if len(queries) == 1:
+            return queries[0], stages
+        return {'$and': queries}, stages
+
+    def generate_page_query(self, query: dict, sort_key: str, first: dict, last: dict):
+        """生成 keyset 分頁一頁範圍的查詢條件 (包含頭尾)
+
+        Args:
+            query (dict): 來源查詢條件
+            sort_key (str): 排序欄位
+            first (dict): 這頁第一筆 (sort_key 及 _id)
+            last (dict): 這頁最後一筆 (sort_key 及 _id)
+
+        Returns:
+            dict: 查詢條件
+        """
+        if sort_key == '_id':
+            range_query = {'_id': {'$gte': first['_id'], '$lte': last['_id']}}
+        else:
+            first_key = self.get_field_value(first, sort_key)
+            last_key = self.get_field_value(last, sort_key)
+            range_query = {
+                '$and': [
+                    {'$or': [{sort_key: {'$gt': first_key}}, {sort_key: first_key, '_id': {'$gte': first['_id']}}]},
+                    {'$or': [{sort_key: {'$lt': last_key}}, {sort_key: last_key, '_id': {'$lte': last['_id']}}]}
+                ]
+            }
+        if len(query) > 0:
+            return {'$and': [query, range_query]}
+        return range_query
+
+    def get_cursor_pipeline_batches(self, col, pipeline: list, query: dict = {}, start: int = 0, size: int = 100, sizer: AdaptiveBatchSizer = None):
+        """以單一 aggregate cursor 分批取得 pipeline 結果
+        全部 stages 在 mongo 執行 ($group 等跨資料的運算結果完整)
+
+        Args:
+            col (Collection): 集合
+            pipeline (list): aggregation pipeline
+            query (dict, optional): 查詢條件, 加在 pipeline 最前面. Defaults to {}.
+            start (int, optional): 略過前幾筆結果. Defaults to 0.
+            size (int, optional): 每批筆數. Defaults to 100.
+            sizer (AdaptiveBatchSizer, optional): 自動調整每批筆數, 設定時 size 無作用. Defaults to None.
+
+        Yields:
+            list: 每批資料
+        """
+        source_query, stages = self.split_pipeline(pipeline, query)
+        if len(source_query) > 0:
+            stages.insert(0, {'$match': source_query})
+        if start:
+            stages.append({'$skip': start})
+
+        cursor = col.aggregate(stages, allowDiskUse=True, batchSize=sizer.get_size() if sizer else size)
+        try:
+            while True:
+                if sizer:
+                    size = sizer.get_size()
+                fetch_start = monotonic()
+                datas = list(islice(cursor, size))
+                if len(datas) == 0:
+                    break
+                if sizer:
+                    self.update_batch_size(sizer, datas, monotonic() - fetch_start)
+
+                yield datas
+
+                if len(datas) < size:
+                    break
+        finally:
+            cursor.close()
+
+    def get_keyset_pipeline_batches(self, col, pipeline: list, query: dict = {}, sort_key: str = '_id', start: int = 0, size: int = 100, last_key=None, last_id=None, sizer: AdaptiveBatchSizer = None):
+        """以 keyset 分頁來源資料, 每頁以 $match 限制範圍後執行 pipeline
+        先以索引取得這頁的頭尾 (sort_key, _id), 再將範圍加在 pipeline 最前面,
+        $group 等跨資料的運算 只在同一頁內計算
+
+        Args:
+            col (Collection): 集合
+            pipeline (list): aggregation pipeline, 開頭的 $match 作為來源查詢條件
+            query (dict, optional): 查詢條件. Defaults to {}.
+            sort_key (str, optional): 排序欄位, 需建立索引. Defaults to '_id'.
+            start (int, optional): 起始位置, 僅第一頁使用 skip. Defaults to 0.
+            size (int, optional): 每頁來源筆數. Defaults to 100.
+            last_key (optional): 從此 sort_key 值之後開始. Defaults to None.
+            last_id (optional): 從此 _id 值之後開始. Defaults to None.
+            sizer (AdaptiveBatchSizer, optional): 自動調整每頁筆數, 設定時 size 無作用. Defaults to None.
+
+        Yields:
+            list: 每頁的 pipeline 結果, 無結果的頁不回傳
+        """
+        source_query, stages = self.split_pipeline(pipeline, query)
+        sort = self.get_keyset_sort(sort_key)
+        projection = {'_id': 1, sort_key: 1}
+        while True:
+            if sizer:
+                size = sizer.get_size()
+            fetch_start = monotonic()
+            if last_id is None:
+                cursor = col.find(source_query, projection).sort(sort).skip(start)
+            else:
+                cursor = col.find(
+                    self.generate_keyset_query(source_query, sort_key=sort_key, last_key=last_key, last_id=last_id),
+                    projection
+                ).sort(sort)
+            keys = list(cursor.limit(size).batch_size(size))
+            if len(keys) == 0:
+                break
+
+            page_query = self.generate_page_query(source_query, sort_key, keys[0], keys[-1])
+            datas = list(col.aggregate([{'$match': page_query}] + stages, allowDiskUse=True, batchSize=max(size, 1)))
+            if sizer:
+                # 以來源筆數調整每頁筆數
+                sizer.update(len(keys), monotonic() - fetch_start)
+
+            last_key = self.get_field_value(keys[-1], sort_key)
+            last_id = keys[-1]['_id']
+
+            if len(datas) > 0:
+                yield datas
+
+            if len(keys) < size:
+                break
+
+    def generate_projection(self, projection=None, fields: list = []):
+        """生成 projection, 確保分頁及 watermark 需要的欄位存在
+
+        Args:
+            projection (dict | list, optional): 回傳欄位 ex: {'name': 1} 或 ['name']. Defaults to None.
+            fields (list, optional): 必須回傳的欄位. Defaults to [].
+
+        Returns:
+            dict: projection, 未設定則為 None (回傳全部欄位)
+        """
+        if not projection:
+            return None
+        if isinstance(projection, (list, tuple)):
+            projection = {field: 1 for field in projection}
+        else:
+            projection = dict(projection)
+
+        # 包含模式 {'a': 1} 加入必要欄位, 排除模式 {'a': 0} 移除必要欄位
+        inclusive = any(value for key, value in projection.items() if key != '_id')
+        for field in fields:
+            if inclusive:
+                projection[field] = 1
+            else:
+                projection.pop(field, None)
+        return projection
+
+    def get_batches(self, col, query: dict = {}, pagination: str = 'skip', sort_key: str = '_id', start: int = 0, size: int = 100, last_key=None, last_id=None, projection: dict = None, sizer: AdaptiveBatchSizer = None, pipeline: list = None):
+        """依分頁方式 分批取得資料
+
+        Args:
+            col (Collection): 集合
+            query (dict, optional): 查詢條件. Defaults to {}.
+            pagination (str, optional): 分頁方式 skip 或 keyset. Defaults to 'skip'.
+            sort_key (str, optional): keyset 分頁排序欄位. Defaults to '_id'.
+            start (int, optional): 起始位置. Defaults to 0.
+            size (int, optional): 每批筆數. Defaults to 100.
+            last_key (optional): keyset 分頁 從此 sort_key 值之後開始. Defaults to None.
+            last_id (optional): keyset 分頁 從此 _id 值之後開始. Defaults to None.
+            projection (dict, optional): 回傳欄位. Defaults to None.
+            sizer (AdaptiveBatchSizer, optional): 自動調整每批筆數. Defaults to None.
+            pipeline (list, optional): aggregation pipeline, keyset 分頁時每頁執行, 其餘為單一 cursor, projection 無作用. Defaults to None.
+
+        Returns:
+            generator: 每批資料
+        """
+        if pipeline is not None:
+            if pagination == 'keyset':
+                return self.get_keyset_pipeline_batches(col, pipeline, query=query, sort_key=sort_key, start=start, size=size, last_key=last_key, last_id=last_id, sizer=sizer)
+            return self.get_cursor_pipeline_batches(col, pipeline, query=query, start=start, size=size, sizer=sizer)
+        if pagination == 'keyset':
+            return self.get_keyset_batches(col, query=query, sort_key=sort_key, start=start, size=size, last_key=last_key, last_id=last_id, projection=projection, sizer=sizer)
+        elif pagination == 'skip':
+            return self.get_skip_batches(col, query=query, start=start, size=size, projection=projection, sizer=sizer)
+        else:
+            raise ValueError(f'pagination 設定錯誤: {pagination}')
+
+    def get_partition_bounds(self, col, query: dict = {}, partition_key: str = '_id', partitions: int = 2, method: str = 'sample'):
+        """取得分區邊界
+
+        Args:
+            col (Collection): 集合
+            query (dict, optional): 查詢條件. Defaults to {}.
+            partition_key (str, optional): 分區欄位, 需建立索引且每筆資料皆存在. Defaults to '_id'.
+            partitions (int, optional): 分區數量. Defaults to 2.
+            method (str, optional): 取得邊界方式. Defaults to 'sample'.
+                sample: 隨機抽樣取得分位數, 速度快 分區大小為近似值
+                bucket: 使用 $bucketAuto, 分區大小較平均 但需掃過全部資料
+
+        Returns:
+            list: 分區邊界 (不含頭尾), 數量最多為 partitions - 1
+        """
+        pipeline = []
+        if len(query) > 0:
+            pipeline.append({'$match': query})
+
+        if method == 'bucket':
+            pipeline.append({'$bucketAuto': {'groupBy': f'${partition_key}', 'buckets': partitions}})
+            buckets = list(col.aggregate(pipeline, allowDiskUse=True))
+            bounds = [bucket['_id']['min'] for bucket in buckets[1:]]
+        elif method == 'sample':
+            pipeline += [
+                {'$sample': {'size': partitions * 100}},
+                {'$sort': {partition_key: 1}},
+                {'$project': {partition_key: 1}}
+            ]
+            values = [self.get_field_value(data, partition_key) for data in col.aggregate(pipeline, allowDiskUse=True)]
+            bounds = []
+            if len(values) > 0:
+                bounds = [values[len(values) * i // partitions] for i in range(1, partitions)]
+        else:
+            raise ValueError(f'partition_method 設定錯誤: {method}')
+
+        # 移除重複邊界, 避免產生空分區
+        unique_bounds = []
+        for bound in bounds:
+            if bound is not None and (len(unique_bounds) == 0 or unique_bounds[-1] != bound):
+                unique_bounds.append(bound)
+        return unique_bounds
+
+    def generate_partition_query(self, query: dict, partition_key: str = '_id', lower=None, upper=None):
+        """生成分區查詢條件 lower <= partition_key < upper
+
+        Args:
+            query (dict): 原查詢條件
+            partition_key (str, optional): 分區欄位. Defaults to '_id'.
+            lower (optional): 下限 (包含), None 為不限制
+            upper (optional): 上限 (不包含), None 為不限制
+
+        Returns:
+            dict: 查詢條件
+        """
+        range_query = {}
+        if lower is not None:
+            range_query['$gte'] = lower
+        if upper is not None:
+            range_query['$lt'] = upper
+
+        if len(range_query) == 0:
+            return query
+        if len(query) > 0:
+            return {'$and': [query, {partition_key: range_query}]}
+        return {partition_key: range_query}
+
+    def get_partitions(self, database: str, collection: str, partitions: int, **kwargs):
+        """將函式參數拆分成多個分區的參數
+
+        Args:
+            database (str): 資料庫
+            collection (str): 集合
+            partitions (int): 分區數量
+            query (dict, optional): 查詢條件. Defaults to {}.
+            partition_key (str, optional): 分區欄位. Defaults to '_id'.
+            partition_method (str, optional): 取得邊界方式 sample 或 bucket. Defaults to 'sample'.
+
+        Returns:
+            list[dict]: 每個分區的 process_mongo_datas 參數
+        """
+        query = kwargs.get('query', {})
+        partition_key = kwargs.get('partition_key', '_id')
+        checkpoint_name = kwargs.get('checkpoint_name')
+
+        # 接續進度時 需使用與上次相同的分區邊界, 與未分區的進度紀錄分開儲存
+        bounds_name = f'{checkpoint_name}.bounds' if checkpoint_name else None
+        bounds = None
+        if bounds_name and kwargs.get('resume'):
+            state = self.checkpoint_store.load(bounds_name)
+            if state:
+                bounds = state.get('bounds')
+
+        if bounds is None:
+            connect_uuid = self.mongo_pool.get_connect()
+            try:
+                col = self.mongo_pool.pool[connect_uuid][database][collection]
+                bounds = self.get_partition_bounds(
+                    col,
+                    query=query,
+                    partition_key=partition_key,
+                    partitions=partitions,
+                    method=kwargs.get('partition_method', 'sample')
+                )
+            finally:
+                self.mongo_pool.release_connect(connect_uuid)
+
+            if bounds_name:
+                self.checkpoint_store.save(bounds_name, {'bounds': bounds})
+
+        if kwargs.get('start'):
+            self.logger.warning(f'分區模式不支援 start 參數, 已忽略 start: {kwargs["start"]}')
+
+        lowers = [None] + bounds
+        uppers = bounds + [None]
+        partition_kwargs = []
+        for index, (lower, upper) in enumerate(zip(lowers, uppers)):
+            details = {
+                **kwargs,
+                'database': database,
+                'collection': collection,
+                'query': self.generate_partition_query(query, partition_key=partition_key, lower=lower, upper=upper),
+                'start': 0,
+                'partition': f'{index + 1}/{len(lowers)}'
+            }
+            if checkpoint_name:
+                details['checkpoint_name'] = f'{checkpoint_name}.{index + 1}'
+            partition_kwargs.append(details)
+        self.logger.info(f'{database}.{collection} 分區數量: {len(partition_kwargs)} 邊界: {bounds}')
+        return partition_kwargs
+
+    def get_task_projection(self, **kwargs):
+        """取得 函式參數的 projection, 加入分頁及 watermark 需要的欄位
+
+        Returns:
+            dict: projection
+        """
+        fields = []
+        if kwargs.get('pagination', 'skip') == 'keyset':
+            fields += ['_id', kwargs.get('sort_key', '_id')]
+        if kwargs.get('watermark_key'):
+            fields.append(kwargs['watermark_key'])
+        return self.generate_projection(kwargs.get('projection'), fields)
+
     def process_mongo_datas(self, func, database: str, collection: str, **kwargs):
         """處理 mongo 資料
 
@@ -120,12 +1014,47 @@ class MongoSync(TestBasic):
             collection (str): 集合
             func (_type_): 執行的函式
             database (str): 資料庫.
+            query (dict, optional): 查詢條件. Defaults to {}.
             limit (int, optional): 執行幾筆
+            start (int, optional): 從第幾筆開始. Defaults to 0.
+            pagination (str, optional): 分頁方式 skip 或 keyset. Defaults to 'skip'.
+            sort_key (str, optional): keyset 分頁排序欄位, 需建立索引. Defaults to '_id'.
+            partition (str, optional): 分區名稱, 顯示進度用
+            projection (dict | list, optional): 回傳欄位. Defaults to None.
+            raw_bson (bool, optional): 處理函式收到 RawBSONDocument. Defaults to False.
+            adaptive_batch (bool, optional): 自動調整每批筆數, 參數見 get_batch_sizer. Defaults to False.
+            prefetch (bool, optional): 預先讀取下一批, 讀取與處理同時進行. Defaults to False.
+            prefetch_depth (int, optional): 預先讀取 最多暫存批數. Defaults to 2.
+            prefetch_bytes (int, optional): 預先讀取 暫存資料量上限. Defaults to None.
+            prefetch_consumers (int, optional): 同時處理批次的執行緒數量, 處理函式需為 thread-safe. Defaults to 1.
+            concurrency (int, optional): 每批資料同時執行處理函式的執行緒數量, 處理函式需為 thread-safe. Defaults to 1.
+            pipeline (list, optional): aggregation pipeline, 取代 find(query). Defaults to None.
+            order_key (str, optional): concurrency 時 相同值的資料依序執行. Defaults to None.
+            collect_errors (bool, optional): 處理函式發生錯誤時 紀錄後繼續處理, 見 get_errors. Defaults to False.
+            is_done (optional): 每批處理後呼叫, 回傳 True 時停止讀取 (ex: 共用讀取的函式皆已達到 limit). Defaults to None.
             mongo_client : 若處理函式的 mongo 主機與批量資料處理的不同, 需帶入 mongo_client
+
+        Returns:
+            int: 處理筆數
         """
+        count = 0
+        connect_uuid = None
+        metrics_label = None
+        prefetcher = None
+        consumer_executor = None
+        func_executor = None
+        label = f'[分區 {kwargs["partition"]}] ' if kwargs.get('partition') else ''
         try:
             query = kwargs.get('query', {})
             limit = int(kwargs.get('limit', 0))
+            pagination = kwargs.get('pagination', 'skip')
+            sort_key = kwargs.get('sort_key', '_id')
+
+            tracker = self.get_checkpoint_tracker(func, label, **kwargs)
+            if tracker and tracker.state['done']:
+                self.logger.info(f'{label}進度紀錄已完成, 略過')
+                return count
+
             connect_uuid = self.mongo_pool.get_connect()
             mongo_client = self.mongo_pool.pool[connect_uuid]
 
@@ -135,47 +1064,529 @@ class MongoSync(TestBasic):
             if not isinstance(mongo_client, MongoClient):
                 raise TypeError('mongo_client 設定錯誤')
             col = mongo_client[database][collection]
+            if kwargs.get('raw_bson'):
+                # 處理函式收到 RawBSONDocument, 存取欄位時才解析
+                col = col.with_options(codec_options=CodecOptions(document_class=RawBSONDocument))
 
             if limit:
                 self.logger.debug(f'限制執行 {limit} 筆')
 
-            total = self.get_mongo_total_amount(
+            # aggregation pipeline 的結果筆數 需執行完才能得知
+            total = None if kwargs.get('pipeline') else self.get_mongo_total_amount(
                 mongo_client=mongo_client, database=database, collection=collection, query=query)
-            self.logger.info(f'總量: {total}')
+            self.logger.info(f'{label}總量: {total}')
             start = int(kwargs.get('start', 0))
-            per = self.size
-            count = 0
+
+            metrics_label = self.get_metrics_label(func)
+            self.metrics.start(metrics_label, self.get_progress_total(total, limit))
+            # save_to_mongo 依此紀錄 新增、更新筆數
+            self.metrics.set_label(metrics_label)
+            progress = MongoProgress(self.logger, label, self.get_progress_total(total, limit), **self.progress_setting)
+
+            sizer = self.get_batch_sizer(col, **kwargs)
+            batches = self.get_batches(
+                col,
+                query=query,
+                pagination=pagination,
+                sort_key=sort_key,
+                start=start,
+                size=self.size,
+                last_key=tracker.state['last_key'] if tracker else None,
+                last_id=tracker.state['last_id'] if tracker else None,
+                projection=self.get_task_projection(**kwargs),
+                sizer=sizer,
+                pipeline=kwargs.get('pipeline')
+            )
+
+            # 預先讀取: 讀取執行緒讀取下一批的同時 處理目前批次
+            if kwargs.get('prefetch'):
+                prefetcher = BatchPrefetcher(batches, depth=kwargs.get('prefetch_depth', 2), max_bytes=kwargs.get('prefetch_bytes'))
+                batches = prefetcher
+            consumers = max(int(kwargs.get('prefetch_consumers', 1)), 1)
+            if consumers > 1:
+                consumer_executor = ThreadPoolExecutor(consumers, thread_name_prefix='MongoSyncConsumer')
+            # 每批資料 由多個執行緒同時處理
+            concurrency = int(kwargs.get('concurrency', 1))
+            if concurrency > 1:
+                func_executor = ThreadPoolExecutor(concurrency, thread_name_prefix='MongoSyncFunc')
+            batch_setting = {
+                'executor': func_executor,
+                'order_key': kwargs.get('order_key'),
+                'collect_errors': kwargs.get('collect_errors', False)
+            }
+
+            watermark_key = kwargs.get('watermark_key')
+            is_done = kwargs.get('is_done')
+            watermark = None
+            submitted = 0
             stop_process = False
-            while True:
+            # {future: 批次編號}
+            pending = {}
+            fetch_start = monotonic()
+            for datas in batches:
+                self.metrics.observe(metrics_label, 'fetch', monotonic() - fetch_start)
+                self.metrics.inc(metrics_label, 'read', len(datas))
+                if sizer:
+                    self.metrics.set_gauge(metrics_label, 'batch_size', sizer.get_size())
+                if limit:
+                    stop_process = submitted + len(datas) >= limit
+                    datas = datas[:limit - submitted]
+                submitted += len(datas)
 
-                end = start + per
-                if end >= total:
-                    end = total
+                seq = None
+                if tracker and not stop_process:
+                    seq = tracker.add(self.get_field_value(datas[-1], sort_key), datas[-1]['_id'], len(datas))
+                if watermark_key:
+                    watermark = self.get_max_value(datas, watermark_key, watermark)
 
-                datas = col.find(query)[start:end]
-                for data in datas:
-                    count += 1
-                    self.logger.debug(f'{count}/{total}')
-                    func(data=data, mongo_client=func_mongo_client)
+                if consumer_executor is None:
+                    count += self.process_batch(func, datas, func_mongo_client, metrics_label, progress, **batch_setting)
+                    if tracker and seq is not None:
+                        tracker.complete(seq)
+                else:
+                    pending[consumer_executor.submit(self.process_batch, func, datas, func_mongo_client, metrics_label, progress, **batch_setting)] = seq
+                    # 限制處理中的批次數量 避免讀取速度超過處理速度
+                    while len(pending) >= consumers * 2:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            count += future.result()
+                            seq = pending.pop(future)
+                            if tracker and seq is not None:
+                                tracker.complete(seq)
 
-                    # 測試模式 每筆停止一秒
-                    if self.test:
-                        sleep(self.sleep_sec)
+                if stop_process:
+                    self.logger.debug(f'已執行 {submitted} 筆, 中止程式')
+                    break
+                if is_done is not None and is_done():
+                    self.logger.debug(f'{label}已完成, 停止讀取')
+                    stop_process = True
+                    break
+                fetch_start = monotonic()
 
-                    if limit != None:
-                        if count == limit:
-                            self.logger.debug(f'已執行 {count} 筆, 中止程式')
-                            stop_process = True
-                            break
+            for future in as_completed(pending):
+                count += future.result()
+                if tracker and pending[future] is not None:
+                    tracker.complete(pending[future])
+
+            if tracker and not stop_process:
+                tracker.finish()
+            if watermark_key:
+                # 限制筆數時 未處理完全部資料, 不更新 watermark
+                self.record_watermark(func, watermark, failed=stop_process)
+
+            if sizer:
+                self.logger.info(f'{label}每批筆數: {sizer.get_size()}')
+            self.logger.info(f'{label}處理完成 {count}/{total}')
+        except Exception as err:
+            self.logger.error(f'{label}處理 mongo 資料 發生錯誤: {err}', exc_info=True)
+            self.metrics.inc(self.get_metrics_label(func), 'errors')
+            if kwargs.get('watermark_key'):
+                self.record_watermark(func, failed=True)
+        finally:
+            if consumer_executor is not None:
+                consumer_executor.shutdown(wait=True, cancel_futures=True)
+            if func_executor is not None:
+                func_executor.shutdown(wait=True, cancel_futures=True)
+            if prefetcher is not None:
+                prefetcher.close()
+            if metrics_label:
+                self.metrics.finish(metrics_label)
+                self.metrics.set_label(None)
+            if connect_uuid is not None:
+                self.mongo_pool.release_connect(connect_uuid)
+        return count
+
+    def group_datas(self, datas: list, order_key: str = None):
+        """依 order_key 分組, 相同值的資料在同一組 依原順序執行
+        未設定 order_key 時 每筆各自一組
+
+        Args:
+            datas (list): 一批資料
+            order_key (str, optional): 分組欄位. Defaults to None.
+
+        Returns:
+            list: [[資料]]
+        """
+        if not order_key:
+            return [[data] for data in datas]
+        groups = {}
+        for data in datas:
+            value = self.get_field_value(data, order_key)
+            try:
+                hash(value)
+            except TypeError:
+                value = repr(value)
+            groups.setdefault(value, []).append(data)
+        return list(groups.values())
+
+    def process_datas(self, func, datas: list, mongo_client: MongoClient, metrics_label: str, progress: MongoProgress, collect_errors: bool = False):
+        """依序執行 資料的處理函式
+
+        Args:
+            func (_type_): 執行的函式
+            datas (list): 資料
+            mongo_client (MongoClient): 處理函式使用的 mongo_client
+            metrics_label (str): 統計名稱
+            progress (MongoProgress): 處理進度
+            collect_errors (bool, optional): 紀錄錯誤後繼續處理. Defaults to False.
+        """
+        # save_to_mongo 依此紀錄 新增、更新筆數, 每個執行緒各自設定
+        self.metrics.set_label(metrics_label)
+        for data in datas:
+            progress.update()
+            func_start = monotonic()
+            try:
+                func(data=data, mongo_client=mongo_client)
+            except Exception as err:
+                if not collect_errors:
+                    raise
+                self.record_error(metrics_label, data, err)
+            self.metrics.observe(metrics_label, 'func', monotonic() - func_start)
+            self.metrics.inc(metrics_label, 'processed')
+
+            # 測試模式 每筆停止一秒
+            if self.test:
+                sleep(self.sleep_sec)
+
+    def process_batch(self, func, datas: list, mongo_client: MongoClient, metrics_label: str, progress: MongoProgress, executor: ThreadPoolExecutor = None, **kwargs):
+        """執行 一批資料的處理函式
+        有 executor 時 資料 (或 order_key 相同的一組資料) 分配給多個執行緒同時執行, 整批完成後回傳
+
+        Args:
+            func (_type_): 執行的函式
+            datas (list): 一批資料
+            mongo_client (MongoClient): 處理函式使用的 mongo_client
+            metrics_label (str): 統計名稱
+            progress (MongoProgress): 處理進度
+            executor (ThreadPoolExecutor, optional): 同時處理的執行緒池. Defaults to None.
+            order_key (str, optional): 相同值的資料依序執行
+            collect_errors (bool, optional): 紀錄錯誤後繼續處理
+
+        Returns:
+            int: 處理筆數
+        """
+        collect_errors = kwargs.get('collect_errors', False)
+        if executor is None:
+            self.process_datas(func, datas, mongo_client, metrics_label, progress, collect_errors)
+            return len(datas)
+
+        futures = [
+            executor.submit(self.process_datas, func, group, mongo_client, metrics_label, progress, collect_errors)
+            for group in self.group_datas(datas, kwargs.get('order_key'))
+        ]
+        # 等待整批完成, 未 collect_errors 時 其他資料處理完成後拋出第一個錯誤
+        wait(futures)
+        for future in futures:
+            future.result()
+        return len(datas)
+
+    def record_batch_metrics(self, metrics_label: str, result: dict):
+        """紀錄 子程序處理一批的統計 (多程序模式)
+        合併子程序 save_to_mongo 的新增、更新、無變化、錯誤筆數及寫入延遲, 處理延遲以整批紀錄為 func_batch
+
+        Args:
+            metrics_label (str): 統計名稱
+            result (dict): process_raw_batch 的結果
+        """
+        self.metrics.merge(result.get('metrics', {}))
+        self.metrics.inc(metrics_label, 'processed', result['count'])
+        self.metrics.observe(metrics_label, 'func_batch', result['seconds'])
+
+    def check_process_settings(self, tasks: list):
+        """檢查 多程序模式 不支援的參數
+
+        Args:
+            tasks (list[tuple]): [(func, 參數), ...]
+
+        Raises:
+            ValueError: stream、共用讀取、concurrency、prefetch_consumers 或 collect_errors
+        """
+        for func, task in tasks:
+            unsupported = [key for key in ('stream', 'scan_group', 'collect_errors') if task.get(key)]
+            unsupported += [key for key in ('concurrency', 'prefetch_consumers') if int(task.get(key) or 1) > 1]
+            if unsupported:
+                raise ValueError(f'多程序模式 不支援的參數: {func.__self__.__class__.__name__} {func.__name__} {unsupported}')
+
+    def process_mongo_datas_in_process(self, process_executor: ProcessPoolExecutor, func_id: int, func, database: str, collection: str, **kwargs):
+        """處理 mongo 資料 (多程序模式)
+        主程序分批讀取 BSON 原始資料, 交由子程序解析及執行處理函式
+
+        Args:
+            process_executor (ProcessPoolExecutor): 子程序池
+            func_id (int): 處理函式編號
+            func (_type_): 執行的函式
+            database (str): 資料庫.
+            collection (str): 集合
+            max_pending (int, optional): 最多同時處理的批次數量. Defaults to 2.
+            其餘參數同 process_mongo_datas, 處理函式使用子程序自己的 mongo_client
+
+        Returns:
+            int: 處理筆數
+        """
+        count = 0
+        connect_uuid = None
+        metrics_label = None
+        prefetcher = None
+        label = f'[分區 {kwargs["partition"]}] ' if kwargs.get('partition') else ''
+        try:
+            query = kwargs.get('query', {})
+            limit = int(kwargs.get('limit', 0))
+            max_pending = int(kwargs.get('max_pending', 2))
+            sort_key = kwargs.get('sort_key', '_id')
+
+            # 子程序每批處理完成前 已寫入批次寫入的暫存資料
+            tracker = self.get_checkpoint_tracker(func, label, flush=False, **kwargs)
+            if tracker and tracker.state['done']:
+                self.logger.info(f'{label}進度紀錄已完成, 略過')
+                return count
+
+            connect_uuid = self.mongo_pool.get_connect()
+            mongo_client = self.mongo_pool.pool[connect_uuid]
+
+            if not isinstance(mongo_client, MongoClient):
+                raise TypeError('mongo_client 設定錯誤')
+            col = mongo_client[database][collection].with_options(
+                codec_options=CodecOptions(document_class=RawBSONDocument)
+            )
+
+            if limit:
+                self.logger.debug(f'限制執行 {limit} 筆')
+
+            # aggregation pipeline 的結果筆數 需執行完才能得知
+            total = None if kwargs.get('pipeline') else self.get_mongo_total_amount(
+                mongo_client=mongo_client, database=database, collection=collection, query=query)
+            self.logger.info(f'{label}總量: {total}')
+
+            metrics_label = self.get_metrics_label(func)
+            self.metrics.start(metrics_label, self.get_progress_total(total, limit))
+            progress = MongoProgress(self.logger, label, self.get_progress_total(total, limit), **self.progress_setting)
+
+            sizer = self.get_batch_sizer(col, **kwargs)
+            batches = self.get_batches(
+                col,
+                query=query,
+                pagination=kwargs.get('pagination', 'skip'),
+                sort_key=sort_key,
+                start=int(kwargs.get('start', 0)),
+                size=self.size,
+                last_key=tracker.state['last_key'] if tracker else None,
+                last_id=tracker.state['last_id'] if tracker else None,
+                projection=self.get_task_projection(**kwargs),
+                sizer=sizer,
+                pipeline=kwargs.get('pipeline')
+            )
+            if kwargs.get('prefetch'):
+                prefetcher = BatchPrefetcher(batches, depth=kwargs.get('prefetch_depth', 2), max_bytes=kwargs.get('prefetch_bytes'))
+                batches = prefetcher
+            sleep_sec = self.sleep_sec if self.test else 0
+
+            watermark_key = kwargs.get('watermark_key')
+            watermark = None
+            submitted = 0
+            seconds = 0
+            stop_process = False
+            # {future: 批次編號}
+            pending = {}
+            fetch_start = monotonic()
+            for datas in batches:
+                self.metrics.observe(metrics_label, 'fetch', monotonic() - fetch_start)
+                self.metrics.inc(metrics_label, 'read', len(datas))
+                if sizer:
+                    self.metrics.set_gauge(metrics_label, 'batch_size', sizer.get_size())
+                if limit:
+                    stop_process = submitted + len(datas) >= limit
+                    datas = datas[:limit - submitted]
+                submitted += len(datas)
 
-                if end == total or stop_process:
+                seq = None
+                if tracker and not stop_process:
+                    seq = tracker.add(self.get_field_value(datas[-1], sort_key), datas[-1]['_id'], len(datas))
+                if watermark_key:
+                    watermark = self.get_max_value(datas, watermark_key, watermark)
+
+                raw_datas = b''.join(data.raw for data in datas)
+                pending[process_executor.submit(process_raw_batch, func_id, raw_datas, sleep_sec, metrics_label)] = seq
+
+                # 限制送出的批次數量 避免讀取速度超過處理速度
+                while len(pending) >= max_pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        result = future.result()
+                        seq = pending.pop(future)
+                        if tracker and seq is not None:
+                            tracker.complete(seq)
+                        count += result['count']
+                        seconds += result['seconds']
+                        self.record_batch_metrics(metrics_label, result)
+                        progress.update(result['count'])
+
+                if stop_process:
+                    self.logger.debug(f'已執行 {submitted} 筆, 中止程式')
                     break
+                fetch_start = monotonic()
+
+            for future in as_completed(pending):
+                result = future.result()
+                if tracker and pending[future] is not None:
+                    tracker.complete(pending[future])
+                count += result['count']
+                seconds += result['seconds']
+                self.record_batch_metrics(metrics_label, result)
+                progress.update(result['count'])
+
+            if tracker and not stop_process:
+                tracker.finish()
+            if watermark_key:
+                self.record_watermark(func, watermark, failed=stop_process)
+
+            if sizer:
+                self.logger.info(f'{label}每批筆數: {sizer.get_size()}')
+            self.logger.info(f'{label}處理完成 {count}/{total} 子程序執行時間: {seconds:.2f} 秒')
+        except Exception as err:
+            self.logger.error(f'{label}處理 mongo 資料 發生錯誤: {err}', exc_info=True)
+            self.metrics.inc(self.get_metrics_label(func), 'errors')
+            if kwargs.get('watermark_key'):
+                self.record_watermark(func, failed=True)
+        finally:
+            if prefetcher is not None:
+                prefetcher.close()
+            if metrics_label:
+                self.metrics.finish(metrics_label)
+            if connect_uuid is not None:
+                self.mongo_pool.release_connect(connect_uuid)
+        return count
+
+    def generate_stream_match(self, query: dict):
+        """將查詢條件 轉換為 change stream 的 $match 條件 (欄位加上 fullDocument.)
+
+        Args:
+            query (dict): 查詢條件
+
+        Returns:
+            dict: change stream $match 條件
+        """
+        match = {}
+        for key, value in query.items():
+            if key in ['$and', '$or', '$nor']:
+                match[key] = [self.generate_stream_match(sub_query) for sub_query in value]
+            elif key.startswith('$'):
+                raise ValueError(f'stream 模式 不支援的查詢條件: {key}')
+            else:
+                match[f'fullDocument.{key}'] = value
+        return match
+
+    def process_mongo_stream(self, func, database: str, collection: str, **kwargs):
+        """處理 mongo change stream (stream 模式)
+        持續接收集合的新增、更新、取代事件, 累積成批後 將 fullDocument 交給處理函式
+        設置進度紀錄時 每批處理完成後記錄 resume token, 重新執行時從上次位置繼續
+
+        Args:
+            collection (str): 集合
+            func (_type_): 執行的函式
+            database (str): 資料庫.
+            query (dict, optional): 查詢條件, 比對事件的 fullDocument. Defaults to {}.
+            limit (int, optional): 處理筆數達到後停止, 0 為不限制. Defaults to 0.
+            stream_batch_seconds (float, optional): 每批最長等待秒數. Defaults to 1.
+            checkpoint_name (str, optional): 進度紀錄名稱
+            mongo_client : 若處理函式的 mongo 主機與批量資料處理的不同, 需帶入 mongo_client
+
+        Returns:
+            int: 處理筆數
+        """
+        count = 0
+        connect_uuid = None
+        try:
+            query = kwargs.get('query', {})
+            limit = int(kwargs.get('limit', 0))
+            batch_seconds = float(kwargs.get('stream_batch_seconds', 1))
+
+            checkpoint_name = kwargs.get('checkpoint_name')
+            if checkpoint_name:
+                checkpoint_name = f'{checkpoint_name}.stream'
+                state = self.checkpoint_store.load(checkpoint_name) or {'resume_token': None, 'count': 0}
+            else:
+                self.logger.warning('未設置進度紀錄, stream 重新執行時 無法從上次位置繼續')
+                state = {'resume_token': None, 'count': 0}
+
+            connect_uuid = self.mongo_pool.get_connect()
+            mongo_client = self.mongo_pool.pool[connect_uuid]
+
+            # 若處理函式的 mongo 主機不同, 需帶入 mongo_client
+            func_mongo_client = kwargs.get('mongo_client', mongo_client)
+            instance = getattr(func, '__self__', None)
+
+            pipeline = [
+                {
+                    '$match': {
+                        'operationType': {'$in': ['insert', 'update', 'replace']},
+                        **self.generate_stream_match(query)
+                    }
+                }
+            ]
+            if state['resume_token']:
+                self.logger.info(f'stream {database}.{collection} 從 resume token 繼續')
+
+            col = mongo_client[database][collection]
+            with col.watch(
+                pipeline,
+                full_document='updateLookup',
+                resume_after=state['resume_token'],
+                max_await_time_ms=int(batch_seconds * 1000)
+            ) as stream:
+                self.logger.info(f'開始接收 stream {database}.{collection}')
+                while not self.stop_event.is_set() and stream.alive and not (limit and count >= limit):
+                    changes = []
+                    deadline = monotonic() + batch_seconds
+                    while len(changes) < self.size and monotonic() < deadline and not self.stop_event.is_set():
+                        change = stream.try_next()
+                        if change is not None:
+                            changes.append(change)
+
+                    if len(changes) == 0:
+                        continue
+
+                    processed = 0
+                    resume_token = stream.resume_token
+                    for change in changes:
+                        if limit and count >= limit:
+                            # 未處理的事件 下次從此繼續
+                            break
+                        resume_token = change['_id']
+                        # 更新後 文件已被刪除 fullDocument 為 None
+                        data = change.get('fullDocument')
+                        if data is None:
+                            continue
+                        count += 1
+                        processed += 1
+                        self.logger.debug('stream %s.%s %s: %d', database, collection, change['operationType'], count)
+                        func(data=data, mongo_client=func_mongo_client)
+
+                        # 測試模式 每筆停止一秒
+                        if self.test:
+                            sleep(self.sleep_sec)
+                    else:
+                        resume_token = stream.resume_token
 
-                start += per
+                    if hasattr(instance, 'flush_bulk_write'):
+                        instance.flush_bulk_write()
 
-            self.mongo_pool.del_connect(connect_uuid)
+                    if checkpoint_name:
+                        state['resume_token'] = resume_token
+                        state['count'] += processed
+                        self.checkpoint_store.save(checkpoint_name, state)
+
+            self.logger.info(f'停止接收 stream {database}.{collection} 共處理 {count} 筆')
         except Exception as err:
-            self.logger.error(f'處理 mongo 資料 發生錯誤: {err}', exc_info=True)
+            self.logger.error(f'處理 mongo stream 發生錯誤: {err}', exc_info=True)
+        finally:
+            if connect_uuid is not None:
+                self.mongo_pool.release_connect(connect_uuid)
+        return count
+
+    def stop(self):
+        """停止 stream 模式的處理函式, 目前批次處理完成後結束
+        """
+        self.stop_event.set()
 
     def add_func(self, func, database: str, collection: str, limit: int = 0,  query: dict = {}, **kwargs):
         """新增 要執行的函式
@@ -185,8 +1596,49 @@ class MongoSync(TestBasic):
             collection (str): 取得資料的需使用的 collection 名稱
             limit (int, optional): 測試回數. Defaults to 0.
             query (dict, optional): 查詢條件. Defaults to {}.
-            mongo_client : MongoConnect 連線物件
+            start (int, optional): 從第幾筆開始. Defaults to 0.
+            pagination (str, optional): 分頁方式. Defaults to 'skip'.
+                skip: 以 skip/limit 分頁, 越後面的批次越慢
+                keyset: 以 sort_key 範圍分頁, 大集合建議使用
+            sort_key (str, optional): keyset 分頁排序欄位, 需建立索引. Defaults to '_id'.
+            partitions (int, optional): 分區數量, 大於 1 時將集合依 partition_key 範圍拆分 由多個執行序同時處理. Defaults to 1.
+            partition_key (str, optional): 分區欄位, 需建立索引且每筆資料皆存在. Defaults to '_id'.
+            partition_method (str, optional): 取得分區邊界方式 sample 或 bucket. Defaults to 'sample'.
+            max_pending (int, optional): 多程序模式 最多同時處理的批次數量. Defaults to workers * 2.
+            checkpoint_name (str, optional): 進度紀錄名稱. Defaults to 類別.函式.資料庫.集合
+            stream (bool, optional): stream 模式, 持續接收集合的 change stream, 需為 replica set. Defaults to False.
+                執行中的 stream 會佔用一個執行序, 直到呼叫 stop()
+            stream_batch_seconds (float, optional): stream 模式 每批最長等待秒數. Defaults to 1.
+            projection (dict | list, optional): 回傳欄位, 只取需要的欄位 減少傳輸及解析. Defaults to None.
+            raw_bson (bool, optional): 處理函式收到 RawBSONDocument, 存取欄位時才解析 (唯讀, 需修改時使用 bson.decode(data.raw)). Defaults to False.
+            adaptive_batch (bool, optional): 依每批讀取時間及資料大小 自動調整每批筆數 (初始為 size). Defaults to False.
+            target_batch_seconds (float, optional): 自動調整 每批目標讀取秒數. Defaults to 0.2.
+            target_batch_bytes (int, optional): 自動調整 每批資料量上限. Defaults to 16M.
+            min_batch_size (int, optional): 自動調整 每批最少筆數. Defaults to 10.
+            max_batch_size (int, optional): 自動調整 每批最多筆數. Defaults to 10000.
+            prefetch (bool, optional): 預先讀取, 讀取執行緒讀取下一批的同時處理目前批次. Defaults to False.
+            prefetch_depth (int, optional): 預先讀取 最多暫存批數, 達到時讀取執行緒等待. Defaults to 2.
+            prefetch_bytes (int, optional): 預先讀取 暫存資料量上限 (bytes), 至少保留一批. Defaults to None.
+            prefetch_consumers (int, optional): 多執行緒模式 同時處理批次的執行緒數量, 處理函式需為 thread-safe. Defaults to 1.
+            concurrency (int, optional): 多執行緒模式 每批資料分配給幾個執行緒同時執行處理函式, 共用同一個連線池, 處理函式需為 thread-safe. Defaults to 1.
+            order_key (str, optional): concurrency 時 同一批中相同值的資料 (ex: comic_id) 在同一執行緒依序執行, prefetch_consumers > 1 時不同批次仍可能同時執行. Defaults to None.
+            collect_errors (bool, optional): 多執行緒模式 處理函式發生錯誤時 紀錄錯誤 (get_errors) 後繼續處理, 不中止整批. Defaults to False.
+            pipeline (list, optional): 以 aggregation pipeline 取得資料 ($match、$project、$lookup、$unwind、$group 等), 取代 find(query). Defaults to None.
+                開頭的 $match 與 query 合併為來源查詢條件, 不計算總量, 不支援進度紀錄及增量模式, projection 無作用 (請使用 $project)
+                pagination='keyset' 時 以 sort_key 分頁來源資料, 每頁執行一次 pipeline ($group 只在同一頁內計算)
+                其餘為單一 aggregate cursor 分批處理
+            scan_group (str, optional): 共用讀取群組, 相同群組且讀取相同集合的處理函式 以一次讀取 (查詢條件及回傳欄位聯集) 分配資料. Defaults to None.
+                MongoSync(shared_scan=True) 時 未設定的函式依 資料庫.集合 自動分組
+                查詢條件需可在記憶體中比對 (欄位相等及 $eq $ne $gt $gte $lt $lte $in $nin $exists $and $or $nor),
+                不支援 stream、增量模式、分區及 start, 讀取設定 (分頁、prefetch、concurrency 等) 使用群組中第一個函式的參數
+            incremental (bool, optional): 增量模式, 只處理 watermark_key 大於上次執行最大值的資料, 需先 set_checkpoint_store. Defaults to False.
+            watermark_key (str, optional): 增量模式 watermark 欄位, 需建立索引. Defaults to 'modified_date'.
+            watermark_overlap (float, optional): 增量模式 重疊秒數, 避免時間誤差漏掉資料. Defaults to 300.
+            mongo_client : MongoConnect 連線物件, 多程序模式不使用
         """
+        if kwargs.get('pipeline') is not None and (kwargs.get('incremental') or kwargs.get('watermark_key')):
+            # pipeline 的結果可能不含 watermark_key, watermark 無法更新 每次都會處理全部資料
+            raise ValueError('aggregation pipeline 不支援增量模式, 請以 pipeline 開頭的 $match 限制範圍')
         self.funcs[func] = {
             'database': database,
             'collection': collection,
@@ -194,20 +1646,260 @@ class MongoSync(TestBasic):
             'query': query,
             **kwargs
         }
+        if hasattr(func.__self__, 'set_metrics'):
+            func.__self__.set_metrics(self.metrics)
+        if self.write_governor is not None and hasattr(func.__self__, 'set_write_governor'):
+            func.__self__.set_write_governor(self.write_governor)
         self.logger.debug(f'新增函式: {func.__self__.__class__.__name__} {func.__name__} 參數: {self.funcs[func]}')
 
-    def run(self, workers: int = 3):
+    def get_tasks(self, resume: bool = False, backfill: bool = False):
+        """取得 要執行的工作, 分區模式時 拆分成多個工作
+
+        Args:
+            resume (bool, optional): 是否從進度紀錄繼續. Defaults to False.
+            backfill (bool, optional): 增量模式 忽略 watermark 處理全部資料. Defaults to False.
+
+        Returns:
+            list[tuple]: [(func, 參數), ...]
+        """
+        tasks = []
+        for func, details in self.funcs.items():
+            self.logger.debug(f'執行函式: {func.__self__.__class__.__name__} {func.__name__} 參數: {details}')
+            if isinstance(details, dict):
+                if self.checkpoint_store is not None:
+                    details = {
+                        **details,
+                        'checkpoint_name': self.get_checkpoint_name(func, details),
+                        'resume': resume
+                    }
+                if details.get('incremental') and not details.get('stream'):
+                    details = self.apply_watermark(func, details, backfill=backfill)
+
+                partitions = int(details.get('partitions', 1))
+                if details.get('stream'):
+                    tasks.append((func, details))
+                elif partitions > 1:
+                    try:
+                        for task in self.get_partitions(**{**details, 'partitions': partitions}):
+                            tasks.append((func, task))
+                    except Exception as err:
+                        self.logger.error(f'取得分區 發生錯誤: {err}', exc_info=True)
+                else:
+                    tasks.append((func, details))
+        return tasks
+
+    def is_shareable(self, task: dict):
+        """工作 是否可共用讀取
+
+        Args:
+            task (dict): 工作參數
+
+        Returns:
+            bool: _description_
+        """
+        if task.get('stream') or task.get('incremental') or task.get('partition') or task.get('pipeline') or int(task.get('start', 0)):
+            return False
+        return MongoQueryMatcher().is_supported(task.get('query') or {})
+
+    def generate_scan_task(self, group: MongoScanGroup, tasks: list):
+        """生成 共用讀取的工作參數
+
+        Args:
+            group (MongoScanGroup): 共用讀取
+            tasks (list[tuple]): 群組中的工作 [(func, 參數), ...]
+
+        Returns:
+            dict: 工作參數
+        """
+        task = {
+            key: value for key, value in tasks[0][1].items()
+            if key not in ('limit', 'start', 'mongo_client', 'collect_errors', 'scan_group', 'checkpoint_name', 'watermark_key')
+        }
+        task['query'] = group.generate_query()
+        task['projection'] = group.generate_projection()
+        if self.checkpoint_store is not None:
+            task['checkpoint_name'] = f'MongoScanGroup.{group.name}.{task["database"]}.{task["collection"]}'
+        return task
+
+    def group_tasks(self, tasks: list):
+        """讀取相同集合的工作 合併為共用讀取
+
+        Args:
+            tasks (list[tuple]): [(func, 參數), ...]
+
+        Returns:
+            list[tuple]: 合併後的工作, 共用讀取為 (MongoScanGroup.mongo_func, 參數)
+        """
+        groups = {}
+        grouped_tasks = []
+        for func, task in tasks:
+            name = task.get('scan_group') or (f'{task["database"]}.{task["collection"]}' if self.shared_scan else None)
+            if not name:
+                grouped_tasks.append((func, task))
+                continue
+            if not self.is_shareable(task):
+                if task.get('scan_group'):
+                    self.logger.warning(f'無法共用讀取: {func.__self__.__class__.__name__} {func.__name__}, 不支援的參數或查詢條件')
+                grouped_tasks.append((func, task))
+                continue
+            key = (name, task['database'], task['collection'], task.get('pagination', 'skip'), task.get('sort_key', '_id'), bool(task.get('raw_bson')))
+            groups.setdefault(key, []).append((func, task))
+
+        for key, members in groups.items():
+            if len(members) < 2:
+                grouped_tasks += members
+                continue
+            group = MongoScanGroup(
+                key[0],
+                {func: task for func, task in members},
+                self.metrics,
+                record_error=self.record_error,
+                log_level=self.log_level
+            )
+            self.logger.info(f'共用讀取 {key[1]}.{key[2]}: {list(group.labels.values())}')
+            grouped_tasks.append((group.mongo_func, self.generate_scan_task(group, members)))
+        return grouped_tasks
+
+    def process_scan_group(self, func, **kwargs):
+        """處理 共用讀取
+
+        Args:
+            func (_type_): MongoScanGroup.mongo_func
+            其餘參數同 process_mongo_datas
+
+        Returns:
+            int: 讀取筆數
+        """
+        group = func.__self__
+        group.start()
+        try:
+            # 全部函式皆達到 limit 時 停止讀取
+            return self.process_mongo_datas(func=func, is_done=group.is_done, **kwargs)
+        finally:
+            group.finish()
+
+    def get_instances(self):
+        """取得 處理函式的物件 (不重複)
+
+        Returns:
+            list: 處理函式的物件
+        """
+        instances = []
+        for func in self.funcs:
+            instance = getattr(func, '__self__', None)
+            if instance is not None and all(instance is not item for item in instances):
+                instances.append(instance)
+        return instances
+
+    def ensure_indexes(self):
+        """執行前 建立處理函式物件登記的索引 (register_indexes)
+        """
+        for instance in self.get_instances():
+            if hasattr(instance, 'ensure_registered_indexes'):
+                try:
+                    instance.ensure_registered_indexes()
+                except Exception as err:
+                    self.logger.error(f'建立索引 {instance.__class__.__name__} 發生錯誤: {err}', exc_info=True)
+
+    def run(self, workers: int = 3, mode: str = 'thread', resume: bool = False, backfill: bool = False):
         """執行
 
         Args:
-            workers (int, optional): 多執行序數量. Defaults to 3.
+            workers (int, optional): 多執行序或子程序數量. Defaults to 3.
+            mode (str, optional): 執行方式. Defaults to 'thread'.
+                thread: 多執行序, 適合 I/O 為主的處理函式
+                process: 多程序, 適合 CPU 為主的處理函式, 處理函式的物件需可 pickle 序列化,
+                    子程序的 save_to_mongo 統計每批回傳主程序合併, 不支援 stream、共用讀取、concurrency、prefetch_consumers 及 collect_errors
+            resume (bool, optional): 從進度紀錄繼續, 需先 set_checkpoint_store. Defaults to False.
+            backfill (bool, optional): 增量模式 忽略 watermark 處理全部資料. Defaults to False.
+
+        Returns:
+            dict: 各函式處理筆數 {func: count}
         """
-        with ThreadPoolExecutor(max_workers=workers) as executor:
-            for func, details in self.funcs.items():
-                self.logger.debug(f'執行函式: {func.__self__.__class__.__name__} {func.__name__} 參數: {details}')
-                if isinstance(details, dict):
-                    executor.submit(
-                        self.process_mongo_datas,
-                        func=func,
-                        **details
-                    )
+        results = {}
+        try:
+            self.stop_event.clear()
+            self.metrics.reset_progress()
+            self.watermark_results = {}
+            tasks = self.get_tasks(resume=resume, backfill=backfill)
+            self.ensure_indexes()
+            self.start_write_governor()
+            if self.metrics_setting:
+                self.metrics.start_reporter(**self.metrics_setting)
+            if mode == 'thread':
+                tasks = self.group_tasks(tasks)
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    futures = {}
+                    for func, task in tasks:
+                        if task.get('stream'):
+                            process = self.process_mongo_stream
+                        elif isinstance(func.__self__, MongoScanGroup):
+                            process = self.process_scan_group
+                        else:
+                            process = self.process_mongo_datas
+                        future = executor.submit(process, func=func, **task)
+                        futures[future] = func
+
+                    for future in as_completed(futures):
+                        func = futures[future]
+                        count = future.result()
+                        if isinstance(func.__self__, MongoScanGroup):
+                            # 共用讀取 以各函式分配筆數為處理筆數
+                            for member, count in func.__self__.get_counts().items():
+                                results[member] = results.get(member, 0) + count
+                        else:
+                            results[func] = results.get(func, 0) + count
+            elif mode == 'process':
+                self.check_process_settings(tasks)
+                func_ids = {func: func_id for func_id, func in enumerate(self.funcs)}
+                # 子程序啟動時 反序列化處理函式, 各自建立 MongoClient
+                funcs = pickle.dumps({func_id: func for func, func_id in func_ids.items()})
+                with ProcessPoolExecutor(max_workers=workers, initializer=init_process_worker, initargs=(funcs,)) as process_executor:
+                    with ThreadPoolExecutor(max_workers=max(len(tasks), 1)) as executor:
+                        futures = {}
+                        for func, task in tasks:
+                            future = executor.submit(
+                                self.process_mongo_datas_in_process,
+                                process_executor,
+                                func_id=func_ids[func],
+                                func=func,
+                                **{'max_pending': workers * 2, **task}
+                            )
+                            futures[future] = func
+
+                        for future in as_completed(futures):
+                            func = futures[future]
+                            results[func] = results.get(func, 0) + future.result()
+            else:
+                raise ValueError(f'mode 設定錯誤: {mode}')
+            # 寫入 批次寫入的暫存資料
+            for func in self.funcs:
+                instance = getattr(func, '__self__', None)
+                if hasattr(instance, 'flush_bulk_write'):
+                    instance.flush_bulk_write()
+
+            if self.checkpoint_store is not None:
+                self.clear_checkpoints(tasks)
+                self.save_watermarks()
+
+            if self.metrics_setting:
+                self.metrics.stop_reporter()
+                if self.metrics_setting.get('path'):
+                    self.metrics.write_prometheus(self.metrics_setting['path'])
+            self.metrics.log_summary()
+            self.logger.info(f'連線池統計: {self.mongo_pool.get_stats()}')
+            if self.write_governor is not None:
+                self.logger.info(f'寫入速率限制統計: {self.write_governor.get_stats()}')
+            for func, count in results.items():
+                self.logger.info(f'執行完成: {func.__self__.__class__.__name__} {func.__name__} 共處理 {count} 筆')
+                # 欄位差異更新 各欄位變化次數
+                if getattr(func.__self__, 'delta_update', False):
+                    self.logger.info(f'欄位變化次數: {func.__self__.__class__.__name__} {func.__self__.get_field_changes()}')
+            for metrics_label, errors in self.get_errors().items():
+                # 錯誤筆數見統計摘要 errors
+                self.logger.warning(f'處理錯誤: {metrics_label} 前 {min(len(errors), 10)} 筆 {errors[:10]}')
+        finally:
+            self.stop_write_governor()
+            # 佇列模式 等待 log 全部輸出, 發生錯誤時也需輸出
+            Log.flush_queue()
+        return results
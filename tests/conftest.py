@@ -0,0 +1,120 @@
+import importlib
+import pkgutil
+
+import bson
+import mongomock
+import mongomock.store
+import pymongo.collection
+import pytest
+from bson.raw_bson import RawBSONDocument
+
+import src
+from src.mongo_client import client_registry
+from src.mongo_index import index_registry
+
+
+# 全部連線共用同一個記憶體資料庫, 模擬連到同一台 mongo 主機
+STORE = mongomock.store.ServerStore()
+
+
+class MockMongoClient(mongomock.MongoClient):
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(_store=STORE)
+
+
+class RawCursor():
+
+    def __init__(self, cursor) -> None:
+        """mongomock 不支援 document_class, 讀取時轉為 RawBSONDocument
+        """
+        self.cursor = cursor
+
+    def __getattr__(self, name):
+        attr = getattr(self.cursor, name)
+        if not callable(attr):
+            return attr
+
+        def wrapper(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            return RawCursor(result) if isinstance(result, mongomock.collection.Cursor) else result
+        return wrapper
+
+    def __getitem__(self, index):
+        return RawCursor(self.cursor[index])
+
+    def __iter__(self):
+        for document in self.cursor:
+            yield RawBSONDocument(bson.encode(document))
+
+
+class RawCollection():
+
+    def __init__(self, collection) -> None:
+        self.collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def find(self, *args, **kwargs):
+        return RawCursor(self.collection.find(*args, **kwargs))
+
+    def aggregate(self, *args, **kwargs):
+        return (RawBSONDocument(bson.encode(document)) for document in self.collection.aggregate(*args, **kwargs))
+
+
+with_options = mongomock.collection.Collection.with_options
+
+
+def with_raw_options(self, codec_options=None, **kwargs):
+    if codec_options is not None and codec_options.document_class is RawBSONDocument:
+        return RawCollection(self)
+    return with_options(self, codec_options=codec_options, **kwargs)
+
+
+@pytest.fixture(scope='session', autouse=True)
+def mock_mongo():
+    """src 內的 MongoClient 全部改為 mongomock
+    """
+    patcher = pytest.MonkeyPatch()
+    for module_info in pkgutil.iter_modules(src.__path__):
+        try:
+            module = importlib.import_module(f'src.{module_info.name}')
+        except ImportError:
+            # 非同步模組需安裝 motor
+            continue
+        if hasattr(module, 'MongoClient'):
+            patcher.setattr(module, 'MongoClient', MockMongoClient)
+    patcher.setattr(pymongo.collection, 'Collection', mongomock.collection.Collection)
+    patcher.setattr(mongomock.collection.Collection, 'with_options', with_raw_options)
+    yield
+    patcher.undo()
+
+
+@pytest.fixture
+def mongo_client():
+    """清空資料庫 及 索引快取, 回傳 mongo 連線
+    """
+    mongo_client = MockMongoClient()
+    for name in mongo_client.list_database_names():
+        mongo_client.drop_database(name)
+    with index_registry.lock:
+        index_registry.indexes.clear()
+    yield mongo_client
+    client_registry.close_all()
+
+
+@pytest.fixture
+def async_mongo_client(mongo_client, monkeypatch):
+    """非同步模式的 AsyncIOMotorClient 改為 mongomock_motor, 與 mongo_client 共用資料
+    """
+    mongomock_motor = pytest.importorskip('mongomock_motor')
+    mongo_async = pytest.importorskip('src.mongo_async')
+
+    class MockAsyncMongoClient(mongomock_motor.AsyncMongoMockClient):
+
+        def __init__(self, *args, **kwargs) -> None:
+            super().__init__(_store=STORE)
+
+    monkeypatch.setattr(mongo_async, 'AsyncIOMotorClient', MockAsyncMongoClient)
+    return MockAsyncMongoClient()
@@ -0,0 +1,194 @@
+import pytest
+
+from src.basic import MongoFuncBasic
+
+
+def test_fingerprint_ignores_key_order_and_metadata():
+    func = MongoFuncBasic()
+    func.enable_fingerprint()
+    fingerprint = func.generate_fingerprint({'k': 1, 'v': {'b': 1, 'a': [1, {'y': 2, 'x': 1}]}})
+    assert fingerprint == func.generate_fingerprint({'v': {'a': [1, {'x': 1, 'y': 2}], 'b': 1}, 'k': 1})
+    assert fingerprint == func.generate_fingerprint({
+        'k': 1, 'v': {'b': 1, 'a': [1, {'y': 2, 'x': 1}]}, '_id': 1, 'modified_date': 2, '_fingerprint': 'old'
+    })
+    # 陣列順序不同 為不同資料
+    assert fingerprint != func.generate_fingerprint({'k': 1, 'v': {'b': 1, 'a': [{'y': 2, 'x': 1}, 1]}})
+    assert fingerprint != func.generate_fingerprint({'k': 1, 'v': {'b': 2, 'a': [1, {'y': 2, 'x': 1}]}})
+
+
+def test_fingerprint_columns_and_exclude_columns():
+    func = MongoFuncBasic()
+    func.enable_fingerprint()
+    assert func.generate_fingerprint({'k': 1, 'v': 1}, exclude_columns=['v']) == func.generate_fingerprint({'k': 1, 'v': 2}, exclude_columns=['v'])
+    # columns 中不存在於資料的欄位 視為 None
+    assert func.generate_fingerprint({'k': 1}, columns=['v']) == func.generate_fingerprint({'k': 1, 'v': None})
+
+
+
+@pytest.mark.parametrize('old_value, new_value', [(1, 1.0), (0, False), (1, True), ({'b': [1]}, {'b': [1.0]})])
+def test_fingerprint_uses_has_change_equality(old_value, new_value):
+    func = MongoFuncBasic()
+    func.enable_fingerprint()
+    assert func.has_change({'a': old_value}, {'a': new_value}) is False
+    assert func.generate_fingerprint({'a': old_value}) == func.generate_fingerprint({'a': new_value})
+    assert func.generate_fingerprint({'a': 1}) != func.generate_fingerprint({'a': 1.5})
+
+
+def test_fingerprint_falls_back_when_data_cannot_be_encoded(mongo_client):
+    col = mongo_client['db']['t']
+    func = MongoFuncBasic()
+    func.enable_fingerprint()
+    assert func.generate_fingerprint({'k': 1, 'v': 2 ** 64}) is None
+    func.save_to_mongo('db', 't', {'k': 1, 'v': 1}, query={'k': 1})
+
+    operation = func.generate_operation('db', 't', {'k': 1, 'v': {1, 2}}, old_data=col.find_one({'k': 1}, {'_fingerprint': 1}), query={'k': 1})
+    assert operation._doc['$set']['_fingerprint'] is None
+
+def test_fingerprint_skips_unchanged_writes(mongo_client):
+    col = mongo_client['db']['t']
+    func = MongoFuncBasic()
+    func.enable_fingerprint()
+    assert func.save_to_mongo('db', 't', {'k': 1, 'v': {'b': 1, 'a': 2}}, query={'k': 1}) is True
+    assert func.save_to_mongo('db', 't', {'k': 1, 'v': {'a': 2, 'b': 1}}, query={'k': 1}) is False
+    assert func.save_to_mongo('db', 't', {'k': 1, 'v': 2}, query={'k': 1}) is True
+    assert func.save_many_to_mongo('db', 't', [({'k': 1}, {'k': 1, 'v': 2}), ({'k': 2}, {'k': 2})]) == [False, True]
+
+    data = col.find_one({'k': 1})
+    assert data['v'] == 2
+    assert data['_fingerprint'] == func.generate_fingerprint({'k': 1, 'v': 2})
+    # 舊資料只需取回指紋欄位
+    assert func.get_old_data_projection() == {'_fingerprint': 1}
+
+
+def test_diff_changes_nested_paths():
+    func = MongoFuncBasic()
+    old_data = {'_id': 1, 'a': {'b': 1, 'c': 2, 'd': 3}, 'items': [{'no': 1}, {'no': 2}], 'tags': [1, 2], 'keep': 1}
+    new_data = {'_id': 1, 'a': {'b': 1, 'c': 5, 'e': 6}, 'items': [{'no': 1}, {'no': 3}], 'tags': [1, 2, 3], 'new': 1}
+    set_data, unset_paths = func.diff_changes(old_data, new_data)
+    assert set_data == {'a.c': 5, 'a.e': 6, 'items.1.no': 3, 'tags': [1, 2, 3], 'new': 1}
+    # 最上層欄位 不移除
+    assert unset_paths == ['a.d']
+
+
+def test_diff_changes_replaces_non_diffable_documents():
+    func = MongoFuncBasic()
+    set_data, unset_paths = func.diff_changes({'a': {'x.y': 1}}, {'a': {'x.y': 2}})
+    assert set_data == {'a': {'x.y': 2}}
+    assert unset_paths == []
+    assert func.diff_changes({'a': {'b': 1}}, {'a': {}}) == ({'a': {}}, [])
+
+
+@pytest.mark.parametrize('old_value, new_value', [(0, False), (1, True), (1, 1.0), ({'b': 1}, {'b': 1.0})])
+def test_diff_changes_uses_has_change_equality(old_value, new_value):
+    func = MongoFuncBasic()
+    old_data = {'a': old_value}
+    new_data = {'a': new_value}
+    assert func.has_change(old_data, new_data) is False
+    assert func.diff_changes(old_data, new_data) == ({}, [])
+
+
+def test_delta_update_sets_only_changed_paths(mongo_client):
+    col = mongo_client['db']['t']
+    func = MongoFuncBasic()
+    func.enable_delta_update()
+    func.save_to_mongo('db', 't', {'k': 1, 'a': {'b': 1, 'c': 2}, 'v': 1}, query={'k': 1})
+    # 其他程式寫入的欄位 不在 data 內 不受影響
+    col.update_one({'k': 1}, {'$set': {'other': 1}})
+
+    assert func.save_to_mongo('db', 't', {'k': 1, 'a': {'b': 1, 'c': 2}, 'v': 1.0}, query={'k': 1}) is False
+    assert func.save_to_mongo('db', 't', {'k': 1, 'a': {'b': 2}, 'v': 1}, query={'k': 1}) is True
+
+    data = col.find_one({'k': 1}, {'_id': 0, 'creation_date': 0, 'modified_date': 0})
+    assert data == {'k': 1, 'a': {'b': 2}, 'v': 1, 'other': 1}
+    assert func.get_field_changes() == {'a.b': 1, 'a.c': 1}
+
+
+def test_delta_update_only_diffs_check_columns(mongo_client):
+    col = mongo_client['db']['t']
+    func = MongoFuncBasic()
+    func.enable_delta_update()
+    func.save_to_mongo('db', 't', {'k': 1, 'a': 1, 'b': 1}, query={'k': 1})
+
+    assert func.save_to_mongo('db', 't', {'k': 1, 'a': 1, 'b': 2}, query={'k': 1}, check_colunms=['a']) is False
+    assert func.save_to_mongo('db', 't', {'k': 1, 'a': 2, 'b': 3}, query={'k': 1}, check_colunms=['a']) is True
+
+    data = col.find_one({'k': 1}, {'_id': 0, 'creation_date': 0, 'modified_date': 0})
+    assert data == {'k': 1, 'a': 2, 'b': 1}
+
+
+def test_delta_update_skips_paths_under_unset(mongo_client):
+    col = mongo_client['db']['t']
+    func = MongoFuncBasic()
+    func.enable_delta_update()
+    func.save_to_mongo('db', 't', {'k': 1, 'a': {'b': 1, 'c': 1}, 'v': 1}, query={'k': 1})
+    old_data = col.find_one({'k': 1})
+
+    operation = func.generate_operation('db', 't', {'k': 1, 'a': {'b': 2}, 'v': 2}, old_data=old_data, unset=['a'], query={'k': 1})
+    update = operation._doc
+    assert update['$unset'] == {'a': 1}
+    assert not [path for path in update['$set'] if path == 'a' or path.startswith('a.')]
+    assert update['$set']['v'] == 2
+
+    func.save_to_mongo('db', 't', {'k': 1, 'a': {'b': 2}, 'v': 2}, unset=['a'], query={'k': 1})
+    data = col.find_one({'k': 1}, {'_id': 0, 'creation_date': 0, 'modified_date': 0})
+    assert data == {'k': 1, 'v': 2}
+
+
+def test_old_data_fetches_use_in_for_one_field_and_or_for_many():
+    func = MongoFuncBasic()
+    queries = [{'k': 1}, {'k': 2}, {'k': 3}, {'a': 1, 'b': 2}, {'v': {'$gt': 1}}, {}]
+    groups, others = func.group_old_data_queries(queries)
+    assert groups == {('k',): [0, 1, 2], ('a', 'b'): [3]}
+    assert others == [4]
+
+    fetches = list(func.generate_old_data_fetches(queries, groups, chunk_size=2, projection={'_fingerprint': 1}))
+    assert [(fields, chunk, fetch_query) for fields, chunk, fetch_query, _ in fetches] == [
+        (('k',), [0, 1], {'k': {'$in': [1, 2]}}),
+        (('k',), [2], {'k': {'$in': [3]}}),
+        (('a', 'b'), [3], {'$or': [{'a': 1, 'b': 2}]}),
+    ]
+    # projection 加入查詢欄位 以便對應
+    assert fetches[2][3] == {'_fingerprint': 1, 'a': 1, 'b': 1}
+
+
+def test_get_old_datas_keeps_query_order(mongo_client):
+    col = mongo_client['db']['t']
+    col.insert_many([{'k': i, 'a': i % 2, 'v': i} for i in range(5)])
+    func = MongoFuncBasic()
+    old_datas = func.get_old_datas('db', 't', [{'k': 3}, {'k': 9}, {'k': 1, 'a': 1}, {'v': {'$gte': 4}}, {'k': 0}])
+    assert [data and data['k'] for data in old_datas] == [3, None, 1, 4, 0]
+
+
+def test_save_many_to_mongo_prefetches_once_per_batch(mongo_client, monkeypatch):
+    import mongomock.collection
+
+    col = mongo_client['db']['t']
+    col.insert_many([{'k': 1, 'v': 1}, {'k': 2, 'v': 2}])
+    func = MongoFuncBasic()
+    finds = []
+    find = mongomock.collection.Collection.find
+
+    def counted_find(self, *args, **kwargs):
+        finds.append(args[0] if args else kwargs.get('filter'))
+        return find(self, *args, **kwargs)
+
+    monkeypatch.setattr(mongomock.collection.Collection, 'find', counted_find)
+    results = func.save_many_to_mongo('db', 't', [
+        ({'k': 1}, {'k': 1, 'v': 1}),
+        ({'k': 2}, {'k': 2, 'v': 3}),
+        ({'k': 3}, {'k': 3, 'v': 3}),
+    ])
+    monkeypatch.undo()
+
+    assert results == [False, True, True]
+    assert finds == [{'k': {'$in': [1, 2, 3]}}]
+    assert [data['v'] for data in col.find({}, sort=[('k', 1)])] == [1, 3, 3]
+
+
+def test_save_many_to_mongo_saves_duplicate_queries_in_order(mongo_client):
+    col = mongo_client['db']['t']
+    func = MongoFuncBasic()
+    results = func.save_many_to_mongo('db', 't', [({'k': 1}, {'k': 1, 'v': 1}), ({'k': 1}, {'k': 1, 'v': 2})])
+    assert results == [True, True]
+    assert col.count_documents({}) == 1
+    assert col.find_one({'k': 1})['v'] == 2
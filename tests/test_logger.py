@@ -0,0 +1,140 @@
+import logging
+import queue
+
+import pytest
+
+from src.logger import Log, LogQueueHandler
+
+
+class CaptureHandler(logging.Handler):
+
+    def __init__(self, level: int = logging.NOTSET) -> None:
+        """紀錄 格式化後的 log
+        """
+        super().__init__(level)
+        self.setFormatter(logging.Formatter('%(name)s %(levelname)s %(message)s'))
+        self.lines = []
+
+    def emit(self, record: logging.LogRecord):
+        self.lines.append(self.format(record))
+
+
+@pytest.fixture
+def log_queue():
+    Log.start_queue(max_size=100)
+    yield
+    Log.stop_queue()
+
+
+def create_log(name: str, level: str = 'DEBUG', handler_level: int = logging.NOTSET):
+    log = Log(name)
+    log.set_level(level)
+    handler = CaptureHandler(handler_level)
+    log.add_handler(handler)
+    return log, handler
+
+
+def test_queue_mode_formats_arguments_when_logged(log_queue):
+    log, handler = create_log('test_logger.args')
+    data = {'k': 1}
+    log.info('內容: %s', data)
+    # 呼叫後修改的資料 不影響已放入佇列的 log
+    data['_id'] = 1
+    Log.flush_queue()
+    assert handler.lines == ["test_logger.args INFO 內容: {'k': 1}"]
+
+
+def test_queue_mode_keeps_traceback_text_only(log_queue):
+    log, handler = create_log('test_logger.exc')
+    records = []
+    Log.queue_handler.addFilter(lambda record: records.append(record) or True)
+    try:
+        raise ValueError('bad data')
+    except ValueError as err:
+        log.error(f'發生錯誤: {err}', exc_info=True)
+    Log.flush_queue()
+    assert 'Traceback' in handler.lines[0] and 'ValueError: bad data' in handler.lines[0]
+
+    prepared = Log.queue_handler.prepare(records[0])
+    assert prepared.args is None and prepared.exc_info is None
+    assert 'ValueError: bad data' in prepared.exc_text
+    # 原本的 record 不變
+    assert records[0].exc_info is not None
+
+
+def test_listener_routes_by_logger_name_and_level(log_queue):
+    first, first_handler = create_log('test_logger.first')
+    second, second_handler = create_log('test_logger.second', handler_level=logging.WARNING)
+    first.info('a')
+    second.info('b')
+    second.warning('c')
+    Log.flush_queue()
+    assert first_handler.lines == ['test_logger.first INFO a']
+    assert second_handler.lines == ['test_logger.second WARNING c']
+    # handler 由 listener 輸出, 不在 logger 上
+    assert first_handler not in logging.getLogger('test_logger.first').handlers
+
+
+def test_existing_handlers_move_to_queue_and_back():
+    log, handler = create_log('test_logger.route')
+    assert handler in logging.getLogger('test_logger.route').handlers
+    Log.start_queue()
+    try:
+        assert handler not in logging.getLogger('test_logger.route').handlers
+        assert Log.queue_listener.get_handlers('test_logger.route') == [handler]
+        log.info('a')
+    finally:
+        Log.stop_queue()
+    assert handler.lines == ['test_logger.route INFO a']
+    assert handler in logging.getLogger('test_logger.route').handlers
+    assert Log.queue_handler not in logging.getLogger('test_logger.route').handlers
+    logging.getLogger('test_logger.route').removeHandler(handler)
+
+
+def test_drop_policy_counts_dropped_records():
+    handler = LogQueueHandler(queue.Queue(1), policy='drop')
+    record = logging.LogRecord('test_logger.drop', logging.INFO, __file__, 1, 'a', None, None)
+    handler.handle(record)
+    handler.handle(record)
+    handler.handle(record)
+    assert handler.queue.qsize() == 1
+    assert handler.dropped == 2
+
+
+def test_reset_after_fork_writes_directly(log_queue):
+    log, handler = create_log('test_logger.fork')
+    listener = Log.queue_listener
+    try:
+        # 模擬 fork 後的子程序: 沒有 listener 執行緒, handler 移回 logger
+        Log.reset_after_fork()
+        assert Log.queue_listener is None
+        log.info('a')
+        assert handler.lines == ['test_logger.fork INFO a']
+    finally:
+        listener.stop()
+        logging.getLogger('test_logger.fork').removeHandler(handler)
+
+
+class Expensive():
+
+    def __init__(self) -> None:
+        """組成訊息時 計算次數
+        """
+        self.count = 0
+
+    def __str__(self) -> str:
+        self.count += 1
+        return 'expensive'
+
+
+def test_disabled_level_does_not_format_arguments():
+    log, handler = create_log('test_lazy', level='INFO')
+    value = Expensive()
+    log.debug('內容: %s', value)
+    assert value.count == 0
+    assert log.is_enabled_for('DEBUG') is False
+    assert log.is_enabled_for('INFO') is True
+
+    log.info('內容: %s', value)
+    assert value.count > 0
+    assert handler.lines == ['test_lazy INFO 內容: expensive']
@@ -0,0 +1,144 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('motor')
+
+from src.mongo_async import AsyncMongoSync, AsyncMongoSyncFuncBasic  # noqa: E402
+
+
+class Saver(AsyncMongoSyncFuncBasic):
+
+    async def mongo_func(self, data, **kwargs):
+        assert self.metrics.get_label() == 'Saver.mongo_func'
+        if data['i'] == 7:
+            raise ValueError('bad data')
+        await asyncio.sleep(0)
+        # 切換 task 後 統計名稱不受其他函式影響
+        assert self.metrics.get_label() == 'Saver.mongo_func'
+        await self.save_to_mongo('db', 'dst', {'i': data['i'], 'v': 1}, query={'i': data['i']}, index_names=['i'])
+
+
+class Grouper(AsyncMongoSyncFuncBasic):
+
+    async def mongo_func(self, data, **kwargs):
+        await self.save_many_to_mongo('db', 'groups', [({'g': data['_id']}, {'g': data['_id'], 'n': data['n']})])
+
+
+class Reader(AsyncMongoSyncFuncBasic):
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.values = []
+
+    def mongo_func(self, data, **kwargs):
+        assert self.metrics.get_label() == 'Reader.mongo_func'
+        self.values.append(data['i'])
+
+
+@pytest.fixture
+def source(async_mongo_client, mongo_client):
+    mongo_client['db']['src'].insert_many([{'i': i, 'g': i % 3} for i in range(250)])
+    return mongo_client['db']['src']
+
+
+def test_async_run(source, mongo_client):
+    saver = Saver()
+    grouper = Grouper()
+    reader = Reader()
+    grouper.enable_bulk_write(max_size=2)
+
+    mongo_sync = AsyncMongoSync(size=40)
+    mongo_sync.add_func(saver.mongo_func, 'db', 'src', pagination='keyset', collect_errors=True, limit=100)
+    mongo_sync.add_func(grouper.mongo_func, 'db', 'src', pipeline=[{'$group': {'_id': '$g', 'n': {'$sum': 1}}}])
+    mongo_sync.add_func(reader.mongo_func, 'db', 'src', query={'g': 1}, pipeline=[{'$match': {'i': {'$lt': 100}}}], pagination='keyset')
+    results = mongo_sync.run(workers=20)
+
+    assert results == {saver.mongo_func: 100, grouper.mongo_func: 3, reader.mongo_func: 33}
+    assert mongo_client['db']['dst'].count_documents({}) == 99
+    assert 'i_1' in mongo_client['db']['dst'].index_information()
+    assert list(mongo_client['db']['groups'].find({}, {'_id': 0, 'g': 1, 'n': 1}).sort('g', 1)) == [
+        {'g': 0, 'n': 84}, {'g': 1, 'n': 83}, {'g': 2, 'n': 83}
+    ]
+    assert sorted(reader.values) == [i for i in range(100) if i % 3 == 1]
+
+    errors = mongo_sync.get_errors()['Saver.mongo_func']
+    assert len(errors) == 1 and 'bad data' in errors[0]['error']
+    stats = mongo_sync.get_stats()['Saver.mongo_func']
+    assert stats['counters']['errors'] == 1
+    assert stats['total'] == 100
+
+
+def test_async_save_to_mongo_with_bulk_write(async_mongo_client, mongo_client):
+
+    async def save():
+        saver = Saver()
+        saver.enable_bulk_write(max_size=3, max_seconds=60)
+        futures = [
+            await saver.save_to_mongo('db', 't', {'k': i, 'v': 'x'}, query={'k': i})
+            for i in range(5)
+        ]
+        await saver.flush_bulk_write()
+        return await asyncio.gather(*futures)
+
+    assert asyncio.run(save()) == [True] * 5
+    assert mongo_client['db']['t'].count_documents({}) == 5
+
+
+@pytest.mark.parametrize('settings', [
+    {'partitions': 4},
+    {'stream': True},
+    {'incremental': True},
+    {'checkpoint_name': 'scan'},
+    {'scan_group': 'db.src'},
+    {'raw_bson': True},
+])
+def test_unsupported_settings_are_rejected(settings):
+    mongo_sync = AsyncMongoSync()
+    with pytest.raises(ValueError):
+        mongo_sync.add_func(Reader().mongo_func, 'db', 'src', **settings)
+    assert mongo_sync.funcs == {}
+
+
+def test_shared_scan_and_checkpoints_are_rejected():
+    with pytest.raises(ValueError):
+        AsyncMongoSync(shared_scan=True)
+    with pytest.raises(ValueError):
+        AsyncMongoSync().set_checkpoint_store(None)
+    # 只影響讀取效能的設定 忽略
+    mongo_sync = AsyncMongoSync()
+    mongo_sync.add_func(Reader().mongo_func, 'db', 'src', prefetch=True, partitions=1)
+    assert len(mongo_sync.funcs) == 1
+
+
+class Failing(AsyncMongoSyncFuncBasic):
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.cancelled = 0
+
+    async def mongo_func(self, data, **kwargs):
+        if data['i'] == 0:
+            raise ValueError('bad data')
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+
+
+def test_failed_batch_cancels_and_awaits_pending_tasks(source):
+    failing = Failing()
+    mongo_sync = AsyncMongoSync(size=10)
+
+    async def process():
+        mongo_sync.semaphore = asyncio.Semaphore(100)
+        mongo_sync.mongo_client = mongo_sync.create_mongo_client()
+        count = await mongo_sync.process_mongo_datas(failing.mongo_func, 'db', 'src')
+        pending = [task for task in asyncio.all_tasks() if task is not asyncio.current_task() and not task.done()]
+        return count, pending
+
+    count, pending = asyncio.run(process())
+    assert count == 10
+    assert pending == []
+    assert failing.cancelled == 9
@@ -0,0 +1,120 @@
+from time import monotonic, sleep
+
+import bson
+import pytest
+
+from src.mongo_batch import AdaptiveBatchSizer, BatchPrefetcher
+
+
+def test_size_grows_at_most_double_towards_target_seconds():
+    sizer = AdaptiveBatchSizer(size=100, target_seconds=0.2)
+    # 每筆 0.0001 秒, 目標 2000 筆, 每次最多兩倍
+    assert sizer.update(100, 0.01) == 200
+    assert sizer.update(200, 0.02) == 400
+    assert sizer.update(400, 0.04) == 800
+    assert sizer.update(800, 0.08) == 1600
+    assert sizer.update(1600, 0.16) == 2000
+
+
+def test_size_shrinks_at_most_half_when_slow():
+    sizer = AdaptiveBatchSizer(size=1000, target_seconds=0.2)
+    assert sizer.update(1000, 10) == 500
+
+
+def test_size_is_limited_by_target_bytes():
+    sizer = AdaptiveBatchSizer(size=100, target_seconds=10, target_bytes=100 * 1024)
+    # 每筆 1K, 上限 100 筆
+    assert sizer.update(100, 0.001, nbytes=100 * 1024) == 100
+
+    sizer = AdaptiveBatchSizer(size=100, target_seconds=10, target_bytes=100 * 1024, avg_obj_size=2048)
+    assert sizer.update(100, 0.001) == 50
+
+
+def test_size_stays_within_bounds():
+    sizer = AdaptiveBatchSizer(size=5, min_size=10, max_size=300, target_seconds=0.2)
+    assert sizer.get_size() == 10
+    for _ in range(10):
+        sizer.update(sizer.get_size(), 0.0)
+    assert sizer.get_size() == 300
+    for _ in range(10):
+        sizer.update(sizer.get_size(), 100)
+    assert sizer.get_size() == 10
+
+
+def test_short_last_batch_does_not_adjust():
+    sizer = AdaptiveBatchSizer(size=100, target_seconds=0.2)
+    assert sizer.update(30, 10) == 100
+    assert sizer.update(0, 0) == 100
+    assert sizer.doc_seconds is None
+
+
+def generate_batches(count: int, read: list = None, error: Exception = None):
+    """每批一筆 {'i': i}, 讀取時記錄到 read
+    """
+    for i in range(count):
+        if read is not None:
+            read.append(i)
+        yield [{'i': i}]
+    if error is not None:
+        raise error
+
+
+def wait_until(condition, seconds: float = 2):
+    deadline = monotonic() + seconds
+    while not condition() and monotonic() < deadline:
+        sleep(0.005)
+    return condition()
+
+
+def test_prefetcher_yields_every_batch_in_order():
+    prefetcher = BatchPrefetcher(generate_batches(20), depth=3)
+    assert [datas[0]['i'] for datas in prefetcher] == list(range(20))
+    prefetcher.close()
+
+
+def test_prefetcher_reads_ahead_up_to_depth():
+    read = []
+    prefetcher = BatchPrefetcher(generate_batches(20, read), depth=3)
+    # 佇列 3 批 + 讀取執行緒等待中的 1 批
+    assert wait_until(lambda: len(prefetcher.queue) == 3)
+    sleep(0.05)
+    assert len(read) == 4
+
+    batches = iter(prefetcher)
+    assert next(batches) == [{'i': 0}]
+    assert wait_until(lambda: len(read) == 5)
+    prefetcher.close()
+
+
+def test_prefetcher_keeps_at_least_one_batch_under_max_bytes():
+    read = []
+    prefetcher = BatchPrefetcher(generate_batches(5, read), depth=10, max_bytes=1)
+    assert wait_until(lambda: len(prefetcher.queue) == 1)
+    sleep(0.05)
+    assert len(prefetcher.queue) == 1
+    assert prefetcher.bytes == len(bson.encode({'i': 0}))
+    assert [datas[0]['i'] for datas in prefetcher] == list(range(5))
+    assert prefetcher.bytes == 0
+    prefetcher.close()
+
+
+def test_prefetcher_raises_reader_errors_after_queued_batches():
+    prefetcher = BatchPrefetcher(generate_batches(2, error=RuntimeError('read failed')))
+    batches = []
+    with pytest.raises(RuntimeError):
+        for datas in prefetcher:
+            batches.append(datas)
+    assert batches == [[{'i': 0}], [{'i': 1}]]
+    prefetcher.close()
+
+
+def test_prefetcher_close_stops_the_reader():
+    read = []
+    batches = generate_batches(1000, read)
+    prefetcher = BatchPrefetcher(batches, depth=2)
+    assert wait_until(lambda: len(prefetcher.queue) == 2)
+    prefetcher.close()
+    assert not prefetcher.reader.is_alive()
+    assert len(read) < 1000
+    # 關閉 generator
+    assert batches.gi_frame is None
@@ -0,0 +1,82 @@
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, WriteError
+import pytest
+
+from src.mongo_bulk import MongoBulkWriter
+
+
+class FailingClient():
+
+    def __init__(self, err: Exception) -> None:
+        """bulk_write 一律發生錯誤的連線
+        """
+        self.err = err
+
+    def __getitem__(self, name):
+        return self
+
+    def bulk_write(self, operations, ordered=True):
+        raise self.err
+
+
+def test_write_errors_map_back_to_each_operation(mongo_client):
+    col = mongo_client['db']['t']
+    col.create_index('k', unique=True)
+    col.insert_one({'k': 1})
+
+    writer = MongoBulkWriter(mongo_client, max_size=10)
+    futures = [
+        writer.add('db', 't', InsertOne({'k': k}), document={'k': k})
+        for k in [0, 1, 2]
+    ]
+    writer.close()
+
+    assert futures[0].result() is True
+    assert isinstance(futures[1].exception(), WriteError)
+    assert futures[1].exception().code == 11000
+    assert futures[2].result() is True
+    # unordered, 錯誤的那筆不影響其他資料
+    assert sorted(data['k'] for data in col.find()) == [0, 1, 2]
+
+
+def test_get_write_errors_uses_operation_index():
+    writer = MongoBulkWriter(None)
+    err = BulkWriteError({'writeErrors': [
+        {'index': 2, 'code': 11000, 'errmsg': 'duplicate key'},
+        {'index': 0, 'code': 121, 'errmsg': 'document failed validation'}
+    ]})
+    errors = writer.get_write_errors(err)
+    assert sorted(errors) == [0, 2]
+    assert errors[2].code == 11000
+    assert errors[0].details['errmsg'] == 'document failed validation'
+
+
+def test_whole_batch_failure_sets_every_future():
+    err = RuntimeError('connection lost')
+    writer = MongoBulkWriter(FailingClient(err), max_size=2)
+    futures = [writer.add('db', 't', InsertOne({'k': k}), document={'k': k}) for k in range(2)]
+    for future in futures:
+        assert future.exception() is err
+
+
+def test_flush_on_max_size_and_pending_queries(mongo_client):
+    writer = MongoBulkWriter(mongo_client, max_size=2, max_seconds=60)
+    first = writer.add('db', 't', UpdateOne({'k': 1}, {'$set': {'v': 1}}, upsert=True), query={'k': 1})
+    assert not first.done()
+    assert writer.is_pending('db', 't', {'k': 1})
+    assert not writer.is_pending('db', 't', {'k': 2})
+
+    second = writer.add('db', 't', UpdateOne({'k': 2}, {'$set': {'v': 2}}, upsert=True), query={'k': 2})
+    assert first.result() is True and second.result() is True
+    assert not writer.is_pending('db', 't', {'k': 1})
+    assert mongo_client['db']['t'].count_documents({}) == 2
+    writer.close()
+
+
+@pytest.mark.parametrize('max_bytes', [1, 8 * 1024 * 1024])
+def test_flush_on_max_bytes(mongo_client, max_bytes):
+    writer = MongoBulkWriter(mongo_client, max_size=100, max_bytes=max_bytes, max_seconds=60)
+    future = writer.add('db', 't', InsertOne({'k': 1}), document={'k': 1})
+    assert future.done() == (max_bytes == 1)
+    writer.close()
+    assert future.result() is True
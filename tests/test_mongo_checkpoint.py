@@ -0,0 +1,126 @@
+from bson import ObjectId
+import pytest
+
+from src.basic import MongoSyncFuncBasic
+from src.mongo_checkpoint import CheckpointTracker, FileCheckpointStore, MongoCheckpointStore
+from src.mongo_sync import MongoSync
+
+
+class MemoryCheckpointStore():
+
+    def __init__(self) -> None:
+        """記憶體內的進度紀錄, 紀錄儲存次數
+        """
+        self.states = {}
+        self.saves = 0
+
+    def load(self, name: str):
+        return self.states.get(name)
+
+    def save(self, name: str, state: dict):
+        self.states[name] = dict(state)
+        self.saves += 1
+
+    def delete(self, name: str):
+        self.states.pop(name, None)
+
+
+class Interrupted(Exception):
+    pass
+
+
+class Reader(MongoSyncFuncBasic):
+
+    def __init__(self, fail_at=None, **kwargs) -> None:
+        """紀錄 處理的 _id, 處理到 fail_at 時中斷
+        """
+        super().__init__(**kwargs)
+        self.fail_at = fail_at
+        self.ids = []
+
+    def mongo_func(self, data, **kwargs):
+        if data['_id'] == self.fail_at:
+            raise Interrupted(data['_id'])
+        self.ids.append(data['_id'])
+
+
+def test_tracker_only_advances_over_contiguous_batches():
+    store = MemoryCheckpointStore()
+    tracker = CheckpointTracker(store, 'scan', interval=0)
+    seqs = [tracker.add(last_key=key, last_id=key, count=10) for key in [9, 19, 29]]
+
+    tracker.complete(seqs[2])
+    tracker.complete(seqs[1])
+    # 第一批尚未完成, 不可跳過
+    assert store.states['scan']['last_id'] is None
+    assert store.states['scan']['count'] == 0
+
+    tracker.complete(seqs[0])
+    assert store.states['scan']['last_id'] == 29
+    assert store.states['scan']['count'] == 30
+
+    tracker.finish()
+    assert store.states['scan']['done'] is True
+
+
+def test_tracker_saves_at_interval_and_flushes_first():
+    store = MemoryCheckpointStore()
+    flushed = []
+    tracker = CheckpointTracker(store, 'scan', interval=3600, flush=lambda: flushed.append(True))
+    tracker.complete(tracker.add(1, 1, 1))
+    assert store.saves == 0
+
+    tracker.finish()
+    assert store.saves == 1
+    assert flushed == [True]
+
+
+def test_tracker_resume_loads_saved_state():
+    store = MemoryCheckpointStore()
+    store.save('scan', {'last_key': 5, 'last_id': 5, 'count': 6, 'done': False, 'created': None, 'updated': None})
+    assert CheckpointTracker(store, 'scan', resume=True).state['last_id'] == 5
+    assert CheckpointTracker(store, 'scan', resume=False).state['last_id'] is None
+
+
+@pytest.fixture(params=['file', 'mongo'])
+def checkpoint_store(request, tmp_path, mongo_client):
+    if request.param == 'file':
+        return FileCheckpointStore(str(tmp_path / 'checkpoints' / 'checkpoint.json'))
+    return MongoCheckpointStore(mongo_client, 'db')
+
+
+def test_checkpoint_store_round_trip(checkpoint_store):
+    _id = ObjectId()
+    checkpoint_store.save('scan', {'last_key': _id, 'last_id': _id, 'count': 1})
+    assert checkpoint_store.load('scan') == {'last_key': _id, 'last_id': _id, 'count': 1}
+    checkpoint_store.delete('scan')
+    assert checkpoint_store.load('scan') is None
+
+
+@pytest.mark.parametrize('partitions', [None, 3])
+def test_run_resumes_after_interruption(mongo_client, tmp_path, partitions):
+    mongo_client['db']['col'].insert_many([{'_id': i} for i in range(300)])
+    path = str(tmp_path / 'checkpoint.json')
+    kwargs = {'pagination': 'keyset'}
+    if partitions:
+        kwargs['partitions'] = partitions
+
+    first = Reader(fail_at=150)
+    mongo_sync = MongoSync(size=50)
+    mongo_sync.set_checkpoint_store(FileCheckpointStore(path), interval=0)
+    mongo_sync.add_func(first.mongo_func, 'db', 'col', **kwargs)
+    mongo_sync.run()
+    assert 150 not in first.ids
+
+    second = Reader()
+    mongo_sync = MongoSync(size=50)
+    mongo_sync.set_checkpoint_store(FileCheckpointStore(path), interval=0)
+    mongo_sync.add_func(second.mongo_func, 'db', 'col', **kwargs)
+    mongo_sync.run(resume=True)
+
+    # 中斷的批次重新處理, 已完成的批次不重複處理
+    assert set(first.ids) | set(second.ids) == set(range(300))
+    assert 150 in second.ids
+    assert len(second.ids) < 300
+    # 全部完成後 刪除進度紀錄 (含分區邊界)
+    assert FileCheckpointStore(path).read() == {}
@@ -0,0 +1,174 @@
+from datetime import datetime, timedelta
+from threading import Event
+
+import pytest
+
+from src import mongo_governor
+from src.mongo_governor import WriteGovernor
+from src.mongo_sync import MongoSync
+from src.mongo_client import client_registry
+
+
+class Clock():
+
+    def __init__(self) -> None:
+        """可控制的時間, 取代 monotonic 及 sleep
+        """
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class ReplicaSetClient():
+
+    def __init__(self, lag: float) -> None:
+        """replSetGetStatus 回傳指定 secondary 延遲的連線
+        """
+        self.lag = lag
+        self.checked = Event()
+        self.admin = self
+
+    def command(self, name: str):
+        now = datetime.now()
+        self.checked.set()
+        return {'members': [
+            {'stateStr': 'PRIMARY', 'optimeDate': now},
+            {'stateStr': 'SECONDARY', 'optimeDate': now - timedelta(seconds=self.lag)}
+        ]}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(mongo_governor, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(mongo_governor, 'sleep', clock.sleep)
+    return clock
+
+
+def test_token_bucket_limits_rate(clock):
+    governor = WriteGovernor(ops_per_sec=100, burst_seconds=0.1)
+    # 累積額度 10 筆 不需等待
+    assert all(governor.acquire() == 0 for _ in range(10))
+    assert governor.acquire() == pytest.approx(0.01)
+    # 預支額度, 之後的寫入依序等待
+    assert governor.acquire(50) == pytest.approx(0.5)
+    assert governor.get_stats()['throttled'] == 2
+
+
+def test_bytes_limit(clock):
+    governor = WriteGovernor(ops_per_sec=1000, bytes_per_sec=1000, burst_seconds=1)
+    assert governor.reserve(1, 1000) == 0
+    assert governor.reserve(1, 500) == pytest.approx(0.5)
+
+
+def test_aimd_increase_when_saturated_and_decrease_on_latency_or_error(clock):
+    governor = WriteGovernor(ops_per_sec=100, adjust_seconds=1, target_latency=0.1, increase=0.5, decrease=0.5)
+    governor.observe(0.01, ops=100)
+    clock.now += 1
+    governor.observe(0.01, ops=1)
+    assert governor.get_stats()['scale'] == pytest.approx(1.5)
+
+    clock.now += 1
+    governor.observe(0.5, ops=1)
+    assert governor.get_stats()['scale'] == pytest.approx(0.75)
+
+    clock.now += 1
+    governor.observe(0.01, ops=1, error=True)
+    assert governor.get_stats()['scale'] == pytest.approx(0.375)
+    assert governor.get_stats()['decreases'] == 2
+
+
+def test_bulk_write_latency_is_compared_per_operation(clock):
+    governor = WriteGovernor(ops_per_sec=1000, adjust_seconds=1, target_latency=0.1, target_batch_latency=0.01, increase=0.5)
+    # 500 筆 1 秒, 每筆 0.002 秒 未超過目標 (整批延遲超過單筆目標 但不降低速率)
+    governor.observe(1, ops=500)
+    governor.observe(1, ops=500)
+    clock.now += 1
+    governor.observe(0.01)
+    assert governor.get_stats()['scale'] == pytest.approx(1.5)
+
+    # 每筆 0.02 秒 超過目標
+    governor.observe(10, ops=500)
+    clock.now += 1
+    governor.observe(0.01)
+    assert governor.get_stats()['scale'] == pytest.approx(0.75)
+
+
+def test_scale_bounds_and_idle_does_not_increase(clock):
+    governor = WriteGovernor(ops_per_sec=100, min_scale=0.5, max_scale=1.2, increase=1, decrease=0.1)
+    clock.now += 1
+    governor.observe(0.5)
+    assert governor.get_stats()['scale'] == 0.5
+
+    # 未用滿速率 不增加
+    clock.now += 1
+    governor.observe(0.01)
+    assert governor.get_stats()['scale'] == 0.5
+
+    for _ in range(3):
+        governor.observe(0.01, ops=1000)
+        clock.now += 1
+    governor.observe(0.01)
+    assert governor.get_stats()['scale'] == 1.2
+
+
+def test_replication_lag_is_polled_in_background():
+    mongo_client = ReplicaSetClient(lag=30)
+    governor = WriteGovernor(ops_per_sec=100, max_lag=10, mongo_client=mongo_client, adjust_seconds=0, lag_interval=60)
+    # 寫入時不檢查 secondary 延遲
+    governor.observe(0.01)
+    assert not mongo_client.checked.is_set()
+
+    governor.start()
+    try:
+        assert mongo_client.checked.wait(5)
+    finally:
+        governor.stop()
+    assert governor.lag_thread is None
+    assert governor.get_stats()['lag'] == pytest.approx(30, abs=1)
+
+    governor.observe(0.01)
+    assert governor.get_stats()['scale'] < 1
+
+
+def test_run_releases_the_lag_client(mongo_client, monkeypatch):
+    mongo_client['db']['col'].insert_many([{'_id': i} for i in range(10)])
+
+    class Noop():
+        def mongo_func(self, data, **kwargs):
+            pass
+
+    mongo_sync = MongoSync()
+    mongo_sync.add_func(Noop().mongo_func, 'db', 'col')
+    governor = mongo_sync.set_write_governor(max_lag=10)
+    # 設置時不取得連線
+    assert governor.mongo_client is None
+
+    lag_clients = []
+    released = []
+    start = governor.start
+    release_client = client_registry.release_client
+
+    def spy_start():
+        lag_clients.append(governor.mongo_client)
+        start()
+
+    def spy_release_client(client):
+        released.append(client)
+        release_client(client)
+
+    monkeypatch.setattr(governor, 'start', spy_start)
+    monkeypatch.setattr(client_registry, 'release_client', spy_release_client)
+    mongo_sync.run()
+
+    # 檢查 secondary 延遲的連線 只在執行期間取得, 完成後釋放
+    assert len(lag_clients) == 1 and lag_clients[0] is not None
+    assert any(client is lag_clients[0] for client in released)
+    assert governor.mongo_client is None
+    assert mongo_sync.lag_client is None
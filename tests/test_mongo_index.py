@@ -0,0 +1,88 @@
+import mongomock.collection
+import pytest
+
+from src.basic import MongoFuncBasic
+from src.mongo_index import MongoIndexRegistry, index_registry
+from src.mongo_sync import MongoSync
+
+
+@pytest.fixture
+def index_calls(monkeypatch):
+    """紀錄 index_information 及 create_index 的呼叫
+    """
+    calls = {'index_information': 0, 'create_index': []}
+    index_information = mongomock.collection.Collection.index_information
+    create_index = mongomock.collection.Collection.create_index
+
+    def counted_index_information(self, *args, **kwargs):
+        calls['index_information'] += 1
+        return index_information(self, *args, **kwargs)
+
+    def counted_create_index(self, keys, *args, **kwargs):
+        calls['create_index'].append(keys)
+        return create_index(self, keys, *args, **kwargs)
+
+    monkeypatch.setattr(mongomock.collection.Collection, 'index_information', counted_index_information)
+    monkeypatch.setattr(mongomock.collection.Collection, 'create_index', counted_create_index)
+    return calls
+
+
+def test_key_spec_treats_equivalent_formats_the_same():
+    registry = MongoIndexRegistry()
+    assert registry.generate_key_spec('k') == (('k', 1),)
+    assert registry.generate_key_spec([('k', 1)]) == (('k', 1),)
+    assert registry.generate_key_spec(('k', -1)) == (('k', -1),)
+    assert registry.generate_key_spec({'a': 1, 'b': -1}) == (('a', 1), ('b', -1))
+    assert registry.generate_key_spec(['a', ('b', -1)]) == (('a', 1), ('b', -1))
+
+
+def test_ensure_indexes_reads_index_information_once(mongo_client, index_calls):
+    registry = MongoIndexRegistry()
+    assert registry.ensure_indexes(mongo_client, 'db', 't', ['k', [('a', 1), ('b', -1)]]) == [(('k', 1),), (('a', 1), ('b', -1))]
+    assert index_calls['create_index'] == [[('k', 1)], [('a', 1), ('b', -1)]]
+
+    # 建立後清除快取, 下次重新讀取一次
+    assert registry.ensure_indexes(mongo_client, 'db', 't', [[('k', 1)]]) == []
+    assert registry.ensure_indexes(mongo_client, 'db', 't', ['k']) == []
+    assert index_calls['index_information'] == 2
+    assert len(index_calls['create_index']) == 2
+
+
+def test_ensure_indexes_does_not_create_in_test_mode(mongo_client, index_calls):
+    registry = MongoIndexRegistry()
+    assert registry.ensure_indexes(mongo_client, 'db', 't', ['k'], test=True) == []
+    assert index_calls['create_index'] == []
+    assert registry.get_missing(mongo_client, 'db', 't', ['k']) == [(('k', 1),)]
+
+
+def test_func_checks_each_index_set_once(mongo_client, index_calls):
+    func = MongoFuncBasic()
+    for i in range(3):
+        func.save_to_mongo('db', 't', {'k': i}, query={'k': i}, index_names=['k'])
+    assert index_calls['create_index'] == [[('k', 1)]]
+    assert index_calls['index_information'] == 1
+    assert ('db', 't', repr(['k'])) in func.ensured_indexes
+
+    # 其他物件 使用 index_registry 的快取
+    MongoFuncBasic().save_to_mongo('db', 't', {'k': 3}, query={'k': 3}, index_names=['k'])
+    assert index_calls['index_information'] == 2
+    assert index_registry.get_missing(func.mongo_client, 'db', 't', ['k']) == []
+
+
+class Writer(MongoFuncBasic):
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.register_indexes('db', 'dst', ['k'])
+
+    def mongo_func(self, data, **kwargs):
+        self.save_to_mongo('db', 'dst', {'k': data['_id']}, query={'k': data['_id']})
+
+
+def test_registered_indexes_are_created_before_run(mongo_client, index_calls):
+    mongo_client['db']['src'].insert_many([{'_id': i} for i in range(5)])
+    mongo_sync = MongoSync()
+    mongo_sync.add_func(Writer().mongo_func, 'db', 'src')
+    mongo_sync.run()
+    assert index_calls['create_index'] == [[('k', 1)]]
+    assert 'k_1' in mongo_client['db']['dst'].index_information()
@@ -0,0 +1,91 @@
+from bson import Decimal128, Regex
+import re
+
+import pytest
+
+from src.mongo_matcher import MongoQueryMatcher
+
+
+@pytest.fixture
+def matcher():
+    return MongoQueryMatcher()
+
+
+@pytest.mark.parametrize('data, query, expected', [
+    # 數字型別 int/float/Decimal128 相同, 布林與數字不同
+    ({'a': 1}, {'a': 1.0}, True),
+    ({'a': 1}, {'a': Decimal128('1')}, True),
+    ({'a': True}, {'a': 1}, False),
+    ({'a': 0}, {'a': False}, False),
+    ({'a': 1}, {'a': {'$gt': False}}, False),
+    ({'a': True}, {'a': {'$gte': True}}, True),
+    ({'a': '2'}, {'a': {'$gt': 1}}, False),
+    # 不存在 等同 null
+    ({}, {'a': None}, True),
+    ({'a': None}, {'a': {'$exists': True}}, True),
+    ({}, {'a': {'$exists': False}}, True),
+    ({}, {'a': {'$ne': 1}}, True),
+    ({'a': 1}, {'a': {'$in': [2, 1.0]}}, True),
+    ({'a': 1}, {'a': {'$nin': [True]}}, True),
+    # 子文件 欄位順序需相同
+    ({'a': {'x': 1, 'y': 2}}, {'a': {'x': 1, 'y': 2}}, True),
+    ({'a': {'x': 1, 'y': 2}}, {'a': {'y': 2, 'x': 1}}, False),
+])
+def test_type_classes_and_equality(matcher, data, query, expected):
+    assert matcher.match(data, query) is expected
+
+
+@pytest.mark.parametrize('query, expected', [
+    ({'items.no': 2}, True),
+    ({'items.no': 5}, False),
+    ({'items.no': {'$gt': 2}}, True),
+    ({'items.0.no': 1}, True),
+    ({'items.0.no': 2}, False),
+    ({'items.tags': 'b'}, True),
+    ({'tags': 'x'}, True),
+    ({'tags': ['x', 'y']}, True),
+    ({'tags': {'$size': 2}}, None),
+    ({'items.missing': None}, True),
+    ({'info.type': {'$in': ['a', 'c']}}, True),
+])
+def test_array_paths(matcher, query, expected):
+    data = {'items': [{'no': 1, 'tags': ['a']}, {'no': 3, 'tags': ['b']}, {'no': 2}], 'tags': ['x', 'y'], 'info': {'type': 'a'}}
+    if expected is None:
+        assert not matcher.is_supported(query)
+        with pytest.raises(ValueError):
+            matcher.match(data, query)
+    else:
+        assert matcher.match(data, query) is expected
+
+
+@pytest.mark.parametrize('query, expected', [
+    ({'name': {'$regex': '^ab'}}, True),
+    ({'name': {'$regex': '^AB'}}, False),
+    ({'name': {'$regex': '^AB', '$options': 'i'}}, True),
+    ({'name': re.compile('c$')}, True),
+    ({'name': Regex('^x')}, False),
+    ({'name': {'$in': [re.compile('^a'), 'z']}}, True),
+    ({'tags': {'$regex': '^y'}}, True),
+    ({'n': {'$regex': '1'}}, False),
+])
+def test_regex(matcher, query, expected):
+    assert matcher.match({'name': 'abc', 'tags': ['x', 'yy'], 'n': 1}, query) is expected
+
+
+def test_logical_operators(matcher):
+    data = {'a': 1, 'b': 2}
+    assert matcher.match(data, {'$or': [{'a': 2}, {'b': 2}]})
+    assert not matcher.match(data, {'$and': [{'a': 1}, {'b': 3}]})
+    assert matcher.match(data, {'$nor': [{'a': 2}, {'b': 3}]})
+    assert matcher.match(data, {'a': {'$gte': 1, '$lt': 2}})
+
+
+def test_is_supported_and_is_equality(matcher):
+    assert matcher.is_supported({'a': 1, '$or': [{'b': {'$gt': 1}}]})
+    assert not matcher.is_supported({'$where': 'true'})
+    assert not matcher.is_supported({'a': {'$elemMatch': {'b': 1}}})
+    assert not matcher.is_supported({'a': {'$options': 'i'}})
+    assert matcher.is_equality({'a': 1, 'b.c': 'x'})
+    assert not matcher.is_equality({'a': {'$gt': 1}})
+    assert not matcher.is_equality({'a': re.compile('x')})
+    assert matcher.get_fields({'a': 1, '$or': [{'b': 1}, {'a': 2}]}) == ['a', 'b']
@@ -0,0 +1,128 @@
+from threading import Thread
+
+from src.basic import MongoFuncBasic
+from src.logger import Log
+from src.mongo_metrics import MongoHistogram, MongoMetrics, MongoProgress
+from src.mongo_sync import MongoSync
+
+
+def test_histogram_quantiles_use_bucket_upper_bounds():
+    histogram = MongoHistogram()
+    for seconds in [0.002] * 98 + [0.3, 4]:
+        histogram.observe(seconds)
+    stats = histogram.get_stats()
+    assert stats['count'] == 100
+    assert stats['p50'] == 0.0025
+    assert stats['p99'] == 0.5
+    assert stats['max'] == 4
+    assert MongoHistogram().get_stats()['p99'] == 0
+
+
+def test_label_is_kept_per_thread():
+    metrics = MongoMetrics()
+    metrics.set_label('main')
+    labels = []
+
+    def worker():
+        labels.append(metrics.get_label('default'))
+        metrics.set_label('worker')
+        labels.append(metrics.get_label())
+
+    thread = Thread(target=worker)
+    thread.start()
+    thread.join()
+    assert labels == ['default', 'worker']
+    assert metrics.get_label() == 'main'
+
+
+def test_progress_rate_and_eta_only_count_this_run():
+    metrics = MongoMetrics()
+    metrics.inc('a', 'processed', 50)
+    metrics.start('a', total=100)
+    metrics.start('a', total=100)
+    metrics.inc('a', 'processed', 50)
+    progress = metrics.progress['a']
+    progress['started'] -= 10
+
+    stats = metrics.get_stats()['a']
+    assert stats['total'] == 200
+    assert round(stats['docs_per_sec']) == 5
+    assert round(stats['eta']) == 30
+
+    metrics.finish('a')
+    assert metrics.progress['a']['finished'] is None
+    metrics.finish('a')
+    assert metrics.progress['a']['finished'] is not None
+    metrics.reset_progress()
+    assert 'total' not in metrics.get_stats()['a']
+
+
+def test_prometheus_output(tmp_path):
+    metrics = MongoMetrics()
+    metrics.inc('Copier.mongo_func', 'processed', 3)
+    metrics.observe('Copier.mongo_func', 'write', 0.003)
+    metrics.set_gauge('Copier.mongo_func', 'batch_size', 500)
+    text = metrics.generate_prometheus()
+    assert 'mongo_sync_processed_total{name="Copier.mongo_func"} 3' in text
+    assert 'mongo_sync_inserted_total{name="Copier.mongo_func"} 0' in text
+    assert 'mongo_sync_write_seconds_bucket{name="Copier.mongo_func",le="0.0025"} 0' in text
+    assert 'mongo_sync_write_seconds_bucket{name="Copier.mongo_func",le="0.005"} 1' in text
+    assert 'mongo_sync_write_seconds_bucket{name="Copier.mongo_func",le="+Inf"} 1' in text
+    assert 'mongo_sync_batch_size{name="Copier.mongo_func"} 500' in text
+
+    path = tmp_path / 'metrics' / 'mongo_sync.prom'
+    metrics.write_prometheus(str(path))
+    assert path.read_text(encoding='utf-8') == text
+
+
+class Copier(MongoFuncBasic):
+
+    def mongo_func(self, data, **kwargs):
+        self.save_to_mongo('db', 'dst', {'i': data['i'], 'v': data['i'] % 2}, query={'i': data['i']})
+
+
+def test_run_records_read_process_and_save_counters(mongo_client):
+    mongo_client['db']['src'].insert_many([{'i': i} for i in range(10)])
+    mongo_client['db']['dst'].insert_many([{'i': i, 'v': i % 2} for i in range(4)])
+    mongo_sync = MongoSync(size=3)
+    mongo_sync.add_func(Copier().mongo_func, 'db', 'src')
+    mongo_sync.run()
+
+    stats = mongo_sync.metrics.get_stats()['Copier.mongo_func']
+    assert stats['counters']['read'] == 10
+    assert stats['counters']['processed'] == 10
+    assert stats['counters']['inserted'] == 6
+    assert stats['counters']['unchanged'] == 4
+    assert stats['latency']['fetch']['count'] == 4
+    assert stats['latency']['func']['count'] == 10
+    assert stats['latency']['write']['count'] == 6
+
+
+
+def test_progress_logs_every_n_documents(caplog):
+    log = Log('test_progress_count')
+    log.set_level('INFO')
+    progress = MongoProgress(log, '[a] ', total=10, every=3, seconds=0)
+    for _ in range(10):
+        progress.update()
+    messages = [record.getMessage() for record in caplog.records]
+    assert [message.split()[1] for message in messages] == ['3/10', '6/10', '9/10']
+    assert all('預估剩餘' in message for message in messages)
+
+    # 一次增加多筆 只紀錄一次
+    progress.update(7)
+    assert len(caplog.records) == 4
+    assert caplog.records[-1].getMessage().split()[1] == '17/10'
+
+
+def test_progress_logs_every_n_seconds(caplog):
+    log = Log('test_progress_seconds')
+    log.set_level('INFO')
+    progress = MongoProgress(log, every=0, seconds=60)
+    for _ in range(100):
+        progress.update()
+    assert caplog.records == []
+
+    progress.next_time -= 60
+    progress.update()
+    assert [record.getMessage().split()[0] for record in caplog.records] == ['101']
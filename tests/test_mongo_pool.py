@@ -0,0 +1,76 @@
+from threading import Thread
+from time import sleep
+
+import pytest
+
+from src.mongo_client import client_registry
+from src.mongo_pool import MongoConnectPool
+
+
+@pytest.fixture
+def mongo_pool(mongo_client):
+    mongo_pool = MongoConnectPool(max_connect=2)
+    mongo_pool.set_mongo_connect_uri('mongodb://127.0.0.1:27017')
+    return mongo_pool
+
+
+def test_acquire_reuses_released_connect(mongo_pool):
+    first = mongo_pool.acquire()
+    second = mongo_pool.acquire()
+    mongo_pool.release(first)
+    assert mongo_pool.acquire() == first
+
+    stats = mongo_pool.get_stats()
+    assert stats['created'] == 2
+    assert stats['hit'] == 1
+    assert stats['high_water'] == 2
+    # 每個連線皆為同一個共用 MongoClient 的參考
+    assert mongo_pool.pool[first] is mongo_pool.pool[second]
+    assert list(client_registry.get_reference_counts().values()) == [2]
+
+
+def test_acquire_waits_for_release(mongo_pool):
+    connects = [mongo_pool.acquire(), mongo_pool.acquire()]
+    results = []
+    thread = Thread(target=lambda: results.append(mongo_pool.acquire(timeout=5)))
+    thread.start()
+    sleep(0.05)
+    assert results == []
+
+    mongo_pool.release(connects[0])
+    thread.join()
+    assert results == [connects[0]]
+    assert mongo_pool.get_stats()['wait'] == 1
+
+
+def test_get_connect_raises_on_timeout(mongo_pool):
+    mongo_pool.acquire()
+    mongo_pool.acquire()
+    with pytest.raises(TimeoutError):
+        mongo_pool.get_connect(timeout=0.01)
+    assert mongo_pool.get_stats()['timeout'] == 1
+
+
+def test_get_connect_raises_when_create_fails(mongo_pool, monkeypatch):
+    def create_connect():
+        raise ConnectionError('建立 mongo 連線失敗')
+
+    monkeypatch.setattr(mongo_pool, 'create_connect', create_connect)
+    with pytest.raises(ConnectionError):
+        mongo_pool.get_connect()
+    # 建立失敗 不佔用連線數
+    assert mongo_pool.creating == 0
+    assert mongo_pool.get_stats()['total'] == 0
+
+
+def test_release_rejects_idle_connect_and_close_all_releases_clients(mongo_pool):
+    connect_uuid = mongo_pool.acquire()
+    with mongo_pool.connect() as mongo_client:
+        assert mongo_client is mongo_pool.pool[connect_uuid]
+    mongo_pool.release(connect_uuid)
+    with pytest.raises(RuntimeError):
+        mongo_pool.release(connect_uuid)
+
+    mongo_pool.close_all()
+    assert mongo_pool.get_stats()['total'] == 0
+    assert client_registry.get_reference_counts() == {}
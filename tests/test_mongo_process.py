@@ -0,0 +1,84 @@
+import pickle
+
+import bson
+import pytest
+
+from src import mongo_process
+from src.basic import MongoSyncFuncBasic
+from src.mongo_metrics import MongoMetrics
+from src.mongo_process import init_process_worker, process_raw_batch
+from src.mongo_sync import MongoSync
+
+
+class Copier(MongoSyncFuncBasic):
+
+    def mongo_func(self, data, **kwargs):
+        if data['i'] == -1:
+            raise ValueError('bad data')
+        self.save_to_mongo('db', 'dst', {'i': data['i'], 'v': data['i'] % 2}, query={'i': data['i']})
+
+
+@pytest.fixture
+def worker():
+    yield
+    mongo_process.worker_funcs.clear()
+    mongo_process.worker_metrics = None
+
+
+def test_process_raw_batch_returns_metrics_delta(mongo_client, worker):
+    mongo_client['db']['dst'].insert_many([{'i': 0, 'v': 0}, {'i': 1, 'v': 0}])
+    copier = Copier()
+    # 處理函式 (物件方法) 以 pickle 傳給子程序
+    init_process_worker(pickle.dumps({0: copier.mongo_func}))
+
+    raw_datas = b''.join(bson.encode({'i': i}) for i in range(4))
+    result = process_raw_batch(0, raw_datas, metrics_label='Copier.mongo_func')
+    assert result['count'] == 4
+    assert result['metrics']['counters']['Copier.mongo_func'] == {'inserted': 2, 'updated': 1, 'unchanged': 1}
+    assert result['metrics']['histograms']['Copier.mongo_func']['write']['count'] == 3
+
+    # 每批只回傳該批的變化
+    result = process_raw_batch(0, bson.encode({'i': 0}), metrics_label='Copier.mongo_func')
+    assert result['metrics']['counters'] == {'Copier.mongo_func': {'unchanged': 1}}
+
+
+def test_metrics_merge():
+    child = MongoMetrics()
+    child.inc('F.f', 'inserted', 2)
+    child.observe('F.f', 'write', 0.01)
+    parent = MongoMetrics()
+    parent.inc('F.f', 'inserted', 1)
+    parent.observe('F.f', 'write', 0.5)
+    parent.merge(child.export(clear=True))
+    stats = parent.get_stats()['F.f']
+    assert stats['counters']['inserted'] == 3
+    assert stats['latency']['write']['count'] == 2
+    assert stats['latency']['write']['max'] == 0.5
+    assert child.export() == {'counters': {}, 'histograms': {}}
+
+
+def test_process_mode_run_merges_child_statistics(mongo_client):
+    mongo_client['db']['src'].insert_many([{'i': i} for i in range(120)])
+    mongo_sync = MongoSync(size=25)
+    mongo_sync.add_func(Copier().mongo_func, 'db', 'src', pagination='keyset')
+    results = mongo_sync.run(workers=2, mode='process')
+
+    assert list(results.values()) == [120]
+    # 子程序的 save_to_mongo 統計 回到主程序
+    counters = mongo_sync.get_stats()['Copier.mongo_func']['counters']
+    assert counters['processed'] == 120
+    assert counters['inserted'] == 120
+
+
+@pytest.mark.parametrize('settings', [
+    {'concurrency': 4},
+    {'prefetch_consumers': 2},
+    {'collect_errors': True},
+    {'stream': True},
+    {'scan_group': 'db.src'},
+])
+def test_process_mode_rejects_thread_only_settings(mongo_client, settings):
+    mongo_sync = MongoSync()
+    mongo_sync.add_func(Copier().mongo_func, 'db', 'src', **settings)
+    with pytest.raises(ValueError):
+        mongo_sync.run(mode='process')
@@ -0,0 +1,123 @@
+import pytest
+
+from src.basic import MongoSyncFuncBasic
+from src.mongo_metrics import MongoMetrics
+from src.mongo_scan import MongoScanGroup
+from src.mongo_sync import MongoSync
+
+
+class Reader(MongoSyncFuncBasic):
+
+    def __init__(self, **kwargs) -> None:
+        """紀錄 處理的 i
+        """
+        super().__init__(**kwargs)
+        self.values = []
+
+    def mongo_func(self, data, **kwargs):
+        self.values.append(data['i'])
+
+
+class OtherReader(Reader):
+    pass
+
+
+class Copier(MongoSyncFuncBasic):
+
+    def __init__(self, collection: str, **kwargs) -> None:
+        """將收到的資料 直接以 save_to_mongo 寫入 (save_to_mongo 會修改資料), 並紀錄收到的資料
+        """
+        super().__init__(**kwargs)
+        self.collection = collection
+        self.datas = []
+
+    def mongo_func(self, data, **kwargs):
+        self.datas.append(dict(data))
+        self.save_to_mongo('db', self.collection, data, query={'i': data['i']})
+
+
+@pytest.fixture
+def collection(mongo_client):
+    col = mongo_client['db']['g']
+    col.insert_many([{'i': i, 'tags': [{'no': i % 4}]} for i in range(1000)])
+    return col
+
+
+def test_scan_group_query_and_projection():
+    first = Reader()
+    second = OtherReader()
+    group = MongoScanGroup('db.g', {
+        first.mongo_func: {'query': {'i': {'$lt': 10}}, 'projection': ['i']},
+        second.mongo_func: {'query': {'tags.no': 1}, 'projection': {'j': 1}}
+    }, MongoMetrics())
+    assert group.generate_query() == {'$or': [{'i': {'$lt': 10}}, {'tags.no': 1}]}
+    # 加入比對查詢條件需要的欄位
+    assert group.generate_projection() == {'i': 1, 'j': 1, 'tags.no': 1}
+
+    group.funcs[second.mongo_func] = {'query': {}}
+    assert group.generate_query() == {}
+    assert group.generate_projection() is None
+
+
+def test_scan_group_reserve_and_is_done():
+    first = Reader()
+    second = OtherReader()
+    group = MongoScanGroup('db.g', {first.mongo_func: {'limit': 1}, second.mongo_func: {'limit': 2}}, MongoMetrics())
+    assert group.reserve(first.mongo_func)
+    assert not group.reserve(first.mongo_func)
+    assert not group.is_done()
+    assert group.reserve(second.mongo_func) and group.reserve(second.mongo_func)
+    assert group.is_done()
+    assert group.get_counts() == {first.mongo_func: 1, second.mongo_func: 2}
+
+    unlimited = MongoScanGroup('db.g', {first.mongo_func: {}}, MongoMetrics())
+    unlimited.reserve(first.mongo_func)
+    assert not unlimited.is_done()
+
+
+def test_shared_scan_honours_limits_and_stops_reading(collection):
+    first = Reader()
+    second = OtherReader()
+    mongo_sync = MongoSync(size=50, shared_scan=True)
+    mongo_sync.add_func(first.mongo_func, 'db', 'g', limit=10, query={'tags.no': 1})
+    mongo_sync.add_func(second.mongo_func, 'db', 'g', limit=20)
+    results = mongo_sync.run()
+
+    assert results == {first.mongo_func: 10, second.mongo_func: 20}
+    assert first.values == [i for i in range(1000) if i % 4 == 1][:10]
+    assert second.values == list(range(20))
+    # 全部函式達到 limit 後 不再讀取
+    assert mongo_sync.get_stats()['MongoScanGroup.db.g']['counters']['read'] < 100
+
+
+def test_shared_scan_without_limit_reads_everything_once(collection):
+    first = Reader()
+    second = OtherReader()
+    mongo_sync = MongoSync(size=100, shared_scan=True)
+    mongo_sync.add_func(first.mongo_func, 'db', 'g', query={'tags.no': {'$in': [1, 2]}})
+    mongo_sync.add_func(second.mongo_func, 'db', 'g', query={'i': {'$gte': 900}})
+    results = mongo_sync.run()
+
+    assert results == {first.mongo_func: 500, second.mongo_func: 100}
+    assert sorted(first.values) == [i for i in range(1000) if i % 4 in (1, 2)]
+    assert sorted(second.values) == list(range(900, 1000))
+    assert mongo_sync.get_stats()['MongoScanGroup.db.g']['counters']['read'] == 550
+
+
+def test_shared_scan_members_do_not_see_each_others_changes(collection, mongo_client):
+    # 目標已有資料, save_to_mongo 更新時 刪除 data 的 _id 並加入 modified_date
+    mongo_client['db']['first'].insert_many([{'i': i, 'v': 0} for i in range(1000)])
+    boundary = collection.find_one({'i': 50})['_id']
+    expected = list(collection.find({'_id': {'$lt': boundary}}).sort('i', 1))
+
+    first = Copier('first')
+    second = Copier('second')
+    mongo_sync = MongoSync(size=100, shared_scan=True)
+    mongo_sync.add_func(first.mongo_func, 'db', 'g')
+    mongo_sync.add_func(second.mongo_func, 'db', 'g', query={'_id': {'$lt': boundary}})
+    mongo_sync.run()
+
+    # 與分別讀取的結果相同
+    assert len(first.datas) == 1000
+    assert sorted(second.datas, key=lambda data: data['i']) == expected
+    assert mongo_client['db']['second'].count_documents({}) == 50
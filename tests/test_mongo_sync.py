@@ -0,0 +1,399 @@
+from threading import Lock
+
+import pytest
+
+from src.mongo_sync import MongoSync
+
+
+class Recorder():
+
+    def __init__(self, callback=None) -> None:
+        """紀錄 處理函式收到的 _id, MongoSync 的處理函式需為物件方法
+
+        Args:
+            callback (optional): 每筆資料呼叫 callback(data). Defaults to None.
+        """
+        self.ids = []
+        self.lock = Lock()
+        self.callback = callback
+
+    def mongo_func(self, data, **kwargs):
+        with self.lock:
+            self.ids.append(data['_id'])
+        if self.callback:
+            self.callback(data)
+
+
+@pytest.fixture
+def collection(mongo_client):
+    col = mongo_client['db']['col']
+    col.insert_many([{'_id': i, 'k': i % 7, 'v': i} for i in range(1050)])
+    return col
+
+
+@pytest.mark.parametrize('sort_key', ['_id', 'k'])
+def test_keyset_pagination_reads_every_document_once(collection, sort_key):
+    recorder = Recorder()
+    count = MongoSync(size=100).process_mongo_datas(
+        recorder.mongo_func, 'db', 'col', pagination='keyset', sort_key=sort_key, query={'v': {'$gte': 10}}
+    )
+    assert count == 1040
+    assert sorted(recorder.ids) == list(range(10, 1050))
+
+
+@pytest.mark.parametrize('pagination', ['skip', 'keyset'])
+def test_pagination_start_and_limit(collection, pagination):
+    recorder = Recorder()
+    count = MongoSync(size=100).process_mongo_datas(recorder.mongo_func, 'db', 'col', pagination=pagination, start=5, limit=250)
+    assert count == 250
+    assert recorder.ids == list(range(5, 255))
+
+
+def test_keyset_batches_resume_after_last_key(collection):
+    mongo_sync = MongoSync()
+    batches = list(mongo_sync.get_keyset_batches(collection, sort_key='k', size=200, last_key=3, last_id=500))
+    ids = [data['_id'] for batch in batches for data in batch]
+    # 排序為 (k, _id), 從 (3, 500) 之後開始
+    expected = [i for i in range(1050) if (i % 7, i) > (3, 500)]
+    assert sorted(ids) == sorted(expected)
+    assert all(len(batch) <= 200 for batch in batches)
+
+
+def test_keyset_pagination_does_not_revisit_inserted_documents(collection):
+    def callback(data):
+        if data['_id'] == 500:
+            # 插入排序在目前位置之前的資料, keyset 不會讀取也不會使後面的資料重複
+            collection.insert_one({'_id': -1, 'k': 0, 'v': 0})
+
+    recorder = Recorder(callback)
+    MongoSync(size=100).process_mongo_datas(recorder.mongo_func, 'db', 'col', pagination='keyset')
+    assert sorted(recorder.ids) == list(range(1050))
+
+
+def test_partitioned_scan_covers_every_document_once(collection):
+    recorder = Recorder()
+    mongo_sync = MongoSync(size=50)
+    mongo_sync.add_func(
+        recorder.mongo_func, 'db', 'col', partitions=4, partition_method='sample', pagination='keyset', query={'v': {'$gte': 100}}
+    )
+    results = mongo_sync.run(workers=4)
+    assert list(results.values()) == [950]
+    assert sorted(recorder.ids) == list(range(100, 1050))
+
+
+def test_partition_bounds_split_the_range(collection):
+    mongo_sync = MongoSync()
+    # mongomock 不支援 $bucketAuto, 以 sample 測試
+    bounds = mongo_sync.get_partition_bounds(collection, partitions=4, method='sample')
+    assert 0 < len(bounds) <= 3
+    assert bounds == sorted(set(bounds))
+
+    lowers = [None] + bounds
+    uppers = bounds + [None]
+    counts = [
+        collection.count_documents(mongo_sync.generate_partition_query({}, lower=lower, upper=upper))
+        for lower, upper in zip(lowers, uppers)
+    ]
+    assert sum(counts) == 1050
+
+
+def test_partition_query_keeps_the_original_query():
+    mongo_sync = MongoSync()
+    assert mongo_sync.generate_partition_query({}) == {}
+    assert mongo_sync.generate_partition_query({}, lower=1, upper=5) == {'_id': {'$gte': 1, '$lt': 5}}
+    assert mongo_sync.generate_partition_query({'v': 1}, partition_key='k', lower=1) == {'$and': [{'v': 1}, {'k': {'$gte': 1}}]}
+
+
+class FakeChangeStream():
+
+    def __init__(self, changes: list, resume_after=None) -> None:
+        """模擬 change stream, 事件的 _id 為 resume token, 從 resume_after 之後開始
+
+        Args:
+            changes (list): 事件
+            resume_after (optional): resume token. Defaults to None.
+        """
+        start = 0
+        if resume_after is not None:
+            start = [change['_id'] for change in changes].index(resume_after) + 1
+        self.changes = list(changes[start:])
+        self.resume_token = resume_after
+        self.alive = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def try_next(self):
+        if not self.changes:
+            self.alive = False
+            return None
+        change = self.changes.pop(0)
+        self.resume_token = change['_id']
+        return change
+
+
+@pytest.fixture
+def change_stream(mongo_client, monkeypatch):
+    """collection.watch 改為 FakeChangeStream, 事件 0, 3 的 fullDocument 為 None (文件已刪除)
+    """
+    import mongomock.collection
+
+    changes = [
+        {'_id': {'token': i}, 'operationType': 'update', 'fullDocument': None if i in (0, 3) else {'_id': i}}
+        for i in range(10)
+    ]
+    watches = []
+
+    def watch(self, pipeline=None, resume_after=None, **kwargs):
+        watches.append(resume_after)
+        return FakeChangeStream(changes, resume_after=resume_after)
+
+    monkeypatch.setattr(mongomock.collection.Collection, 'watch', watch, raising=False)
+    return watches
+
+
+def test_stream_skips_deleted_documents_and_persists_resume_token(change_stream, tmp_path):
+    from src.mongo_checkpoint import FileCheckpointStore
+
+    store = FileCheckpointStore(str(tmp_path / 'checkpoint.json'))
+    recorder = Recorder()
+    mongo_sync = MongoSync(size=4)
+    mongo_sync.set_checkpoint_store(store)
+    count = mongo_sync.process_mongo_stream(recorder.mongo_func, 'db', 'col', checkpoint_name='c', stream_batch_seconds=0.01)
+
+    assert count == 8
+    assert recorder.ids == [1, 2, 4, 5, 6, 7, 8, 9]
+    # 只計算交給處理函式的資料
+    assert store.load('c.stream') == {'resume_token': {'token': 9}, 'count': 8}
+
+
+def test_stream_limit_counts_processed_documents_and_resumes(change_stream, tmp_path):
+    from src.mongo_checkpoint import FileCheckpointStore
+
+    store = FileCheckpointStore(str(tmp_path / 'checkpoint.json'))
+    first = Recorder()
+    mongo_sync = MongoSync(size=4)
+    mongo_sync.set_checkpoint_store(store)
+    assert mongo_sync.process_mongo_stream(first.mongo_func, 'db', 'col', checkpoint_name='c', limit=4, stream_batch_seconds=0.01) == 4
+    # 略過的事件不計入 limit, 停止時記錄最後處理的事件
+    assert first.ids == [1, 2, 4, 5]
+    assert store.load('c.stream') == {'resume_token': {'token': 5}, 'count': 4}
+
+    second = Recorder()
+    mongo_sync = MongoSync(size=4)
+    mongo_sync.set_checkpoint_store(store)
+    assert mongo_sync.process_mongo_stream(second.mongo_func, 'db', 'col', checkpoint_name='c', stream_batch_seconds=0.01) == 4
+    assert change_stream == [None, {'token': 5}]
+    assert second.ids == [6, 7, 8, 9]
+    assert store.load('c.stream') == {'resume_token': {'token': 9}, 'count': 8}
+
+
+def test_watermark_query_subtracts_overlap():
+    from datetime import datetime
+    from bson import ObjectId
+
+    mongo_sync = MongoSync()
+    watermark = datetime(2024, 1, 1, 0, 5)
+    assert mongo_sync.generate_watermark_query({}, 'modified_date', watermark, overlap=300) == {
+        'modified_date': {'$gte': datetime(2024, 1, 1)}
+    }
+    assert mongo_sync.generate_watermark_query({'k': 1}, 'modified_date', watermark, overlap=0) == {
+        '$and': [{'k': 1}, {'modified_date': {'$gte': watermark}}]
+    }
+    object_id = ObjectId.from_datetime(watermark)
+    query = mongo_sync.generate_watermark_query({}, '_id', object_id, overlap=300)
+    assert query['_id']['$gte'].generation_time == ObjectId.from_datetime(datetime(2024, 1, 1)).generation_time
+    # 非時間欄位 不套用重疊
+    assert mongo_sync.generate_watermark_query({}, 'seq', 10, overlap=300) == {'seq': {'$gte': 10}}
+
+
+def test_incremental_run_rereads_the_overlap_window(mongo_client, tmp_path):
+    from datetime import datetime, timedelta
+    from src.mongo_checkpoint import FileCheckpointStore
+
+    col = mongo_client['db']['col']
+    start = datetime(2024, 1, 1)
+    col.insert_many([{'_id': i, 'modified_date': start + timedelta(minutes=i)} for i in range(10)])
+
+    def run(backfill: bool = False):
+        recorder = Recorder()
+        mongo_sync = MongoSync(size=3)
+        mongo_sync.set_checkpoint_store(FileCheckpointStore(str(tmp_path / 'checkpoint.json')))
+        mongo_sync.add_func(recorder.mongo_func, 'db', 'col', incremental=True, watermark_overlap=150)
+        mongo_sync.run(backfill=backfill)
+        return sorted(recorder.ids)
+
+    assert run() == list(range(10))
+    col.insert_many([{'_id': i, 'modified_date': start + timedelta(minutes=i)} for i in range(10, 12)])
+
+    # watermark 為 9 分, 重疊 150 秒 從 6:30 開始
+    assert run() == [7, 8, 9, 10, 11]
+    assert run() == [9, 10, 11]
+    assert run(backfill=True) == list(range(12))
+
+
+def test_incremental_run_keeps_watermark_when_incomplete(mongo_client, tmp_path):
+    from datetime import datetime, timedelta
+    from src.mongo_checkpoint import FileCheckpointStore
+
+    col = mongo_client['db']['col']
+    start = datetime(2024, 1, 1)
+    col.insert_many([{'_id': i, 'modified_date': start + timedelta(minutes=i)} for i in range(10)])
+    store = FileCheckpointStore(str(tmp_path / 'checkpoint.json'))
+
+    recorder = Recorder()
+    mongo_sync = MongoSync(size=3)
+    mongo_sync.set_checkpoint_store(store)
+    mongo_sync.add_func(recorder.mongo_func, 'db', 'col', incremental=True, limit=4)
+    mongo_sync.run()
+    # 限制筆數 未處理完全部資料, 不更新 watermark
+    assert store.load(mongo_sync.get_watermark_name(recorder.mongo_func, mongo_sync.funcs[recorder.mongo_func])) is None
+
+    mongo_sync = MongoSync(size=3)
+    mongo_sync.set_checkpoint_store(store)
+    mongo_sync.add_func(Recorder().mongo_func, 'db', 'col', incremental=True)
+    mongo_sync.run()
+    func = next(iter(mongo_sync.funcs))
+    assert store.load(mongo_sync.get_watermark_name(func, mongo_sync.funcs[func]))['watermark'] == start + timedelta(minutes=9)
+
+
+def test_projection_keeps_fields_needed_for_paging():
+    mongo_sync = MongoSync()
+    assert mongo_sync.generate_projection() is None
+    assert mongo_sync.get_task_projection(projection=['name'], pagination='keyset', sort_key='k', watermark_key='modified_date') == {
+        'name': 1, '_id': 1, 'k': 1, 'modified_date': 1
+    }
+    # 排除模式 不可排除分頁需要的欄位
+    assert mongo_sync.get_task_projection(projection={'body': 0, 'k': 0}, pagination='keyset', sort_key='k') == {'body': 0}
+
+
+@pytest.mark.parametrize('pagination', ['skip', 'keyset'])
+def test_projection_and_raw_bson_reach_the_func(collection, pagination):
+    from bson.raw_bson import RawBSONDocument
+
+    datas = []
+    recorder = Recorder(callback=datas.append)
+    count = MongoSync(size=100).process_mongo_datas(
+        recorder.mongo_func, 'db', 'col', pagination=pagination, sort_key='k', projection=['v'], raw_bson=True, limit=150
+    )
+    assert count == 150
+    assert all(isinstance(data, RawBSONDocument) for data in datas)
+    expected = {'_id', 'v', 'k'} if pagination == 'keyset' else {'_id', 'v'}
+    assert all(set(data.keys()) == expected for data in datas)
+
+
+@pytest.mark.parametrize('consumers', [1, 3])
+def test_prefetch_processes_every_document_once(collection, consumers):
+    recorder = Recorder()
+    count = MongoSync(size=100).process_mongo_datas(
+        recorder.mongo_func, 'db', 'col', pagination='keyset', prefetch=True, prefetch_depth=2, prefetch_consumers=consumers
+    )
+    assert count == 1050
+    assert sorted(recorder.ids) == list(range(1050))
+    if consumers == 1:
+        assert recorder.ids == list(range(1050))
+
+
+def test_group_datas_keeps_order_within_each_value():
+    mongo_sync = MongoSync()
+    datas = [{'_id': 0, 'k': 1}, {'_id': 1, 'k': 2}, {'_id': 2, 'k': 1}, {'_id': 3, 'k': [1]}, {'_id': 4, 'k': [1]}]
+    assert mongo_sync.group_datas(datas, 'k') == [[datas[0], datas[2]], [datas[1]], [datas[3], datas[4]]]
+    assert mongo_sync.group_datas(datas) == [[data] for data in datas]
+
+
+def test_concurrency_runs_same_order_key_in_sequence(collection):
+    from threading import current_thread
+    from time import sleep
+
+    threads = set()
+    sequences = {}
+
+    def callback(data):
+        threads.add(current_thread().name)
+        sequences.setdefault(data['k'], []).append(data['_id'])
+        sleep(0.0005)
+
+    recorder = Recorder(callback=callback)
+    count = MongoSync(size=100).process_mongo_datas(recorder.mongo_func, 'db', 'col', concurrency=4, order_key='k', limit=300)
+    assert count == 300
+    assert sorted(recorder.ids) == list(range(300))
+    assert all(sequence == sorted(sequence) for sequence in sequences.values())
+    assert len(threads) > 1
+
+
+@pytest.mark.parametrize('concurrency', [1, 4])
+def test_collect_errors_keeps_processing(collection, concurrency):
+    def callback(data):
+        if data['_id'] % 100 == 7:
+            raise ValueError(f'bad {data["_id"]}')
+
+    recorder = Recorder(callback=callback)
+    mongo_sync = MongoSync(size=100, max_error_samples=5)
+    mongo_sync.add_func(recorder.mongo_func, 'db', 'col', concurrency=concurrency, collect_errors=True)
+    mongo_sync.run()
+
+    assert len(recorder.ids) == 1050
+    errors = mongo_sync.get_errors()['Recorder.mongo_func']
+    assert len(errors) == 5
+    assert errors[0]['error'].startswith('ValueError: bad ')
+    assert mongo_sync.get_stats()['Recorder.mongo_func']['counters']['errors'] == 11
+
+
+def test_errors_stop_the_run_without_collect_errors(collection):
+    def callback(data):
+        if data['_id'] == 150:
+            raise ValueError('bad')
+
+    recorder = Recorder(callback=callback)
+    mongo_sync = MongoSync(size=100)
+    mongo_sync.add_func(recorder.mongo_func, 'db', 'col', concurrency=4)
+    mongo_sync.run()
+
+    # 發生錯誤的批次處理完成後停止
+    assert set(range(200)) <= set(recorder.ids)
+    assert len(recorder.ids) < 1050
+    assert mongo_sync.get_errors() == {}
+
+
+def test_split_pipeline_merges_leading_match_stages():
+    mongo_sync = MongoSync()
+    stages = [{'$match': {'a': 1}}, {'$match': {'b': 2}}, {'$project': {'a': 1}}, {'$match': {'c': 3}}]
+    assert mongo_sync.split_pipeline(stages, {'k': 1}) == (
+        {'$and': [{'k': 1}, {'a': 1}, {'b': 2}]},
+        [{'$project': {'a': 1}}, {'$match': {'c': 3}}]
+    )
+    assert mongo_sync.split_pipeline([{'$match': {'a': 1}}]) == ({'a': 1}, [])
+    assert mongo_sync.split_pipeline([{'$project': {'a': 1}}]) == ({}, [{'$project': {'a': 1}}])
+
+
+def test_cursor_pipeline_groups_across_the_whole_collection(collection):
+    datas = []
+    recorder = Recorder(callback=datas.append)
+    count = MongoSync(size=3).process_mongo_datas(
+        recorder.mongo_func, 'db', 'col', query={'v': {'$lt': 700}}, pipeline=[{'$group': {'_id': '$k', 'n': {'$sum': 1}}}]
+    )
+    assert count == 7
+    assert sorted(recorder.ids) == list(range(7))
+    assert sum(data['n'] for data in datas) == 700
+
+
+@pytest.mark.parametrize('sort_key', ['_id', 'k'])
+def test_keyset_pipeline_pages_the_source_documents(collection, sort_key):
+    datas = []
+    recorder = Recorder(callback=datas.append)
+    count = MongoSync(size=100).process_mongo_datas(
+        recorder.mongo_func, 'db', 'col', pagination='keyset', sort_key=sort_key, query={'k': {'$ne': 0}},
+        pipeline=[{'$match': {'v': {'$gte': 10}}}, {'$project': {'double': {'$multiply': ['$v', 2]}}}]
+    )
+    expected = [i for i in range(10, 1050) if i % 7 != 0]
+    assert count == len(expected)
+    assert sorted(recorder.ids) == expected
+    assert all(data['double'] == data['_id'] * 2 for data in datas)
+
+
+def test_pipeline_rejects_incremental_mode():
+    with pytest.raises(ValueError):
+        MongoSync().add_func(Recorder().mongo_func, 'db', 'col', pipeline=[], incremental=True)